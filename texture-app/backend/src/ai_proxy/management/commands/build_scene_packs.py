@@ -0,0 +1,91 @@
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...services.image_service import ImageGenerationParameters, ImageGenerationService
+from ...services.reveal import SceneMasks
+from ...services.riddle_service import RiddleService
+from ...services.scene_pack import ScenePack, ScenePacks, write_scene_pack
+from ...services.segmentation_cache import image_key
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class Command(BaseCommand):
+    help = (
+        "Segment a directory of scene images, extract their masks and write their riddles "
+        "into scene packs that the proxy serves without the GPU backends or the LLM"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", help="Directory of scene images")
+        parser.add_argument("--out", default=os.environ.get("SCENE_PACK_DIR"),
+                            help="Where to write the packs, SCENE_PACK_DIR by default")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Scenes processed at the same time (segmentation and LLM calls in flight)")
+        parser.add_argument("--no-riddles", action="store_true", help="Only segment, riddles are left to the game")
+        parser.add_argument("--force", action="store_true", help="Rebuild scenes that already have a current pack")
+        parser.add_argument("--multipart", action="store_true",
+                            help="Upload the images as multipart files instead of Base64 JSON, "
+                                 "for segmentation servers that accept them")
+
+    def handle(self, *args, **options):
+        if not options["out"]:
+            raise CommandError("Give the pack directory with --out or SCENE_PACK_DIR")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        if not os.path.isdir(options["images"]):
+            raise CommandError(f"{options['images']} is not a directory")
+        paths = sorted(
+            os.path.join(options["images"], name) for name in os.listdir(options["images"])
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+        # Packs are never answered from packs, but the segmentation cache still saves repeated runs
+        self.image_service = ImageGenerationService(packs=ScenePacks(None), masks=SceneMasks(max_bytes=0))
+        self.riddle_service = None if options["no_riddles"] else RiddleService()
+        self.multipart = options["multipart"]
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {pool.submit(self.build, path, options["out"], options["force"]): path for path in paths}
+            for future in as_completed(futures):
+                name = os.path.basename(futures[future])
+                try:
+                    self.stdout.write(f"{name}: {future.result()}")
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Error building the scene pack of {name}: {str(e)}")
+                    self.stderr.write(f"{name}: failed, {str(e)}")
+
+        self.stdout.write(f"{len(paths) - failed} of {len(paths)} scenes packed in {options['out']}")
+        if failed:
+            raise CommandError(f"{failed} scenes failed")
+
+    def build(self, path: str, out: str, force: bool) -> str:
+        """Write the pack of one image, unless it has a current one"""
+        with open(path, "rb") as f:
+            image = f.read()
+        key = image_key(image)
+        if key is None:
+            raise ValueError("not an image")
+
+        pack_path = ScenePacks.path_of(out, key)
+        if os.path.exists(pack_path) and not force:
+            try:
+                ScenePack(pack_path).close()
+                return "up to date"
+            except ValueError as e:
+                logger.info(f"Rebuilding {pack_path}: {str(e)}")
+
+        body = image if self.multipart else base64.b64encode(image).decode()
+        result = self.image_service.generate_image(ImageGenerationParameters(image=body))
+        objects = list(result.get("class_mask_pairs") or {})
+        riddles = self.riddle_service.generate(objects) if self.riddle_service is not None and objects else {}
+        size = write_scene_pack(pack_path, key, result, riddles, source=os.path.basename(path))
+        return f"{len(objects)} objects, {len(riddles)} riddles, {size} bytes"
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_proxy', '0003_conversation_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-updated_at', '-id'], name='ai_proxy_conv_updated_idx'),
+        ),
+    ]
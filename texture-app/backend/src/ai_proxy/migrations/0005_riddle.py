@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_proxy', '0004_conversation_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Riddle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_name', models.CharField(max_length=255)),
+                ('riddle', models.TextField()),
+                ('hints', models.JSONField(default=list)),
+                ('hints_served', models.PositiveSmallIntegerField(default=0)),
+                ('served_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='riddles', to='ai_proxy.conversation')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['conversation', 'served_at'], name='ai_proxy_riddle_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_proxy', '0005_riddle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='reveal_scene',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='revealed_objects',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -11,6 +11,18 @@ class Conversation(models.Model):
     title = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Bumped with every write to the messages, processes compare it against their cached copy
+    version = models.PositiveIntegerField(default=0)
+    # Scene being played (its pixel hash) and the objects found in it, in the order they were found.
+    # Reveal deltas and their versions are derived from these, so every process hands out the same ones.
+    reveal_scene = models.CharField(max_length=64, blank=True, default="")
+    revealed_objects = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            # The conversation list pages through conversations newest first, keyed on (updated_at, id)
+            models.Index(fields=['-updated_at', '-id'], name='ai_proxy_conv_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Conversation {self.id}: {self.title or 'Untitled'}"
@@ -29,6 +41,31 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # History reads and trimming filter on the conversation and order by time
+            models.Index(fields=['conversation', 'timestamp'], name='ai_proxy_msg_conv_time_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.role}: {self.content[:30]}..."
\ No newline at end of file
+        return f"{self.role}: {self.content[:30]}..."
+
+class Riddle(models.Model):
+    """A riddle about one object of a conversation's scene, generated ahead of time and served in order"""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='riddles')
+    object_name = models.CharField(max_length=255)
+    riddle = models.TextField()
+    hints = models.JSONField(default=list)
+    # How many of the hints have been given, they are given in order
+    hints_served = models.PositiveSmallIntegerField(default=0)
+    # When the riddle was given, None while it is still queued
+    served_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['conversation', 'served_at'], name='ai_proxy_riddle_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Riddle about {self.object_name}: {self.riddle[:30]}..."
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import threading
+from functools import partial
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connections to the backends per event loop, the in-flight backend calls of one ASGI process share them
+MAX_CONNECTIONS = int(os.environ.get('AI_PROXY_MAX_CONNECTIONS', '512'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('AI_PROXY_MAX_KEEPALIVE_CONNECTIONS', '64'))
+
+_lock = threading.Lock()
+_clients: Dict[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, AsyncGenerator[None, None]]] = {}
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The shared httpx.AsyncClient of the running event loop
+
+    Under ASGI one loop serves every request, so all async views share one
+    keep-alive connection pool. Async views served by WSGI and asyncio.run()
+    callers run on a fresh loop per request and get a fresh client each time,
+    which is closed when its loop shuts down (see close_with_loop).
+
+    Callers pass their own timeout per request, the client's default is 80s
+    like the blocking services.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        # Loops closed without shutting down their async generators can't close their clients any more
+        for stale in [other for other in _clients if other.is_closed()]:
+            del _clients[stale]
+        client, _ = _clients.get(loop, (None, None))
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+                timeout=httpx.Timeout(80.0, connect=10.0),
+                verify=False,  # like the blocking services, the backends use self-signed certificates
+            )
+            _clients[loop] = (client, close_with_loop(partial(_forget_and_close, loop, client)))
+        return client
+
+
+async def aclose_async_client() -> None:
+    """Close the running loop's shared client, for shutdown hooks and tests"""
+    with _lock:
+        client, _ = _clients.pop(asyncio.get_running_loop(), (None, None))
+    if client is not None:
+        await client.aclose()
+
+
+def close_with_loop(aclose: Callable[[], Awaitable[None]]) -> AsyncGenerator[None, None]:
+    """An async generator, started on the running loop, that awaits aclose() when the loop finalizes it
+
+    asyncio.run() and asgiref's async_to_sync call loop.shutdown_asyncgens()
+    before closing their loop, which closes the generators started on it while
+    the loop can still run aclose(). Callers keep the generator referenced (next
+    to what it closes) so it isn't finalized earlier.
+    """
+    async def closer():
+        try:
+            yield
+        finally:
+            await aclose()
+
+    generator = closer()
+    # Run it to its yield without awaiting: this registers it with the running loop
+    try:
+        generator.asend(None).send(None)
+    except StopIteration:
+        pass
+    return generator
+
+
+async def _forget_and_close(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
+    with _lock:
+        if _clients.get(loop, (None,))[0] is client:
+            del _clients[loop]
+    await client.aclose()
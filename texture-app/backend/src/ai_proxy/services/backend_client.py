@@ -0,0 +1,431 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from websockets.exceptions import WebSocketException
+
+from .async_http import get_async_client
+
+logger = logging.getLogger(__name__)
+
+
+class BackendUnavailable(Exception):
+    """Raised without calling the backend while its circuit breaker is open"""
+
+
+class BackendBusy(BackendUnavailable):
+    """Raised when a backend already has max_in_flight calls and none finished within queue_timeout"""
+
+
+# Errors that say the backend is down or overloaded, as opposed to a bad request
+BACKEND_FAILURES = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httpx.TransportError,
+    WebSocketException,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitBreaker:
+    """Stops calling a backend after repeated failures, then lets one trial call through
+
+    closed: calls go through, ``failure_threshold`` consecutive failures open the circuit
+    open: calls fail fast with BackendUnavailable for ``reset_timeout`` seconds
+    half_open: one trial call goes through, its success closes the circuit and its failure reopens it
+
+    Args:
+        failure_threshold: Consecutive failures that open the circuit
+        reset_timeout: Seconds the circuit stays open before a trial call
+        clock: Time source
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self, name: str = "backend") -> None:
+        """Raises BackendUnavailable if the call must not go through"""
+        with self._lock:
+            if self.state == "open":
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    raise BackendUnavailable(f"{name} is unavailable, retrying in "
+                                             f"{self.reset_timeout - (self.clock() - self.opened_at):.0f}s")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._trial_running:
+                    raise BackendUnavailable(f"{name} is unavailable, a trial call is running")
+                self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Circuit closed again after a successful trial call")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = self.clock()
+
+    def release(self) -> None:
+        """End a call that neither succeeded nor failed the backend (e.g. a 4xx or a cancellation)"""
+        with self._lock:
+            self._trial_running = False
+
+
+class BackendStats:
+    """Call counts and latency percentiles of one backend over a recent window"""
+
+    def __init__(self, window: int = 256):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def started(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+
+    def finished(self, latency: float, error: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.errors += error
+            self._latencies.append(latency)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "mean_s": sum(ordered) / len(ordered) if ordered else 0.0,
+                "p50_s": _percentile(ordered, 50),
+                "p95_s": _percentile(ordered, 95),
+            }
+
+
+class _Waiter:
+    """A caller waiting for a slot: a thread (``loop`` is None) or a coroutine on ``loop``"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop is not None else None
+
+
+class Slots:
+    """A process-wide bounded semaphore that threads and coroutines on any event loop wait on together
+
+    Waiters are served in arrival order and a released slot is handed straight
+    to the first one. Blocking callers wait on an Event, coroutines on a Future
+    of their own loop that release() resolves through call_soon_threadsafe, so
+    no waiter holds a thread while it waits.
+    """
+
+    def __init__(self, value: int):
+        self.value = value
+        self.max_value = value
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a slot, blocking up to ``timeout`` seconds. Returns whether a slot was taken."""
+        with self._lock:
+            if self._take():
+                return True
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return False
+        return True
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        """acquire() for coroutines, waits on the running loop without blocking it"""
+        with self._lock:
+            if self._take():
+                return True
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter.future], timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if waiter.future.done():
+            return True
+        self._abandon(waiter)
+        return False
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.loop is None:
+                    waiter.event.set()
+                    return
+                try:
+                    waiter.loop.call_soon_threadsafe(self._grant, waiter.future)
+                    return
+                except RuntimeError:
+                    continue  # its loop is closed, nobody awaits the future any more
+            if self.value >= self.max_value:
+                raise ValueError("Slots released too many times")
+            self.value += 1
+
+    def _take(self) -> bool:
+        """Take a free slot unless others are already waiting for one, under _lock"""
+        if self.value > 0 and not self._waiters:
+            self.value -= 1
+            return True
+        return False
+
+    def _grant(self, future: asyncio.Future) -> None:
+        """Hand a released slot to a coroutine, on its loop. Abandoned waiters hand it on."""
+        if future.done():
+            self.release()
+        else:
+            future.set_result(True)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Stop waiting, giving back the slot if it was handed over meanwhile"""
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                waiter.future.cancel()
+                return
+        if waiter.future.done():
+            self.release()
+        else:
+            # The grant is scheduled on this loop and will find the future done
+            waiter.future.cancel()
+
+
+class Call:
+    """One call in progress, set ``failed`` when the backend answered but is not healthy (e.g. a 5xx)"""
+    failed = False
+
+
+class BackendClient:
+    """Pooled, bounded and circuit-broken access to one GPU backend
+
+    Blocking calls share a keep-alive requests.Session, async calls the event
+    loop's shared httpx.AsyncClient. At most ``max_in_flight`` calls run at
+    once in the process, blocking and async ones together and whatever event
+    loop they run on; callers beyond that wait up to ``queue_timeout``
+    seconds, then get BackendBusy. While the circuit is open calls fail at
+    once instead of waiting for a slot. Connection errors, timeouts and 5xx
+    answers count as failures for the circuit breaker; 5xx answers are still
+    returned to the caller.
+
+    Args:
+        name: Backend name in logs and stats
+        base_url: URL the request paths are relative to
+        max_in_flight: Concurrent calls allowed
+        queue_timeout: Seconds a call waits for a free slot
+        failure_threshold: Consecutive failures that open the circuit
+        reset_timeout: Seconds before a trial call once the circuit is open
+    """
+
+    def __init__(self, name: str, base_url: str, max_in_flight: int = 16, queue_timeout: float = 30.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = BackendStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = Slots(max_in_flight)
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    @contextlib.contextmanager
+    def call(self) -> Iterator["Call"]:
+        """Slot, breaker and stats around a blocking call to the backend
+
+        Exceptions in BACKEND_FAILURES count as backend failures, so does setting ``failed`` on the yielded Call.
+        """
+        self._before_call()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._busy()
+        try:
+            with self._tracked() as call:
+                yield call
+        finally:
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def acall(self) -> AsyncIterator["Call"]:
+        """call() for coroutines, waiting for a slot on the event loop instead of blocking it"""
+        self._before_call()
+        try:
+            acquired = await self._slots.acquire_async(self.queue_timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        if not acquired:
+            self._busy()
+        try:
+            with self._tracked() as call:
+                yield call
+        finally:
+            self._slots.release()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Blocking request on the pooled session. Raises BackendUnavailable/BackendBusy without calling."""
+        kwargs.setdefault("verify", False)
+        with self.call() as call:
+            response = self.session.request(method, self.url(path), **kwargs)
+            call.failed = response.status_code >= 500
+            return response
+
+    @contextlib.contextmanager
+    def stream(self, method: str, path: str, **kwargs) -> Iterator[requests.Response]:
+        """Streaming request, the slot is held until the response has been read"""
+        kwargs.setdefault("verify", False)
+        with self.call() as call:
+            with self.session.request(method, self.url(path), stream=True, **kwargs) as response:
+                call.failed = response.status_code >= 500
+                yield response
+
+    async def arequest(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Async request on the event loop's shared client. Raises BackendUnavailable/BackendBusy without calling."""
+        async with self.acall() as call:
+            response = await get_async_client().request(method, self.url(path), **kwargs)
+            call.failed = response.status_code >= 500
+            return response
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.base_url,
+            "max_in_flight": self.max_in_flight,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            **self.stats.as_dict(),
+        }
+
+    def _before_call(self) -> None:
+        try:
+            self.breaker.before_call(self.name)
+        except BackendUnavailable:
+            self._reject()
+            raise
+
+    def _busy(self) -> None:
+        """Give up a call that got no slot in time: let the breaker's trial call go and raise BackendBusy"""
+        self.breaker.release()
+        self._reject()
+        raise BackendBusy(f"{self.name} already has {self.max_in_flight} calls in flight")
+
+    @contextlib.contextmanager
+    def _tracked(self) -> Iterator["Call"]:
+        """Breaker outcome and stats of a call that has passed the breaker and holds a slot"""
+        self.stats.started()
+        start = time.perf_counter()
+        call = Call()
+        error = False
+        try:
+            yield call
+        except BACKEND_FAILURES:
+            call.failed = True
+            raise
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.stats.finished(time.perf_counter() - start, error or call.failed)
+            if call.failed:
+                self.breaker.record_failure()
+                if self.breaker.state == "open":
+                    logger.warning(f"{self.name} circuit is open after {self.breaker.failures} failures")
+            elif error:
+                self.breaker.release()
+            else:
+                self.breaker.record_success()
+
+    def _reject(self) -> None:
+        with self.stats._lock:
+            self.stats.rejected += 1
+
+
+# Concurrent calls each backend accepts unless <NAME>_MAX_IN_FLIGHT says otherwise
+DEFAULT_MAX_IN_FLIGHT = {"llm": 16, "image": 8, "comfyui": 8}
+
+_backends: Dict[Tuple[str, str], BackendClient] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str, base_url: str) -> BackendClient:
+    """The process-wide client of a backend, created on first use
+
+    Limits come from <NAME>_MAX_IN_FLIGHT, <NAME>_QUEUE_TIMEOUT,
+    <NAME>_FAILURE_THRESHOLD and <NAME>_RESET_TIMEOUT, e.g. LLM_MAX_IN_FLIGHT.
+    """
+    key = (name, base_url.rstrip("/"))
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            prefix = name.upper()
+            backend = BackendClient(
+                name,
+                base_url,
+                max_in_flight=int(os.environ.get(f"{prefix}_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT.get(name, 16))),
+                queue_timeout=float(os.environ.get(f"{prefix}_QUEUE_TIMEOUT", "30")),
+                failure_threshold=int(os.environ.get(f"{prefix}_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.environ.get(f"{prefix}_RESET_TIMEOUT", "30")),
+            )
+            _backends[key] = backend
+        return backend
+
+
+def backend_stats() -> Dict[str, Any]:
+    """Stats of every backend used so far, keyed by name (name@url when one name has several URLs)"""
+    with _backends_lock:
+        backends = list(_backends.values())
+    names = [backend.name for backend in backends]
+    return {
+        backend.name if names.count(backend.name) == 1 else f"{backend.name}@{backend.base_url}": backend.as_dict()
+        for backend in backends
+    }
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Proxy CPU time per chat turn spent encoding the LLM request and decoding its answer.
+
+Replays what LLMService and ChatBOT do with the bytes of one /generate_answer
+round trip, without the network, for --turns turns:
+
+  legacy:   json= request body, json.loads of the answer, json.dumps(indent=2)
+            for the INFO log and again for the return value, json.loads of that
+            string in ChatBOT and a dig through received_data
+  json:     the typed path, compact JSON through the standard library
+  orjson:   the typed path, compact JSON through orjson (if installed)
+  msgpack:  the typed path, MessagePack answers (if installed)
+
+    python benchmark_llm_response.py
+    python benchmark_llm_response.py --turns 20000 --history 20 --answer-chars 2000
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from src.ai_proxy.services import wire
+from src.ai_proxy.services.llm_service import LLMService, Message
+
+logger = logging.getLogger("benchmark")
+
+
+def make_turn(history, answer_chars):
+    messages = [Message(role="system", content="You are the riddle master of a guessing game. " * 8)]
+    for i in range(history):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append(Message(role=role, content=f"Is it the chair next to the window, number {i}? " * 3))
+    payload = {"messages": [{"role": m.role, "content": m.content} for m in messages], "conversation_id": "42"}
+    answer = ("It has four legs and you sit on it, but it is not a chair. " * 64)[:answer_chars]
+    return payload, {"status": "success", "message": "Received JSON data", "received_data": {"answer": answer}}
+
+
+def legacy_turn(payload, body):
+    """The proxy before the typed response: parse, pretty-print twice, parse again"""
+    json.dumps(payload)
+    result = json.loads(body.decode("utf-8"))
+    logger.info(f"Response: {json.dumps(result, indent=2)}")
+    response = json.loads(json.dumps(result, indent=2))
+    return response.get("received_data", {}).get("answer", "")
+
+
+def typed_turn(service, payload, body, content_type):
+    wire.dumps_json(payload)
+    return service._completion_result(200, body, content_type).answer
+
+
+def cpu_per_turn(fn, turns):
+    fn()
+    start = time.process_time()
+    for _ in range(turns):
+        fn()
+    return (time.process_time() - start) / turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy CPU time per chat turn on the LLM response path")
+    parser.add_argument("--turns", type=int, default=5000)
+    parser.add_argument("--history", type=int, default=20, help="Messages sent to the LLM per turn")
+    parser.add_argument("--answer-chars", type=int, default=1500, help="Length of the LLM answer")
+    args = parser.parse_args()
+
+    # INFO is what the proxy logs at in production, to a handler that discards the output
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    service = LLMService()
+    payload, answer = make_turn(args.history, args.answer_chars)
+    orjson = wire.orjson
+
+    results = {}
+    body = json.dumps(answer).encode("utf-8")
+    results["legacy"] = cpu_per_turn(lambda: legacy_turn(payload, body), args.turns)
+
+    wire.orjson = None
+    results["json"] = cpu_per_turn(lambda: typed_turn(service, payload, body, wire.JSON), args.turns)
+    wire.orjson = orjson
+    if orjson is not None:
+        body = orjson.dumps(answer)
+        results["orjson"] = cpu_per_turn(lambda: typed_turn(service, payload, body, wire.JSON), args.turns)
+    if wire.msgpack is not None:
+        body = wire.msgpack.packb(answer)
+        results["msgpack"] = cpu_per_turn(lambda: typed_turn(service, payload, body, wire.MSGPACK), args.turns)
+
+    print(f"{args.turns} turns, {args.history + 1} messages sent, {args.answer_chars} character answers")
+    for name, seconds in results.items():
+        print(f"{name:>8}: {seconds * 1e6:8.1f} us CPU per turn, {results['legacy'] / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Bytes sent and proxy CPU time per correct guess, for the ways of showing what it uncovered.
+
+Plays a synthetic scene of --objects objects, revealing them one guess at a
+time, --games times over:
+
+  image:    the partially hidden image re-composited and sent as a Base64 PNG
+  mask:     the whole reveal mask sent as a Base64 PNG
+  delta:    RevealCompositor's RevealDelta as JSON, run lengths of the new pixels
+
+    python benchmark_reveal.py
+    python benchmark_reveal.py --width 1920 --height 1080 --objects 8
+"""
+
+import argparse
+import base64
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from src.ai_proxy.services import wire
+from src.ai_proxy.services.bitmask import BitMask
+from src.ai_proxy.services.reveal import RevealCompositor, SceneMasks
+
+
+def make_scene(width, height, objects, seed=0):
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    image = np.stack([xs * 255 // width, ys * 255 // height, (xs + ys) * 127 // (width + height)], axis=-1)
+    image = (image + rng.integers(0, 24, image.shape)).clip(0, 255).astype(np.uint8)
+    masks = {}
+    for i in range(objects):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        rx, ry = rng.integers(width // 20, width // 6), rng.integers(height // 20, height // 6)
+        masks[f"object {i}"] = ((xs - cx) / rx) ** 2 + ((ys - cy) / ry) ** 2 <= 1
+    return image, masks
+
+
+def png_base64(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue())
+
+
+def play(reveal, names, games):
+    """Bytes and CPU seconds per reveal"""
+    sent, start = 0, time.process_time()
+    for game in range(games):
+        revealed = []
+        for name in names:
+            revealed.append(name)
+            sent += len(reveal(game, revealed))
+    reveals = games * len(names)
+    return sent / reveals, (time.process_time() - start) / reveals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes and proxy CPU time per reveal")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--objects", type=int, default=6)
+    parser.add_argument("--games", type=int, default=5)
+    args = parser.parse_args()
+
+    image, arrays = make_scene(args.width, args.height, args.objects)
+    names = list(arrays)
+    hidden = np.full_like(image, 128)
+
+    def full_image(game, revealed):
+        union = np.logical_or.reduce([arrays[name] for name in revealed])
+        return png_base64(np.where(union[..., None], image, hidden))
+
+    def full_mask(game, revealed):
+        union = np.logical_or.reduce([arrays[name] for name in revealed])
+        return png_base64(union.astype(np.uint8) * 255)
+
+    masks = SceneMasks()
+    masks.put("scene", {name: BitMask.from_array(array) for name, array in arrays.items()})
+    compositor = RevealCompositor(masks)
+
+    def delta(game, revealed):
+        return wire.dumps_json(compositor.reveal(game, "scene", revealed[-1:]).as_dict())
+
+    results = {name: play(fn, names, args.games) for name, fn in
+               [("image", full_image), ("mask", full_mask), ("delta", delta)]}
+
+    print(f"{args.width}x{args.height} scene, {args.objects} objects, {args.games} games")
+    for name, (sent, seconds) in results.items():
+        print(f"{name:>6}: {sent / 1024:9.1f} KiB sent, {seconds * 1e3:7.2f} ms CPU per reveal, "
+              f"{results['image'][0] / sent:6.1f}x fewer bytes than image")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Per-pose cost of preparing the character.json workflow.
+
+Compares re-reading and parsing the file for every pose (the old
+ComfyUIAPI.get_workflow), deep-copying a parsed workflow, and rendering the
+cached WorkflowTemplate, including the JSON encoding for the /prompt request.
+
+    python benchmark_workflow.py
+"""
+
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.comfy_service import SLOTS, ComfyUIAPI, Parameters
+from services.workflow_templates import workflow_templates
+
+PARAMETERS = Parameters(positive_prompt="a knight, plain background", negative_prompt="blurry", reference_img="pose2.jpg")
+
+
+def reload_file(path):
+    with open(path, "r") as f:
+        workflow = json.load(f)
+    workflow["7"]["inputs"]["text"] = PARAMETERS.positive_prompt
+    workflow["9"]["inputs"]["text"] = PARAMETERS.negative_prompt
+    workflow["10"]["inputs"]["image"] = PARAMETERS.reference_img
+    return workflow
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark workflow preparation per pose")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    api = ComfyUIAPI()
+    parsed = reload_file(api.workflow_path)
+    workflow_templates.get(api.workflow_path, SLOTS)  # warm-up load
+
+    def deep_copy():
+        workflow = copy.deepcopy(parsed)
+        workflow["7"]["inputs"]["text"] = PARAMETERS.positive_prompt
+        workflow["9"]["inputs"]["text"] = PARAMETERS.negative_prompt
+        workflow["10"]["inputs"]["image"] = PARAMETERS.reference_img
+        return workflow
+
+    variants = {
+        "reload file": lambda: reload_file(api.workflow_path),
+        "deepcopy": deep_copy,
+        "template": lambda: api.get_workflow(PARAMETERS),
+    }
+
+    print(f"{'variant':<12} {'prepare us':>11} {'+ encode us':>12}")
+    for name, prepare in variants.items():
+        assert prepare() == parsed
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            prepare()
+        prepare_time = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            json.dumps({"prompt": prepare()})
+        total_time = (time.perf_counter() - start) / args.repeat
+        print(f"{name:<12} {prepare_time * 1e6:>11.1f} {total_time * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
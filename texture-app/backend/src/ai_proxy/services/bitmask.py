@@ -0,0 +1,146 @@
+import base64
+import binascii
+import io
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+# Set bits of every byte value, for counting the pixels of a mask without unpacking it
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+BBox = Tuple[int, int, int, int]
+
+
+def decode_mask(mask: Union[str, bytes]) -> Optional[np.ndarray]:
+    """Boolean array of a Base64, data URL or raw encoded mask image (white is the object), None if it isn't one"""
+    try:
+        if isinstance(mask, str):
+            mask = base64.b64decode(mask.split(",", 1)[-1] if mask.startswith("data:") else mask, validate=True)
+        with Image.open(io.BytesIO(mask)) as image:
+            return np.asarray(image.convert("L")) > 127
+    except (binascii.Error, ValueError, OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return None
+
+
+class BitMask:
+    """A binary mask stored as packed bits, 8 pixels per byte in row-major order
+
+    A 1024x768 mask takes 96 KiB instead of 768 KiB as a boolean array, and
+    unions, intersections and differences are NumPy operations on the bytes.
+    Masks are immutable: operations return new masks.
+
+    Args:
+        width: Width in pixels
+        height: Height in pixels
+        bits: np.packbits of the flattened mask, the padding bits of the last byte zero
+    """
+
+    __slots__ = ("width", "height", "bits")
+
+    def __init__(self, width: int, height: int, bits: np.ndarray):
+        if bits.dtype != np.uint8 or bits.shape != ((width * height + 7) // 8,):
+            raise ValueError(f"{bits.shape[0]} bytes of bits for a {width}x{height} mask")
+        self.width = width
+        self.height = height
+        self.bits = bits
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "BitMask":
+        """Mask of a (height, width) array, non-zero pixels are set"""
+        height, width = array.shape
+        return cls(width, height, np.packbits(np.asarray(array, dtype=bool), axis=None))
+
+    @classmethod
+    def empty(cls, width: int, height: int) -> "BitMask":
+        return cls(width, height, np.zeros((width * height + 7) // 8, dtype=np.uint8))
+
+    @classmethod
+    def from_image(cls, mask: Union[str, bytes]) -> Optional["BitMask"]:
+        """Mask of a Base64, data URL or raw encoded image, None if it isn't one"""
+        array = decode_mask(mask)
+        return cls.from_array(array) if array is not None else None
+
+    @classmethod
+    def from_rle(cls, width: int, height: int, counts: Sequence[int]) -> "BitMask":
+        """Mask of to_rle() counts. Raises ValueError if they don't add up to the mask's size."""
+        counts = np.asarray(counts, dtype=np.int64)
+        if counts.sum() != width * height or (counts < 0).any():
+            raise ValueError(f"Run lengths add up to {int(counts.sum())}, not {width}x{height}")
+        values = np.arange(len(counts)) % 2 == 1
+        return cls(width, height, np.packbits(np.repeat(values, counts)))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def to_array(self) -> np.ndarray:
+        """Boolean (height, width) array"""
+        return np.unpackbits(self.bits, count=self.width * self.height).reshape(self.height, self.width).astype(bool)
+
+    def to_rle(self) -> List[int]:
+        """Run lengths of the row-major pixels, alternating unset and set runs, starting with an unset one (maybe 0)"""
+        flat = np.unpackbits(self.bits, count=self.width * self.height)
+        if not flat.size:
+            return [0]
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        counts = np.diff(np.concatenate(([0], changes, [flat.size]))).tolist()
+        return [0] + counts if flat[0] else counts
+
+    def to_png(self) -> str:
+        """Base64 PNG of the mask, a 1 bit image"""
+        buffer = io.BytesIO()
+        Image.fromarray(self.to_array()).convert("1").save(buffer, "PNG")
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def count(self) -> int:
+        """Number of set pixels"""
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def any(self) -> bool:
+        return bool(self.bits.any())
+
+    def bbox(self) -> Optional[BBox]:
+        """(left, top, right, bottom) of the set pixels, right and bottom exclusive, None for an empty mask"""
+        if not self.any():
+            return None
+        array = self.to_array()
+        rows, cols = np.flatnonzero(array.any(axis=1)), np.flatnonzero(array.any(axis=0))
+        return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+    def crop(self, bbox: BBox) -> "BitMask":
+        left, top, right, bottom = bbox
+        return BitMask.from_array(self.to_array()[top:bottom, left:right])
+
+    def as_rle_dict(self, bbox: Optional[BBox] = None) -> Dict[str, object]:
+        """{"size": [width, height], "bbox", "counts"}: the RLE of the mask, or only of its bbox region"""
+        region = self.crop(bbox) if bbox is not None else self
+        return {"size": [self.width, self.height], "bbox": list(bbox) if bbox is not None else None,
+                "counts": region.to_rle()}
+
+    def _check(self, other: "BitMask") -> None:
+        if self.shape != other.shape:
+            raise ValueError(f"Masks of {self.width}x{self.height} and {other.width}x{other.height} pixels")
+
+    def __or__(self, other: "BitMask") -> "BitMask":
+        self._check(other)
+        return BitMask(self.width, self.height, self.bits | other.bits)
+
+    def __and__(self, other: "BitMask") -> "BitMask":
+        self._check(other)
+        return BitMask(self.width, self.height, self.bits & other.bits)
+
+    def __sub__(self, other: "BitMask") -> "BitMask":
+        """Pixels set in this mask and not in the other"""
+        self._check(other)
+        return BitMask(self.width, self.height, self.bits & ~other.bits)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, BitMask) and self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+    def __repr__(self) -> str:
+        return f"BitMask({self.width}x{self.height}, {self.count()} set)"
@@ -1,7 +1,6 @@
 import os
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Iterator, Tuple
 import logging
-import json
 # Handle imports differently when running as a module vs directly
 
 ## Was it for testing!
@@ -24,13 +23,29 @@ import json
 #     from .llm_service import LLMService, Message as LLMMessage
 #     from ..models import Conversation, Message as DBMessage
 
-from .llm_service import LLMService, Message as LLMMessage
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .conversation_cache import ConversationCache
+from .guess_matcher import GuessMatchers, parse_objects
+from .llm_service import LLMResponse, LLMService, Message as LLMMessage
+from .riddle_service import RiddleService, riddle_intent
 from ..models import Conversation, Message as DBMessage
 
 
 
 logger = logging.getLogger(__name__)
 
+# Live conversations of this process, shared by the ChatBOT instances built per request
+conversation_cache = ConversationCache(max_entries=int(os.environ.get('CHATBOT_CACHE_SIZE', '256')))
+
+# Guess matchers of the scenes being played, guesses they confirm never reach the LLM
+guess_matchers = GuessMatchers()
+LOCAL_GUESSES = os.environ.get('CHATBOT_LOCAL_GUESSES', '1') != '0'
+CORRECT_GUESS_REPLY = os.environ.get('CHATBOT_CORRECT_GUESS_REPLY', 'Congratulations! You found the {object}!')
+
 
 class ChatBOT:
     """Chatbot implementation using LLM service with database persistence"""
@@ -40,71 +55,116 @@ class ChatBOT:
       llm_service: Optional[LLMService] = None):
         self.llm_service = llm_service or LLMService()
         self.max_history_length = int(os.environ.get('CHATBOT_MAX_HISTORY', '20'))
+        # Objects the last response revealed, for the client to uncover
+        self.revealed: List[str] = []
         
-        # Get or create conversation
-        if conversation_id:
-            try:
-                self.conversation = Conversation.objects.get(id=conversation_id)
-            except Conversation.DoesNotExist:
-                logger.warning(f"Conversation with id {conversation_id} not found, creating new conversation")
-                self.conversation = Conversation.objects.create()
-        else:
-            self.conversation = Conversation.objects.create()
+        # Get or create conversation, known conversations come from the cache
+        self.state = conversation_cache.get(conversation_id) if conversation_id else None
+        if self.state is None and conversation_id:
+            logger.warning(f"Conversation with id {conversation_id} not found, creating new conversation")
+            self.state = conversation_cache.add(Conversation.objects.create(), [])
+        elif self.state is None:
+            conversation = Conversation.objects.create()
             
             # Add initial system message if provided
             system_prompt = os.environ.get('CHATBOT_SYSTEM_PROMPT')
             if system_prompt:
-                DBMessage.objects.create(
-                    conversation=self.conversation,
+                message = DBMessage.objects.create(
+                    conversation=conversation,
                     role="system",
                     content=system_prompt
                 )
+                self.state = conversation_cache.add(
+                    conversation, [{"id": message.id, "role": "system", "content": system_prompt}])
             else:
                 raise ValueError("CHATBOT_SYSTEM_PROMPT environment variable is not set")
+        self.conversation = self.state.conversation
     
     def add_message(self, role: str, content: str) -> None:
-        """Add a message to the conversation history
+        """Add a message to the conversation history and write it to the database
         
         Args:
             role: The role of the message sender ('user' or 'assistant')
             content: The content of the message
         """
+        self._append(role, content)
+        self.flush()
+
+    def _append(self, role: str, content: str) -> None:
+        """Add a message to the in-memory history, the next flush() writes it"""
         # Validate role
         if role not in ["system", "user", "assistant"]:
             raise ValueError(f"Invalid role: {role}. Must be 'system', 'user', or 'assistant'")
         
         # Safely extract object details if present
-        object_details = None
         if "$" in content:
             parts = content.split("$")
             if len(parts) > 1:
-                object_details = parts[1]
                 content = parts[0]  # Update content to only include the message part
 
+        message = {"id": None, "role": role, "content": content}
+        with self.state.lock:
+            self.state.messages.append(message)
+            self.state.pending.append(message)
+            self.state.messages = self._trimmed(self.state.messages)
 
-        # Add message to database
-        DBMessage.objects.create(
-            conversation=self.conversation,
-            role=role,
-            content=content
-        )
-        
-        # Trim history if it exceeds max length
-        messages = self.conversation.messages.all()
-        if messages.count() > self.max_history_length:
-            # Keep system message if it exists
-            system_messages = messages.filter(role="system")
-
-            print(system_messages)
-            if system_messages.exists():
-                # Delete all but system messages and the most recent messages
-                to_keep = list(system_messages.values_list('id', flat=True))
-                to_keep.extend(list(messages.exclude(role="system").order_by('-timestamp')[:self.max_history_length-system_messages.count()].values_list('id', flat=True)))
-                messages.exclude(id__in=to_keep).delete()
+    def flush(self) -> None:
+        """Write the pending messages in one transaction: version bump, one INSERT and one trimming DELETE"""
+        state = self.state
+        with state.lock:
+            pending, state.pending = state.pending, []
+            if not pending:
+                return
+            try:
+                with transaction.atomic():
+                    conversations = Conversation.objects.filter(id=self.conversation.id)
+                    bumped = conversations.filter(version=state.version).update(
+                        version=F('version') + 1, updated_at=timezone.now())
+                    if not bumped:
+                        conversations.update(version=F('version') + 1, updated_at=timezone.now())
+                    created = DBMessage.objects.bulk_create([
+                        DBMessage(conversation=self.conversation, role=message["role"], content=message["content"])
+                        for message in pending
+                    ])
+                    self._trim_history()
+            except Exception:
+                conversation_cache.discard(self.conversation.id)
+                raise
+            # Ids are the cursors of get_history_since(), databases that can't return them make us reload
+            for message, row in zip(pending, created):
+                message["id"] = row.pk
+            if bumped and all(row.pk is not None for row in created):
+                state.version += 1
             else:
-                # Just keep the most recent messages
-                to_delete = messages.order_by('-timestamp')[self.max_history_length:]
-                to_delete.delete()
+                # Another process wrote to this conversation since it was loaded (or the ids are
+                # unknown), reload it on the next request
+                conversation_cache.discard(self.conversation.id)
+
+    def _trimmed(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """The messages _trim_history() keeps, in order"""
+        system_count = sum(1 for message in messages if message["role"] == "system")
+        drop = len(messages) - max(self.max_history_length, system_count)
+        if drop <= 0:
+            return messages
+        trimmed = []
+        for message in messages:
+            if drop > 0 and message["role"] != "system":
+                drop -= 1
+            else:
+                trimmed.append(message)
+        return trimmed
+
+    def _trim_history(self) -> None:
+        """Delete all but the newest max_history_length messages, never deleting system messages
+
+        System messages rank ahead of the others, so the newest messages kept are
+        max_history_length minus the number of system messages.
+        """
+        messages = DBMessage.objects.filter(conversation=self.conversation)
+        keep = messages.annotate(
+            is_system=Case(When(role="system", then=Value(1)), default=Value(0), output_field=IntegerField())
+        ).order_by('-is_system', '-timestamp', '-id').values('id')[:self.max_history_length]
+        messages.exclude(role="system").exclude(id__in=keep).delete()
     
     def get_history(self) -> List[Dict[str, str]]:
         """Get the conversation history in a format suitable for API responses
@@ -112,8 +172,38 @@ class ChatBOT:
         Returns:
             List of message dictionaries with 'role' and 'content' keys
         """
-        messages = self.conversation.messages.all()
-        return [{"role": msg.role, "content": msg.content} for msg in messages]
+        with self.state.lock:
+            return [{"role": message["role"], "content": message["content"]} for message in self.state.messages]
+
+    def get_history_since(self, since_id: Optional[int] = None) -> Dict[str, Any]:
+        """The messages after the one with id ``since_id``, for clients that already hold the older ones
+
+        A client passes back the cursor of its previous response and only gets
+        what was added since. If that message is gone (the history was cleared,
+        or trimmed past it) or no since_id is given, the whole history is returned.
+
+        Args:
+            since_id: Cursor of the client's previous response
+
+        Returns:
+            {"history": messages as in get_history(), "cursor": id of the newest written message,
+             "full": whether history is the whole history rather than a delta}
+        """
+        with self.state.lock:
+            messages = self.state.messages
+            ids = [message["id"] for message in messages]
+            start = ids.index(since_id) + 1 if since_id is not None and since_id in ids else 0
+            written = [message_id for message_id in ids if message_id is not None]
+            return {
+                "history": [{"role": message["role"], "content": message["content"]} for message in messages[start:]],
+                "cursor": written[-1] if written else None,
+                "full": start == 0,
+            }
+
+    @property
+    def etag(self) -> str:
+        """ETag of the conversation's history, it changes with every write to the messages"""
+        return f'"{self.conversation.id}-{self.state.version}"'
     
     def clear_history(self, keep_system_prompt: bool = True) -> None:
         """Clear the conversation history
@@ -121,13 +211,21 @@ class ChatBOT:
         Args:
             keep_system_prompt: Whether to keep the system prompt message
         """
-        messages = self.conversation.messages.all()
-        if keep_system_prompt:
-            # Delete all non-system messages
-            messages.exclude(role="system").delete()
-        else:
-            # Delete all messages
-            messages.delete()
+        state = self.state
+        with state.lock, transaction.atomic():
+            self.flush()
+            messages = self.conversation.messages.all()
+            if keep_system_prompt:
+                # Delete all non-system messages
+                messages.exclude(role="system").delete()
+                state.messages = [message for message in state.messages if message["role"] == "system"]
+            else:
+                # Delete all messages
+                messages.delete()
+                state.messages = []
+            Conversation.objects.filter(id=self.conversation.id).update(
+                version=F('version') + 1, updated_at=timezone.now())
+            state.version += 1
     
     def generate_response(self, user_message: str, temperature: Optional[float] = None) -> str:
         """Generate a response to the user message
@@ -139,67 +237,32 @@ class ChatBOT:
         Returns:
             The assistant's response text
         """
-        # Safely extract object details if present
-        
-        
-        object_details = None
-        message_content = user_message
-        
-        if "$" in user_message:
-            parts = user_message.split("$")
-            if len(parts) > 1:
-                message_content = parts[0]
-                object_details = parts[1]  # Get the objects names
+        message_content, object_details = self._split_object_details(user_message)
         print(object_details)
-        # Add user message to history
-        self.add_message("user", message_content)
+        # Add user message to history, it is written together with the answer
+        self._append("user", message_content)
    
         try:
-            # Convert DB messages to LLM messages for the API call
-            messages = []
-            for msg in self.conversation.messages.all():
-                messages.append(LLMMessage(role=msg.role, content=msg.content))
-            
+            # Requests for the queued riddles and hints, and correct guesses, are
+            # answered here without a GPU round trip
+            local_answer = self._answer_locally(message_content, object_details)
+            if local_answer is not None:
+                self._append("assistant", local_answer)
+                return local_answer
+
             # Get response from LLM service
             response = self.llm_service.create_chat_completion(
-                messages=messages,
+                messages=self._llm_messages(),
                 temperature=temperature,
-                object_details=object_details
-
+                object_details=object_details,
+                conversation_id=self.conversation.id
             )
             
-            # Extract assistant's message from response
-            # The response format from the LLM service is:
-            # {
-            #   "message": "Received JSON data",
-            #   "received_data": {
-            #     "answer": "Hello! Yes, the connection is working perfectly. How can I assist you today?"
-            #   },
-            #   "status": "success"
-            # }
-            
-            # Parse the JSON response if it's a string
-            if isinstance(response, str):
-                try:
-                    response = json.loads(response)
-                except json.JSONDecodeError:
-                    logger.warning("Failed to parse response as JSON, using as-is")
-            
-            # Extract the answer from the received_data.answer field
-            assistant_message = ""
-            if isinstance(response, dict):
-                received_data = response.get("received_data", {})
-                if isinstance(received_data, dict):
-                    assistant_message = received_data.get("answer", "")
-                
-            # Fallback to old extraction method if the new one didn't work # THIS NOT WORKING
-            if not assistant_message:
-                logger.warning("Using fallback method to extract assistant message")
-                assistant_message = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+            assistant_message = self._extract_answer(response)
             
             # Add assistant message to history
             if assistant_message:
-                self.add_message("assistant", assistant_message)
+                self._append("assistant", assistant_message)
             
             return assistant_message
         
@@ -207,6 +270,154 @@ class ChatBOT:
             logger.error(f"Error generating response: {str(e)}")
             raise
 
+        finally:
+            self.flush()
+
+    async def agenerate_response(self, user_message: str, temperature: Optional[float] = None) -> str:
+        """generate_response for async views
+
+        The LLM call is awaited on the event loop's shared connection pool, only
+        the database write at the end of the turn runs in a worker thread.
+
+        Args:
+            user_message: The user's message
+            temperature: Optional temperature override for this specific response
+
+        Returns:
+            The assistant's response text
+        """
+        message_content, object_details = self._split_object_details(user_message)
+        self._append("user", message_content)
+
+        try:
+            local_answer = await sync_to_async(self._answer_locally)(message_content, object_details)
+            if local_answer is not None:
+                self._append("assistant", local_answer)
+                return local_answer
+
+            response = await self.llm_service.acreate_chat_completion(
+                messages=self._llm_messages(),
+                temperature=temperature,
+                object_details=object_details,
+                conversation_id=self.conversation.id
+            )
+            assistant_message = self._extract_answer(response)
+            if assistant_message:
+                self._append("assistant", assistant_message)
+            return assistant_message
+
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            raise
+
+        finally:
+            await sync_to_async(self.flush)()
+
+    @staticmethod
+    def _extract_answer(response: Optional[LLMResponse]) -> str:
+        """The assistant's message in an LLM service response"""
+        if response is None:
+            raise Exception("LLM service failed to generate a response")
+        if not response.answer:
+            logger.warning("LLM service returned an empty answer")
+        return response.answer
+
+    def stream_response(self, user_message: str, temperature: Optional[float] = None) -> Iterator[str]:
+        """Generate a response to the user message, yielding text chunks as they arrive
+
+        The full answer is stored in the history once the stream is complete.
+
+        Args:
+            user_message: The user's message
+            temperature: Optional temperature override for this specific response
+
+        Yields:
+            Chunks of the assistant's response text
+        """
+        message_content, object_details = self._split_object_details(user_message)
+        self._append("user", message_content)
+
+        chunks = []
+        try:
+            local_answer = self._answer_locally(message_content, object_details)
+            if local_answer is not None:
+                stream = iter([local_answer])
+            else:
+                stream = self.llm_service.stream_chat_completion(
+                    messages=self._llm_messages(),
+                    temperature=temperature,
+                    object_details=object_details,
+                    conversation_id=self.conversation.id
+                )
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+
+            assistant_message = "".join(chunks)
+            if assistant_message:
+                self._append("assistant", assistant_message)
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            raise
+        finally:
+            # Also runs when the client disconnects and the generator is closed
+            self.flush()
+
+    def _answer_locally(self, message: str, object_details: Optional[str]) -> Optional[str]:
+        """The reply to a message that needs no LLM, None if the LLM has to answer
+
+        A message asking for a riddle or a hint is never taken for a guess, whatever
+        object it mentions. Sets self.revealed to the objects the reply reveals.
+        """
+        self.revealed = []
+        if riddle_intent(message) is not None:
+            return self._answer_from_queue(message, object_details)
+        return self._answer_guess(message, object_details)
+
+    def _answer_guess(self, message: str, object_details: Optional[str]) -> Optional[str]:
+        """The reply to a correct guess of the riddle being played, None if the LLM has to answer
+
+        Only the object of the last riddle served from the queue is confirmed
+        here. Naming another hidden object, or guessing a riddle the LLM asked
+        itself, is left to the LLM, which knows what it asked.
+        """
+        objects = parse_objects(object_details)
+        if not LOCAL_GUESSES or not objects:
+            return None
+        match = guess_matchers.get(objects).match(message)
+        logger.debug(f"Guess {message!r} is a {match.status} for {match.objects} ({match.method}, {match.score:.2f})")
+        if match.hit is None:
+            return None
+        riddle = RiddleService.current_riddle(self.conversation, objects)
+        if riddle is None or riddle.object_name.lower() != match.hit.lower():
+            return None
+        self.revealed = [match.hit]
+        return CORRECT_GUESS_REPLY.format(object=match.hit)
+
+    def _answer_from_queue(self, message: str, object_details: Optional[str]) -> Optional[str]:
+        """The next queued riddle or hint if the message asks for one, None if the LLM has to answer"""
+        intent = riddle_intent(message)
+        objects = parse_objects(object_details)
+        if intent is None or not objects:
+            return None
+        if intent == "hint":
+            hint = RiddleService.next_hint(self.conversation, objects)
+            return f"Hint: {hint}" if hint else None
+        return RiddleService.next_riddle(self.conversation, objects)
+
+    def _llm_messages(self) -> List[LLMMessage]:
+        """Convert the cached history to LLM messages for the API call"""
+        return [LLMMessage(role=msg["role"], content=msg["content"]) for msg in self.get_history()]
+
+    @staticmethod
+    def _split_object_details(user_message: str) -> Tuple[str, Optional[str]]:
+        """Split a '<message>$<object details>' string sent by the frontend"""
+        if "$" in user_message:
+            parts = user_message.split("$")
+            if len(parts) > 1:
+                return parts[0], parts[1]  # Get the objects names
+        return user_message, None
+
 
 if __name__ == "__main__":
     import os
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from functools import partial
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+
+import httpx
+from websockets.asyncio.client import connect
+
+from .async_http import close_with_loop
+from .upload_registry import UploadRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ComfyUIError(Exception):
+    """Raised when ComfyUI rejects a prompt or fails while executing it"""
+
+
+class _PromptState:
+    """What we know about one prompt: outputs seen so far and the future its caller awaits"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.future: asyncio.Future = loop.create_future()
+        self.outputs: Dict[str, Any] = {}
+        self.cached_nodes = False
+
+
+class AsyncComfyUIClient:
+    """asyncio ComfyUI client that multiplexes every prompt over one websocket
+
+    Prompts are submitted with this client's ``client_id``, so ComfyUI sends
+    their progress to our single ``/ws`` connection. Events are routed to the
+    awaiting caller by ``prompt_id``; a prompt is finished when ComfyUI reports
+    it done, whatever else is still queued. Any number of generations can be
+    awaited concurrently.
+
+    Usage:
+        async with AsyncComfyUIClient() as client:
+            image = await client.generate_img(workflow)
+    """
+
+    # Prompts tracked at once, including ones that finished before their submitter started waiting
+    MAX_TRACKED_PROMPTS = 256
+
+    def __init__(self, base_url: str = None, ws_url: str = None, client_id: str = None, timeout: float = 600):
+        self.base_url = (base_url or os.environ.get("COMFYUI_URL", "http://localhost:8189")).rstrip("/")
+        self.ws_url = ws_url or self.base_url.replace("http", "ws", 1) + "/ws"
+        self.client_id = client_id or uuid.uuid4().hex
+        self.timeout = timeout
+
+        self.closed = False
+        self._http: Optional[httpx.AsyncClient] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._prompts: "OrderedDict[str, _PromptState]" = OrderedDict()
+        self._collected: "OrderedDict[str, None]" = OrderedDict()
+
+    async def __aenter__(self) -> "AsyncComfyUIClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """Open the HTTP pool and the websocket, returns once the websocket is connected
+
+        Concurrent callers share the one connection, later ones only wait for it.
+        """
+        if self._reader is None:
+            self._http = httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(30.0))
+            self._connected = asyncio.Event()
+            self._reader = asyncio.create_task(self._read_events())
+        await asyncio.wait_for(self._connected.wait(), timeout=30)
+
+    async def close(self) -> None:
+        self.closed = True
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        for state in self._prompts.values():
+            if not state.future.done():
+                state.future.set_exception(ComfyUIError("Client closed"))
+        self._prompts.clear()
+
+    async def submit(self, workflow: Dict[str, Any]) -> str:
+        """Queue a workflow and return its prompt_id"""
+        response = await self._http.post("/prompt", json={"prompt": workflow, "client_id": self.client_id})
+        if response.status_code != 200:
+            raise ComfyUIError(f"ComfyUI rejected the prompt ({response.status_code}): {response.text}")
+        prompt_id = response.json()["prompt_id"]
+        self._state(prompt_id)
+        logger.info(f"Queued ComfyUI prompt {prompt_id}")
+        return prompt_id
+
+    async def wait(self, prompt_id: str, timeout: float = None) -> Dict[str, Any]:
+        """Wait for a prompt to finish and return its outputs keyed by node id"""
+        state = self._state(prompt_id)
+        try:
+            await asyncio.wait_for(asyncio.shield(state.future), timeout or self.timeout)
+        finally:
+            # Finished, timed out or cancelled, nobody waits for it any more. On a shared
+            # client abandoned prompts would otherwise take tracking slots until evicted.
+            self._prompts.pop(prompt_id, None)
+            # Late events (execution_success after executing/None) must not resurrect it
+            self._collected[prompt_id] = None
+            while len(self._collected) > self.MAX_TRACKED_PROMPTS:
+                self._collected.popitem(last=False)
+
+        outputs = state.future.result()
+        # Cached nodes do not send 'executed' events, their outputs only show up in the history
+        if state.cached_nodes or not outputs:
+            outputs = await self.get_outputs(prompt_id)
+        return outputs
+
+    async def get_outputs(self, prompt_id: str) -> Dict[str, Any]:
+        response = await self._http.get(f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json().get(prompt_id, {}).get("outputs", {})
+
+    async def fetch_image(self, image: Dict[str, str]) -> bytes:
+        """Download an output image described by a ComfyUI output entry"""
+        response = await self._http.get("/view", params={
+            "filename": image["filename"],
+            "subfolder": image.get("subfolder", ""),
+            "type": image.get("type", "output"),
+        })
+        response.raise_for_status()
+        return response.content
+
+    async def upload_image(self, path: str, registry: UploadRegistry = None) -> str:
+        """Upload an image into ComfyUI's input folder and return its name there
+
+        With a registry the image is stored under its content-hash name and
+        only uploaded when ComfyUI does not have it already.
+        """
+        if registry is None:
+            return await self._upload(path, os.path.basename(path))
+
+        name = registry.content_name(path)
+        if not registry.is_uploaded(self.base_url, name):
+            if await self.has_input_image(name):
+                logger.info(f"ComfyUI already has {name}")
+            else:
+                await self._upload(path, name)
+            registry.mark_uploaded(self.base_url, name)
+        return name
+
+    async def has_input_image(self, name: str) -> bool:
+        response = await self._http.head("/view", params={"filename": name, "type": "input"})
+        return response.status_code == 200
+
+    async def _upload(self, path: str, name: str) -> str:
+        with open(path, "rb") as f:
+            data = f.read()
+        response = await self._http.post(
+            "/upload/image", files={"image": (name, data)}, data={"overwrite": "true"}
+        )
+        if response.status_code != 200:
+            raise ComfyUIError(f"Uploading {path} failed ({response.status_code}): {response.text}")
+        logger.info(f"Uploaded {path} to ComfyUI as {name}")
+        return response.json()["name"]
+
+    async def generate_img(self, workflow: Dict[str, Any], img_prefix: str = "no_bg") -> bytes:
+        """Run a workflow and return the first output image whose filename contains img_prefix"""
+        prompt_id = await self.submit(workflow)
+        return await self.wait_image(prompt_id, img_prefix)
+
+    async def wait_image(self, prompt_id: str, img_prefix: str = "no_bg") -> bytes:
+        """Wait for a submitted prompt and return its first output image whose filename contains img_prefix"""
+        outputs = await self.wait(prompt_id)
+        for node_output in outputs.values():
+            for image in node_output.get("images", []):
+                if img_prefix in image["filename"]:
+                    return await self.fetch_image(image)
+        raise ComfyUIError(f"Prompt {prompt_id} produced no image matching '{img_prefix}'")
+
+    def _state(self, prompt_id: str) -> _PromptState:
+        state = self._prompts.get(prompt_id)
+        if state is None:
+            state = self._prompts[prompt_id] = _PromptState(asyncio.get_running_loop())
+            while len(self._prompts) > self.MAX_TRACKED_PROMPTS:
+                _, stale = self._prompts.popitem(last=False)
+                if not stale.future.done():
+                    stale.future.set_exception(ComfyUIError("Too many prompts in flight"))
+        return state
+
+    async def _read_events(self) -> None:
+        # connect() used as an async iterator reconnects with backoff when the socket drops
+        async for websocket in connect(f"{self.ws_url}?clientId={self.client_id}", max_size=None):
+            self._connected.set()
+            await self._recover_missed()
+            try:
+                async for message in websocket:
+                    if isinstance(message, bytes):
+                        continue  # binary latent previews
+                    self._dispatch(json.loads(message))
+            except Exception as e:
+                logger.warning(f"ComfyUI websocket dropped, reconnecting: {str(e)}")
+                continue
+            finally:
+                # Also when the reader is cancelled, e.g. by a loop shutting down, so ComfyUI sees a clean close
+                await websocket.close()
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        event_type = event.get("type")
+        data = event.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None or prompt_id in self._collected:
+            return  # status broadcasts, late events of collected prompts
+
+        state = self._state(prompt_id)
+        if state.future.done():
+            return
+        if event_type == "executed":
+            state.outputs[str(data.get("node"))] = data.get("output") or {}
+        elif event_type == "execution_cached":
+            state.cached_nodes = state.cached_nodes or bool(data.get("nodes"))
+        elif (event_type == "executing" and data.get("node") is None) or event_type == "execution_success":
+            state.future.set_result(state.outputs)
+        elif event_type == "execution_error":
+            state.future.set_exception(ComfyUIError(
+                f"Prompt {prompt_id} failed in node {data.get('node_id')}: {data.get('exception_message')}"
+            ))
+        elif event_type == "execution_interrupted":
+            state.future.set_exception(ComfyUIError(f"Prompt {prompt_id} was interrupted"))
+
+    async def _recover_missed(self) -> None:
+        """After a (re)connect, prompts that finished while we were offline only show up in the history"""
+        for prompt_id, state in list(self._prompts.items()):
+            if state.future.done():
+                continue
+            try:
+                outputs = await self.get_outputs(prompt_id)
+            except httpx.HTTPError:
+                continue
+            if outputs and not state.future.done():
+                state.future.set_result(outputs)
+
+
+_shared_lock = threading.Lock()
+_shared: Dict[Tuple[asyncio.AbstractEventLoop, Optional[str], Optional[str]],
+              Tuple[AsyncComfyUIClient, AsyncGenerator[None, None]]] = {}
+
+
+async def get_comfy_client(base_url: str = None, ws_url: str = None) -> AsyncComfyUIClient:
+    """The shared, connected AsyncComfyUIClient of the running event loop for one ComfyUI
+
+    Like async_http.get_async_client: every request on a loop multiplexes its
+    prompts over the one websocket and HTTP pool instead of opening its own.
+    The client is closed when its loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, base_url, ws_url)
+    with _shared_lock:
+        # Loops closed without shutting down their async generators can't close their clients any more
+        for stale in [other for other in _shared if other[0].is_closed()]:
+            del _shared[stale]
+        client, _ = _shared.get(key, (None, None))
+        if client is None or client.closed:
+            client = AsyncComfyUIClient(base_url, ws_url)
+            _shared[key] = (client, close_with_loop(partial(_forget_and_close, key, client)))
+    await client.start()
+    return client
+
+
+async def _forget_and_close(key, client: AsyncComfyUIClient) -> None:
+    with _shared_lock:
+        if _shared.get(key, (None,))[0] is client:
+            del _shared[key]
+    await client.close()
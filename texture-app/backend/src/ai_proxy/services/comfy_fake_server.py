@@ -0,0 +1,196 @@
+import asyncio
+import email.parser
+import email.policy
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from websockets.asyncio.server import serve
+
+
+class FakeComfyUI:
+    """In-process stand-in for a ComfyUI server, used by the tests
+
+    Speaks the parts of the API the services use: POST /prompt, GET /history/<id>,
+    GET /view, POST /upload/image and the /ws event stream (executing /
+    executed / execution_error per prompt_id, status broadcasts). Prompts run
+    one at a time like in ComfyUI. HTTP and websocket listen on separate ports.
+
+    Args:
+        job_seconds: Simulated execution time of one prompt
+        render: Maps a workflow to the bytes of its output image (default: the workflow as JSON)
+    """
+
+    def __init__(self, job_seconds: float = 0.05, render: Callable[[Dict[str, Any]], bytes] = None):
+        self.job_seconds = job_seconds
+        self.render = render or (lambda workflow: json.dumps(workflow, sort_keys=True).encode())
+        self.prompts: Dict[str, Dict[str, Any]] = {}
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.images: Dict[str, bytes] = {}
+        self.uploads: Dict[str, bytes] = {}
+        self.upload_count = 0
+        self.view_count = 0
+        self.head_count = 0
+        self.ws_connections = 0
+        self.max_queue_seen = 0
+
+        self._clients: Dict[str, Any] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ws_server = None
+        self._http_server: Optional[ThreadingHTTPServer] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._http_server.server_address[1]}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://127.0.0.1:{self._ws_server.sockets[0].getsockname()[1]}/ws"
+
+    async def __aenter__(self) -> "FakeComfyUI":
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._ws_server = await serve(self._handle_ws, "127.0.0.1", 0)
+        self._http_server = ThreadingHTTPServer(("127.0.0.1", 0), self._http_handler())
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+        self._worker = asyncio.create_task(self._run_prompts())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._worker.cancel()
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._ws_server.close()
+        await self._ws_server.wait_closed()
+
+    async def drop_websockets(self) -> None:
+        """Close every client websocket, as a ComfyUI restart or network blip would"""
+        for websocket in list(self._clients.values()):
+            await websocket.close()
+
+    async def _handle_ws(self, websocket) -> None:
+        client_id = parse_qs(urlparse(websocket.request.path).query).get("clientId", [uuid.uuid4().hex])[0]
+        self._clients[client_id] = websocket
+        self.ws_connections += 1
+        await websocket.send(json.dumps(self._status()))
+        try:
+            await websocket.wait_closed()
+        finally:
+            if self._clients.get(client_id) is websocket:
+                del self._clients[client_id]
+
+    async def _run_prompts(self) -> None:
+        while True:
+            prompt_id, client_id, workflow = await self._queue.get()
+            await self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+            await self._send(client_id, {"type": "executing", "data": {"node": "1", "prompt_id": prompt_id}})
+            await asyncio.sleep(self.job_seconds)
+
+            if workflow.get("fail"):
+                await self._send(client_id, {"type": "execution_error", "data": {
+                    "prompt_id": prompt_id, "node_id": "1", "exception_message": "simulated failure"}})
+            else:
+                filename = f"no_bg_{prompt_id}.png"
+                self.images[filename] = self.render(workflow)
+                output = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+                self.history[prompt_id] = {"outputs": {"21": output}}
+                await self._send(client_id, {"type": "executed",
+                                             "data": {"node": "21", "output": output, "prompt_id": prompt_id}})
+                await self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+            for other in list(self._clients):
+                await self._send(other, self._status())
+
+    def _status(self) -> Dict[str, Any]:
+        return {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self._queue.qsize()}}}}
+
+    async def _send(self, client_id: str, event: Dict[str, Any]) -> None:
+        websocket = self._clients.get(client_id)
+        if websocket is not None:
+            try:
+                await websocket.send(json.dumps(event))
+            except Exception:
+                pass
+
+    def _queue_prompt(self, workflow: Dict[str, Any], client_id: str) -> str:
+        prompt_id = uuid.uuid4().hex
+        self.prompts[prompt_id] = workflow
+        self._queue.put_nowait((prompt_id, client_id, workflow))
+        self.max_queue_seen = max(self.max_queue_seen, self._queue.qsize())
+        return prompt_id
+
+    def _http_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status: int, data: Any) -> None:
+                self._reply(status, json.dumps(data).encode())
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_HEAD(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                fake.head_count += 1
+                store = fake.uploads if query.get("type") == "input" else fake.images
+                found = url.path == "/view" and query.get("filename") in store
+                self.send_response(200 if found else 404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path.startswith("/history/"):
+                    prompt_id = url.path[len("/history/"):]
+                    history = fake.history.get(prompt_id)
+                    return self._json(200, {prompt_id: history} if history else {})
+                if url.path == "/view":
+                    fake.view_count += 1
+                    store = fake.uploads if query.get("type") == "input" else fake.images
+                    data = store.get(query.get("filename", ""))
+                    if data is None:
+                        return self._json(404, {"error": "not found"})
+                    return self._reply(200, data, "image/png")
+                self._json(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path == "/prompt":
+                    data = json.loads(self._body())
+                    prompt_id = asyncio.run_coroutine_threadsafe(
+                        _call(fake._queue_prompt, data["prompt"], data.get("client_id", "")), fake._loop
+                    ).result()
+                    return self._json(200, {"prompt_id": prompt_id, "number": len(fake.prompts), "node_errors": {}})
+                if url.path == "/upload/image":
+                    header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + self._body())
+                    for part in message.iter_parts():
+                        if part.get_param("name", header="content-disposition") == "image":
+                            fake.uploads[part.get_filename()] = part.get_payload(decode=True)
+                            fake.upload_count += 1
+                            return self._json(200, {"name": part.get_filename(), "subfolder": "", "type": "input"})
+                    return self._json(400, {"error": "no image"})
+                self._json(404, {"error": "not found"})
+
+        return Handler
+
+
+async def _call(fn, *args):
+    return fn(*args)
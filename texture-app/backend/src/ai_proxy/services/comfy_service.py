@@ -1,15 +1,20 @@
-import json
-import requests
+import asyncio
 import base64
 import logging
 from dataclasses import dataclass
-from websockets.sync.client import connect
-from typing import Dict, Any, Optional
-import time
+from typing import Dict, Any, Optional, AsyncIterator, Callable, List, Tuple, Union
 import os
 
+from .backend_client import get_backend
+from .comfy_client import get_comfy_client
+from .upload_registry import UploadRegistry
+from .workflow_templates import workflow_templates
+
 logger = logging.getLogger(__name__)
 
+# The record of reference images ComfyUI already has, shared by all requests
+upload_registry = UploadRegistry()
+
 @dataclass
 class Parameters:
     positive_prompt: str
@@ -28,72 +33,34 @@ MAPPING = ParametersMapping(
     reference_img="10",
 )
 
-class ComfyUIAPI:
-    def __init__(self):
-        self.workflow_path = "/mnt-persist/Kaan/texture-app/backend/src/ai_proxy/services/resources/character.json"
-
-    def upload_img(self, img_path):
-        url = "http://localhost:8189/upload/image"
-        response = requests.post(url, files={"image": (os.path.basename(img_path), open(img_path, "rb"))})
-        print(response)
+# Parameter -> (node id, input name) in character.json
+SLOTS = {
+    "positive_prompt": (MAPPING.positive_prompt, "text"),
+    "negative_prompt": (MAPPING.negative_prompt, "text"),
+    "reference_img": (MAPPING.reference_img, "image"),
+}
 
+class ComfyUIAPI:
+    def __init__(self, base_url: str = None):
+        self.workflow_path = os.path.join(os.path.dirname(__file__), "resources", "character.json")
+        self.base_url = base_url or os.environ.get("COMFYUI_URL", "http://localhost:8189")
+        # Pooled, rate-limited client shared by everything talking to this ComfyUI
+        self.backend = get_backend("comfyui", self.base_url)
 
     def get_workflow(self, parameters: Parameters):
-        with open(self.workflow_path, "r") as f:
-            workflow = json.load(f)
-            
-        workflow[MAPPING.positive_prompt]["inputs"]["text"] = parameters.positive_prompt
-        workflow[MAPPING.negative_prompt]["inputs"]["text"] = parameters.negative_prompt
-        workflow[MAPPING.reference_img]["inputs"]["image"] = parameters.reference_img
-        ## TODO:     
-        return workflow
-
-    def generate_img(self, workflow, img_prefix="no_bg"):
-       
-        url = "http://localhost:8189/prompt"
-        response = requests.post(url, json={"prompt": workflow, "api":True})
-        data = response.json()
-        print(data)
-        prompt_id = data["prompt_id"]
-       
-        print("ID ", prompt_id)
-        
-        time.sleep(2)
-        
-        with connect("ws://localhost:8189/ws") as websocket:
-            while True:
-                message = websocket.recv()
-                data = json.loads(message)
-                print(data)
-                if data["type"] == "executing":
-                    print(f"Progress: {data['data']['node']}")
-                elif data["type"] == "status" and data["data"]["status"]["exec_info"]["queue_remaining"] == 0:
-                    print("Execution complete")
-                    break
-                
-        history_url = f"http://localhost:8189/history/{prompt_id}"
-        history_response = requests.get(history_url)
-        history_data = history_response.json()
-        
-        #print(history_data)
-
-        img_name = "character.jpg"
-        for node_id, node_output in history_data[prompt_id]["outputs"].items():
-            if "images" in node_output:
-                for image in node_output["images"]:
-                    print(image["filename"])
-                    if img_prefix in image["filename"]:
-                        image_url = f"http://localhost:8189/view?filename={image['filename']}"
-                        print(image_url)
-                        img_data = requests.get(image_url).content
-                        #with open(img_name, 'wb') as handler:
-                            #handler.write(img_data)
-                            
-                        return img_data
-    
+        """Workflow with the parameters filled in, rendered from the cached template
+
+        Only the patched nodes are copied, the rest is shared with the template and must not be modified.
+        """
+        template = workflow_templates.get(self.workflow_path, SLOTS)
+        return template.render(
+            positive_prompt=parameters.positive_prompt,
+            negative_prompt=parameters.negative_prompt,
+            reference_img=parameters.reference_img
+        )
 
 
-initial_pose = "/mnt-persist/Kaan/texture-app/backend/src/ai_proxy/services/resources/poses/pose1.jpg"
+initial_pose = os.path.join(os.path.dirname(__file__), "resources", "poses", "pose1.jpg")
 
 
 
@@ -108,9 +75,11 @@ defined_poses = {
 class ComfyUIAPIWrapper:
     """Wrapper for ComfyUIAPI to handle POST requests"""
     
-    def __init__(self, base_url: str = None):
-        self.comfy_api = ComfyUIAPI()
-        self.base_url = base_url or "http://localhost:8189"
+    def __init__(self, base_url: str = None, ws_url: str = None, uploads: UploadRegistry = None):
+        self.base_url = base_url or os.environ.get("COMFYUI_URL", "http://localhost:8189")
+        self.comfy_api = ComfyUIAPI(self.base_url)
+        self.ws_url = ws_url
+        self.uploads = uploads or upload_registry
         self.poses_dir = os.path.join(os.path.dirname(__file__), 'resources', 'poses')
     
     
@@ -157,96 +126,103 @@ class ComfyUIAPIWrapper:
             except Exception as e:
                 logger.error(f"Error cleaning up file {file_path}: {str(e)}")
                 
-    def generate_avatar_with_poses(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate an initial avatar pose and then create additional poses
-        
+    def _pose_references(self) -> List[Tuple[str, str]]:
+        """Reference images of every avatar pose, initial pose first
+
+        Returns:
+            List of (pose name, reference image path)
+        """
+        references = [("initial_pose", initial_pose)]
+        for pose_file in sorted(f for f in os.listdir(self.poses_dir) if f.endswith('.jpg')):
+            if pose_file in defined_poses:
+                references.append((defined_poses[pose_file], os.path.join(self.poses_dir, pose_file)))
+        return references
+
+    async def iter_avatar_poses(self, params: Dict[str, Any],
+                                as_base64: bool = True) -> AsyncIterator[Tuple[str, Union[str, bytes]]]:
+        """Generate every avatar pose concurrently, yielding each one as soon as it completes
+
+        All pose workflows are queued in ComfyUI up front and their results are
+        awaited together, so the total time is about that of the slowest pose
+        instead of the sum of all of them.
+
+        Args:
+            params: Same as generate_avatar_with_poses
+            as_base64: Yield Base64 strings, or the raw image bytes if False
+
+        Yields:
+            (pose name, Base64 encoded pose) in completion order
+        """
+        positive_prompt = f"{params.get('positive_prompt', '')},(looking at camera:1.3),(atmosphere), coherent, continuity, epic, plain background"
+        negative_prompt = """
+                        logo, logos, images, graphics, text,
+                        embedding:verybadimagenegative_v1.3, (3d), white eyes, layout, (worst quality:1.4),(low quality:1.4),(normal quality:1.3),
+                        lowres,watermark, title, (jpeg-artifacts:1.33), embedding:badhandv4, embedding:bad-artist, embedding:bad-artist-anime, (hands:1.5)
+                        """
+
+        # One avatar is one call against ComfyUI's concurrency limit, and fails fast while ComfyUI is down
+        async with self.comfy_api.backend.acall():
+            # Every avatar on this event loop shares one websocket, its prompts are told apart by prompt_id
+            client = await get_comfy_client(self.base_url, self.ws_url)
+            references = self._pose_references()
+            # Reference images are content-addressed, after warm-up none of them is uploaded again
+            uploaded = await asyncio.gather(*(client.upload_image(path, self.uploads) for _, path in references))
+
+            # Queue every pose before waiting on any of them
+            prompt_ids = {}
+            for (pose_name, _), reference_img in zip(references, uploaded):
+                workflow = self.comfy_api.get_workflow(Parameters(
+                    positive_prompt=positive_prompt,
+                    negative_prompt=negative_prompt,
+                    reference_img=reference_img
+                ))
+                prompt_ids[pose_name] = await client.submit(workflow)
+                logger.info(f"Queued {pose_name} as prompt {prompt_ids[pose_name]}")
+
+            async def collect(pose_name: str, prompt_id: str) -> Tuple[str, bytes]:
+                return pose_name, await client.wait_image(prompt_id)
+
+            tasks = [asyncio.create_task(collect(pose_name, prompt_id)) for pose_name, prompt_id in prompt_ids.items()]
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    pose_name, pose_image_data = await finished
+                    logger.info(f"Generated {pose_name}")
+                    yield pose_name, base64.b64encode(pose_image_data).decode('utf-8') if as_base64 else pose_image_data
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def generate_avatar_with_poses(self, params: Dict[str, Any], on_pose: Callable[[str, str], None] = None,
+                                   as_base64: bool = True) -> Dict[str, Any]:
+        """Generate an initial avatar pose and the additional poses, all in parallel
+
         Args:
             params: Dictionary containing the following keys:
                 - image: Base64 encoded image (optional)
                 - positive_prompt: Positive prompt for image generation
                 - negative_prompt: Negative prompt for image generation
-                
+            on_pose: Optional callback called with (pose name, Base64 pose) as each pose completes
+            as_base64: Return Base64 strings, or the raw image bytes if False
+
         Returns:
             Dictionary containing all generated poses as Base64 strings:
                 - initial_pose: Base64 encoded initial pose
-                - pose1: Base64 encoded pose 1
-                - pose2: Base64 encoded pose 2
-                - etc.
+                - thinking, wrong, yay: Base64 encoded additional poses
         """
-     
-        positive_prompt = params.get('positive_prompt', '')
-
-        positive_prompt = f"{positive_prompt},(looking at camera:1.3),(atmosphere), coherent, continuity, epic, plain background"""
-        negative_prompt = """
-                        logo, logos, images, graphics, text,
-                        embedding:verybadimagenegative_v1.3, (3d), white eyes, layout, (worst quality:1.4),(low quality:1.4),(normal quality:1.3),
-                        lowres,watermark, title, (jpeg-artifacts:1.33), embedding:badhandv4, embedding:bad-artist, embedding:bad-artist-anime, (hands:1.5)
-                        """
-        
         # Validate parameters
-        if not positive_prompt:
+        if not params.get('positive_prompt'):
             return {"error": "Missing positive_prompt parameter"}
-        
-        # Dictionary to store all poses
-        poses_dict = {}
-        
-        # Generate initial pose
-        logger.info("Generating initial pose...")
-        
-        
-            
-        # Create parameters for the workflow
-        comfy_params = Parameters(
-            positive_prompt=positive_prompt,
-            negative_prompt=negative_prompt,
-            reference_img=os.path.basename(initial_pose)
-        )
-        
-        # Get the workflow and generate the initial pose
-        workflow = self.comfy_api.get_workflow(comfy_params)
-        self.comfy_api.upload_img(initial_pose)
 
-        initial_pose_data = self.comfy_api.generate_img(workflow)
-        
-        # Convert the initial pose to base64 and add to dictionary
-        
-        initial_pose_base64 = base64.b64encode(initial_pose_data).decode('utf-8')
-        poses_dict["initial_pose"] = initial_pose_base64
-        
-        # Now generate additional poses using the pose files
-        logger.info("Generating additional poses...")
-        pose_files = sorted([f for f in os.listdir(self.poses_dir) if f.endswith('.jpg')])
-        
-        for pose_file in pose_files:
+        async def collect() -> Dict[str, Any]:
+            poses_dict = {}
+            async for pose_name, pose_base64 in self.iter_avatar_poses(params, as_base64):
+                poses_dict[pose_name] = pose_base64
+                if on_pose is not None:
+                    on_pose(pose_name, pose_base64)
+            return poses_dict
 
-            pose_name = os.path.basename(pose_file)  # Get name without extension
-            if pose_name not in defined_poses:
-                continue
-            logger.info(f"Generating {pose_name}...")
-            
-            # Upload the pose file to ComfyUI
-            pose_path = os.path.join(self.poses_dir, pose_file)
-            self.comfy_api.upload_img(pose_path)
-            
-            # Create parameters for the workflow with the pose file
-            pose_params = Parameters(
-                positive_prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                reference_img=pose_name
-            )
-            
-            # Get the workflow and generate the pose
-            pose_workflow = self.comfy_api.get_workflow(pose_params)
-            pose_image_data = self.comfy_api.generate_img(pose_workflow)
-            
-            # Convert the pose to base64 and add to dictionary
-            
-            pose_base64 = base64.b64encode(pose_image_data).decode('utf-8')
-            poses_dict[defined_poses[pose_name]] = pose_base64
-                
-          
-        
-        return poses_dict
+        return asyncio.run(collect())
             
 
 
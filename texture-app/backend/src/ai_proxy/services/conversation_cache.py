@@ -0,0 +1,96 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ..models import Conversation
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedConversation:
+    """A conversation's messages held in memory, plus the messages not yet written to the database
+
+    Args:
+        conversation: The Conversation row the messages belong to
+        version: Conversation.version the messages correspond to
+        messages: History as {"id", "role", "content"} dicts, oldest first, including pending ones
+            (whose id is None until they are written)
+        pending: Messages appended since the last flush
+    """
+    conversation: Conversation
+    version: int
+    messages: List[Dict[str, str]]
+    pending: List[Dict[str, str]] = field(default_factory=list)
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False)
+
+
+class ConversationCache:
+    """Bounded LRU of live conversations, keyed by conversation id.
+
+    Every write to a conversation's messages bumps Conversation.version in the
+    same transaction, so a lookup costs one query for the Conversation row: if
+    its version (and creation time, in case the id was reused) matches the
+    cached entry the messages come from memory, otherwise they are reloaded.
+    That keeps several Django worker processes consistent without a shared
+    cache; a process that wrote last simply has the newest version.
+
+    Code that changes messages outside ChatBOT has to bump the version too, or
+    call discard() in this process.
+
+    Args:
+        max_entries: Conversations kept in memory
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, CachedConversation]" = OrderedDict()
+
+    def get(self, conversation_id) -> Optional[CachedConversation]:
+        """The conversation with its messages, or None if it does not exist"""
+        conversation = Conversation.objects.filter(id=conversation_id).first()
+        if conversation is None:
+            self.discard(conversation_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(conversation.id)
+            if (entry is not None and entry.version == conversation.version
+                    and entry.conversation.created_at == conversation.created_at):
+                self._entries.move_to_end(conversation.id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        messages = list(conversation.messages.values("id", "role", "content"))
+        return self.add(conversation, messages)
+
+    def add(self, conversation: Conversation, messages: List[Dict[str, str]]) -> CachedConversation:
+        """Cache a conversation whose messages in the database are exactly ``messages``"""
+        entry = CachedConversation(conversation=conversation, version=conversation.version, messages=messages)
+        with self._lock:
+            self._entries[conversation.id] = entry
+            self._entries.move_to_end(conversation.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def discard(self, conversation_id) -> None:
+        with self._lock:
+            try:
+                self._entries.pop(int(conversation_id), None)
+            except (TypeError, ValueError):
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
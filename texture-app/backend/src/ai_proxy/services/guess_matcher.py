@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# numpy is optional, it is only needed for embedding similarity
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Other words players use for the objects the segmentation service finds, by object name.
+# Extra entries can be given as a {"object": ["synonym", ...]} JSON file in GUESS_SYNONYMS_FILE.
+SYNONYMS: Dict[str, List[str]] = {
+    "tv": ["television", "telly", "tv set", "television set", "tele"],
+    "couch": ["sofa", "settee", "loveseat", "divan"],
+    "chair": ["armchair", "stool", "seat"],
+    "keyboard": ["keys", "computer keyboard"],
+    "laptop": ["notebook", "notebook computer"],
+    "monitor": ["screen", "display"],
+    "cell phone": ["phone", "mobile", "mobile phone", "smartphone", "cellphone"],
+    "potted plant": ["plant", "houseplant", "pot plant", "flower pot"],
+    "dining table": ["table", "dinner table"],
+    "refrigerator": ["fridge", "freezer"],
+    "bed": ["mattress"],
+    "cup": ["mug"],
+    "lamp": ["light", "floor lamp", "desk lamp"],
+    "book": ["novel", "books"],
+    "clock": ["watch", "wall clock"],
+    "mouse": ["computer mouse"],
+    "remote": ["remote control", "controller", "clicker"],
+    "picture": ["painting", "frame", "poster", "photo"],
+}
+
+# Words that make a guess that names an object mean something else, e.g.
+# "is it not the chair?" or "is it bigger than the chair?". The LLM decides those.
+AMBIGUOUS_WORDS = {
+    "not", "no", "nt", "never", "than", "like", "similar", "near", "next", "beside", "behind", "under",
+    "below", "above", "on", "onto", "over", "left", "right", "front", "besides", "except", "without",
+    "color", "colour", "made", "part", "inside", "if", "maybe",
+}
+
+# Words a guess may have around the object it names: "is it the tv?", "it's a sofa", "I think it's the chair".
+# A message with any other word ("where is the chair?", "tell me about the couch") isn't taken for a guess.
+GUESS_WORDS = {
+    "is", "it", "its", "s", "a", "an", "the", "that", "this", "i", "think", "guess", "my", "answer", "be", "must",
+    "could", "would", "might", "probably", "how", "about", "oh", "ah", "hmm", "ok", "okay", "so", "then", "well",
+    "final", "please", "one", "some", "those", "these", "they", "are", "got", "found", "yes",
+}
+# Longest a misspelled guess can be, in words other than GUESS_WORDS, for embedding similarity to hit
+MAX_GUESS_WORDS = 3
+
+# Plurals the rules in lemma() would get wrong
+_IRREGULAR = {"mice": "mouse", "people": "person", "knives": "knife", "shelves": "shelf", "leaves": "leaf",
+              "news": "news", "series": "series", "species": "species"}
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercase ASCII words of a text, accents and punctuation removed ("n't" becomes the word "nt")"""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z0-9]+", " ", text.replace("n't", " nt")).split()
+
+
+def lemma(word: str) -> str:
+    """Singular of an English noun, by the usual plural rules"""
+    if word in _IRREGULAR:
+        return _IRREGULAR[word]
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "zes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def parse_objects(object_details: Optional[str]) -> List[str]:
+    """Object names in the object details sent by the frontend
+
+    Accepts the frontend's JSON ({"chair": "/mask_images/mask_chair.png", ...}
+    or ["chair", ...]) and plain comma separated names ("chair, couch").
+    """
+    if not object_details or not object_details.strip():
+        return []
+    try:
+        parsed = json.loads(object_details)
+    except ValueError:
+        parsed = object_details.split(",")
+    if isinstance(parsed, dict):
+        parsed = list(parsed)
+    if not isinstance(parsed, list):
+        return []
+    return [name.strip() for name in parsed if isinstance(name, str) and name.strip()]
+
+
+@dataclass
+class GuessMatch:
+    """What a guess says about the hidden objects
+
+    Args:
+        status: "hit" if the message is a guess of exactly one object,
+            "ambiguous" if it might be (it names objects but says more than a
+            guess would, or names several), "miss" if it names none (a
+            question, a request for a hint, ...)
+        objects: Objects the guess names, or might name
+        method: "lexical" or "embedding", what decided it
+        score: 1.0 for lexical matches, the cosine similarity for embedding ones
+    """
+    status: str
+    objects: List[str]
+    method: str = "lexical"
+    score: float = 0.0
+
+    @property
+    def hit(self) -> Optional[str]:
+        """The object found, if the guess is a confirmed hit"""
+        return self.objects[0] if self.status == "hit" else None
+
+
+class EmbeddingIndex:
+    """Cosine similarity of texts against the object names and synonyms, as one NumPy matrix product
+
+    Args:
+        embed: Maps a list of texts to a (len(texts), dim) array
+        phrases: (phrase, object) pairs to index
+    """
+
+    def __init__(self, embed: Callable[[List[str]], "np.ndarray"], phrases: Sequence[Tuple[str, str]]):
+        self.embed = embed
+        self.objects = [name for _, name in phrases]
+        self.matrix = self._normalized(embed([phrase for phrase, _ in phrases]))
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Best similarity of ``text`` to each object"""
+        similarities = self.matrix @ self._normalized(self.embed([text]))[0]
+        best: Dict[str, float] = {}
+        for name, similarity in zip(self.objects, similarities.tolist()):
+            best[name] = max(best.get(name, -1.0), similarity)
+        return best
+
+    @staticmethod
+    def _normalized(vectors) -> "np.ndarray":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class GuessMatcher:
+    """Decides locally whether a guess names one of the hidden objects
+
+    Every object is indexed under its lemmatized name and synonyms. A guess
+    hits when those words appear in it, for exactly one object, and every
+    other word is one a guess is phrased with (GUESS_WORDS): "is it the tv?"
+    hits, "where is the tv?" or "tell me about the tv" only mention it and go
+    to the LLM as ambiguous, like negations and comparisons do. Guesses that
+    name no object may still hit through embedding similarity when an
+    ``embed`` function is given: above ``hit_threshold`` they hit, above
+    ``ambiguous_threshold`` they go to the LLM as ambiguous.
+
+    Args:
+        objects: Names of the hidden objects
+        synonyms: Other names of objects, by object name
+        embed: Optional sentence embedding function for EmbeddingIndex
+        hit_threshold: Similarity at which an embedding match is a hit
+        ambiguous_threshold: Similarity at which an embedding match is ambiguous
+    """
+
+    def __init__(self, objects: Iterable[str], synonyms: Optional[Dict[str, List[str]]] = None,
+                 embed: Optional[Callable[[List[str]], "np.ndarray"]] = None,
+                 hit_threshold: float = 0.85, ambiguous_threshold: float = 0.6):
+        synonyms = SYNONYMS if synonyms is None else synonyms
+        self.objects = list(dict.fromkeys(objects))
+        self.hit_threshold = hit_threshold
+        self.ambiguous_threshold = ambiguous_threshold
+
+        phrases: List[Tuple[str, str]] = []
+        for name in self.objects:
+            for phrase in [name, *synonyms.get(name.lower(), [])]:
+                phrases.append((phrase, name))
+        # Lemmatized word sequences, longest first so "coffee table" wins over "table"
+        self._phrases = sorted(
+            {(tuple(lemma(word) for word in normalize(phrase)), name) for phrase, name in phrases if normalize(phrase)},
+            key=lambda item: -len(item[0]),
+        )
+        self._index = EmbeddingIndex(embed, phrases) if embed is not None and np is not None and phrases else None
+
+    def match(self, guess: str) -> GuessMatch:
+        words = normalize(guess)
+        lemmas = [lemma(word) for word in words]
+        named = []
+        taken = [False] * len(lemmas)
+        for phrase, name in self._phrases:
+            for start in range(len(lemmas) - len(phrase) + 1):
+                if lemmas[start:start + len(phrase)] == list(phrase) and not any(taken[start:start + len(phrase)]):
+                    taken[start:start + len(phrase)] = [True] * len(phrase)
+                    if name not in named:
+                        named.append(name)
+
+        if named:
+            others = {word for word, used in zip(words, taken) if not used}
+            if len(named) == 1 and others <= GUESS_WORDS:
+                return GuessMatch("hit", named, score=1.0)
+            return GuessMatch("ambiguous", named, score=1.0)
+
+        content = [word for word in words if word not in GUESS_WORDS]
+        if self._index is not None and content:
+            scores = self._index.scores(" ".join(content))
+            best = max(scores, key=scores.get)
+            if (scores[best] >= self.hit_threshold and len(content) <= MAX_GUESS_WORDS
+                    and not AMBIGUOUS_WORDS.intersection(words)):
+                return GuessMatch("hit", [best], "embedding", scores[best])
+            if scores[best] >= self.ambiguous_threshold:
+                return GuessMatch("ambiguous", [best], "embedding", scores[best])
+        return GuessMatch("miss", [])
+
+
+def load_synonyms() -> Dict[str, List[str]]:
+    """SYNONYMS plus the entries of the GUESS_SYNONYMS_FILE JSON file, if set"""
+    synonyms = {name: list(words) for name, words in SYNONYMS.items()}
+    path = os.environ.get("GUESS_SYNONYMS_FILE")
+    if path:
+        with open(path) as f:
+            for name, words in json.load(f).items():
+                synonyms.setdefault(name.lower(), []).extend(words)
+    return synonyms
+
+
+def load_embedder() -> Optional[Callable[[List[str]], "np.ndarray"]]:
+    """Sentence embeddings of GUESS_EMBEDDING_MODEL (e.g. all-MiniLM-L6-v2), None when unset or unavailable"""
+    model_name = os.environ.get("GUESS_EMBEDDING_MODEL")
+    if not model_name:
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning("GUESS_EMBEDDING_MODEL is set but sentence-transformers is not installed")
+        return None
+    model = SentenceTransformer(model_name, device=os.environ.get("GUESS_EMBEDDING_DEVICE", "cpu"))
+    return lambda texts: model.encode(texts, convert_to_numpy=True)
+
+
+class GuessMatchers:
+    """Matchers of recently played scenes, keyed by their objects, built on first use
+
+    Args:
+        max_entries: Scenes kept
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._matchers: "OrderedDict[Tuple[str, ...], GuessMatcher]" = OrderedDict()
+        self._synonyms: Optional[Dict[str, List[str]]] = None
+        self._embed = None
+        self._lock = threading.Lock()
+
+    def get(self, objects: Sequence[str]) -> GuessMatcher:
+        key = tuple(objects)
+        with self._lock:
+            matcher = self._matchers.get(key)
+            if matcher is not None:
+                self._matchers.move_to_end(key)
+                return matcher
+            if self._synonyms is None:
+                self._synonyms = load_synonyms()
+                self._embed = load_embedder()
+            matcher = GuessMatcher(objects, self._synonyms, self._embed)
+            self._matchers[key] = matcher
+            while len(self._matchers) > self.max_entries:
+                self._matchers.popitem(last=False)
+            return matcher
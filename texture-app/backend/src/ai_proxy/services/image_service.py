@@ -1,4 +1,6 @@
+import asyncio
 import json
+import httpx
 import requests
 import base64
 import logging
@@ -6,42 +8,72 @@ from dataclasses import dataclass
 from typing import Optional, Dict, Any, Union
 import os
 
+from .backend_client import BackendUnavailable, get_backend
+from .reveal import SceneMasks
+from .scene_pack import ScenePacks
+from .segmentation_cache import ImageKey, SegmentationCache, image_key
+
 logger = logging.getLogger(__name__)
 
+# Segmentation results of this process's images by content, on disk under IMAGE_CACHE_DIR
+segmentation_cache = SegmentationCache.from_env()
+# Scenes precomputed by the build_scene_packs command, under SCENE_PACK_DIR
+scene_packs = ScenePacks.from_env()
+# Masks of the scenes being played, as BitMasks for the reveal compositor
+scene_masks = SceneMasks(scene_packs, max_bytes=int(os.environ.get("SCENE_MASKS_MB", "64")) * 1024 * 1024,
+                         cache=segmentation_cache)
+
 @dataclass
 class ImageGenerationParameters:
-    image: str  # Base64 encoded image
+    image: Union[str, bytes]  # Base64 encoded image, or the raw encoded image to upload as multipart
+    mask_format: str = "png"  # "png": masks as Base64 PNGs, "rle": as BitMask.as_rle_dict()
 
 ## clas mask 
 class ImageGenerationService:
     """Service for handling image generation requests to the image generation API"""
     
-    def __init__(self, base_url: str = None):
-        self.base_url = base_url or "http://localhost:11245"
+    def __init__(self, base_url: str = None, cache: Optional[SegmentationCache] = None,
+                 packs: Optional[ScenePacks] = None, masks: Optional[SceneMasks] = None):
+        self.base_url = base_url or os.environ.get("IMAGE_SERVICE_URL", "http://localhost:11245")
+        # Pooled, rate-limited client shared by every service with this URL
+        self.backend = get_backend("image", self.base_url)
+        # Images already segmented (by any player) are answered from here, see SegmentationCache
+        self.cache = cache if cache is not None else segmentation_cache
+        # Scenes with a pack cost no GPU time at all
+        self.packs = packs if packs is not None else scene_packs
+        self.masks = masks if masks is not None else scene_masks
         
     def generate_image(self, params: ImageGenerationParameters) -> Dict[str, Any]:
         """Generate an image using the provided parameters
         
+        Scenes with a pack are answered from it. Other results are cached by image
+        content, concurrent calls for the same image share one request. Results
+        carry the scene id that reveal deltas of the scene are asked with.
+
         Args:
             params: The parameters for image generation
             
         Returns:
             The response from the image generation API
         """
+        key = image_key(params.image)
+        if key is None:
+            return self._process_image(params)
+        result = self._from_pack(key, params.mask_format)
+        if result is not None:
+            return result
+        result = self.cache.get_or_compute(key, lambda: self._process_image(params))
+        return self._with_scene(key, result, params.mask_format)
+
+    def _process_image(self, params: ImageGenerationParameters) -> Dict[str, Any]:
+        """POST the image to /process_image"""
         try:
-            # Prepare the request payload
-            payload = {
-                "image": params.image,
-            }
-            
             # Send the request to the image generation API
-            response = requests.post(
-                f"{self.base_url}/process_image",
-                json=payload,
-                headers={"Content-Type": "application/json"},
+            response = self.backend.request(
+                "POST",
+                "/process_image",
                 timeout=80,
-                verify=False  # verify=False to ignore SSL certificate validation
-
+                **self._request_body(params)
             )
             
             # Raise an exception if the request failed
@@ -51,7 +83,7 @@ class ImageGenerationService:
             result = response.json()
             return result
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, BackendUnavailable) as e:
             logger.error(f"Error communicating with image generation API: {str(e)}")
             raise
         except json.JSONDecodeError as e:
@@ -60,6 +92,67 @@ class ImageGenerationService:
         except Exception as e:
             logger.error(f"Unexpected error in image generation: {str(e)}")
             raise
+
+    async def agenerate_image(self, params: ImageGenerationParameters) -> Dict[str, Any]:
+        """generate_image for async views, sent over the event loop's shared connection pool
+        
+        Args:
+            params: The parameters for image generation
+            
+        Returns:
+            The response from the image generation API
+        """
+        # Decoding the image to hash its pixels is CPU work, kept off the event loop
+        key = await asyncio.to_thread(image_key, params.image)
+        if key is None:
+            return await self._aprocess_image(params)
+        # So is opening and mapping a scene's pack, the first time the scene is played
+        result = await asyncio.to_thread(self._from_pack, key, params.mask_format)
+        if result is not None:
+            return result
+        result = await self.cache.aget_or_compute(key, lambda: self._aprocess_image(params))
+        return await asyncio.to_thread(self._with_scene, key, result, params.mask_format)
+
+    def _from_pack(self, key: ImageKey, mask_format: str) -> Optional[Dict[str, Any]]:
+        """The result stored in the scene's pack, None if the scene has none"""
+        pack = self.packs.get(key)
+        return pack.result(mask_format) if pack is not None else None
+
+    def _with_scene(self, key: ImageKey, result: Dict[str, Any], mask_format: str) -> Dict[str, Any]:
+        """The result with its scene id, its masks kept as BitMasks for reveals (and sent as RLE if asked)"""
+        masks = self.masks.remember(key.pixels, result)
+        result = {**result, "scene": key.pixels}
+        if mask_format == "rle":
+            result["class_mask_pairs"] = {**(result.get("class_mask_pairs") or {}),
+                                          **{name: mask.as_rle_dict() for name, mask in masks.items()}}
+        return result
+
+    async def _aprocess_image(self, params: ImageGenerationParameters) -> Dict[str, Any]:
+        """POST the image to /process_image on the event loop's shared connection pool"""
+        try:
+            response = await self.backend.arequest("POST", "/process_image", timeout=80, **self._request_body(params))
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, BackendUnavailable) as e:
+            logger.error(f"Error communicating with image generation API: {str(e)}")
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing response from image generation API: {str(e)}")
+            raise
+
+    @staticmethod
+    def _request_body(params: ImageGenerationParameters) -> Dict[str, Any]:
+        """Body and headers of a /process_image request, the same for requests and httpx"""
+        if isinstance(params.image, (bytes, bytearray, memoryview)):
+            # Binary transport: the image goes as a multipart file, without the base64 overhead
+            return {
+                "files": {"image": ("image.png", bytes(params.image))},
+                "headers": {"Accept": "application/json"},
+            }
+        return {
+            "json": {"image": params.image},
+            "headers": {"Content-Type": "application/json"},
+        }
     
     def encode_image_to_base64(self, image_path: str) -> str:
         """Encode an image file to base64
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Raised when a JobManager already has max_pending jobs waiting or running"""
+
+
+@dataclass
+class Job:
+    """A long-running backend call run by a JobManager.
+
+    The job function receives the Job and reports results that are ready
+    before the whole job is with add_partial() while it runs. Readers take a
+    snapshot with partial_results(), as the worker thread keeps adding to it.
+    """
+    id: str
+    kind: str
+    status: str = "queued"
+    progress: float = 0.0
+    partial: Dict[str, Any] = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_partial(self, name: str, value: Any, total: Optional[int] = None) -> None:
+        """Store a result that is ready, and set the progress to the share of ``total`` results done"""
+        with self._lock:
+            self.partial[name] = value
+            if total:
+                self.progress = len(self.partial) / total
+
+    def partial_results(self) -> Dict[str, Any]:
+        """Copy of the results that are ready so far"""
+        with self._lock:
+            return dict(self.partial)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Status of the job, without its result"""
+        with self._lock:
+            ready, progress = sorted(self.partial), self.progress
+        status = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": progress,
+            "ready": ready,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobManager:
+    """Bounded worker pool for one backend, plus a store of its jobs' results.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending`` are
+    queued or running, further submissions raise JobQueueFull. Finished jobs
+    stay retrievable for ``ttl`` seconds.
+
+    Jobs live in this process's memory, so with several server processes the
+    status requests have to reach the process that accepted the job.
+
+    Args:
+        name: Backend name, used for the worker thread names
+        max_workers: Jobs run concurrently
+        max_pending: Jobs queued or running before submissions are refused
+        ttl: Seconds a finished job is kept
+        clock: Time source for job timestamps and expiry
+    """
+
+    def __init__(self, name: str, max_workers: int = 2, max_pending: int = 16, ttl: float = 3600,
+                 clock: Callable[[], float] = time.time):
+        self.name = name
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.clock = clock
+        self.expired = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-job")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """Run fn(job, *args, **kwargs) on the pool, its return value becomes the job's result.
+
+        Raises:
+            JobQueueFull: max_pending jobs are already queued or running
+        """
+        with self._lock:
+            self._evict()
+            if sum(1 for job in self._jobs.values() if not job.finished) >= self.max_pending:
+                raise JobQueueFull(f"{self.name} already has {self.max_pending} jobs queued")
+            job = Job(id=uuid.uuid4().hex, kind=kind, created_at=self.clock())
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job, or None if the id is unknown or has expired"""
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            counts["expired"] = self.expired
+            return counts
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        job.started_at = self.clock()
+        job.status = "running"
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            status = "succeeded"
+        except Exception as e:
+            logger.error(f"{self.name} job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            status = "failed"
+        # finished_at has to be set before the status says finished, eviction reads it
+        job.finished_at = self.clock()
+        job.status = status
+
+    def _evict(self) -> None:
+        now = self.clock()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at >= self.ttl]:
+            del self._jobs[job_id]
+            self.expired += 1
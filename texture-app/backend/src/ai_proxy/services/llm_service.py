@@ -1,12 +1,16 @@
 import requests
+import httpx
 import logging
 import json
 import os
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Tuple
 from django.conf import settings
 from dotenv import load_dotenv
 
+from . import wire
+from .backend_client import BackendClient, BackendUnavailable, get_backend
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -19,6 +23,39 @@ class Message:
     role: str  # 'system', 'user', or 'assistant'
     content: str
 
+
+@dataclass
+class LLMResponse:
+    """A completion of the LLM service, decoded once from the wire.
+
+    Args:
+        answer: The assistant's message, empty if the LLM service sent none
+        status: Status reported by the LLM service
+        data: The decoded response body
+    """
+    answer: str
+    status: str = "success"
+    data: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LLMResponse":
+        """Read a {"received_data": {"answer": ...}} body of the LLM server, or an OpenAI style {"choices": ...} one"""
+        answer = ""
+        received_data = data.get("received_data")
+        if isinstance(received_data, dict):
+            answer = received_data.get("answer") or ""
+        choices = data.get("choices")
+        if not answer and isinstance(choices, list) and choices and isinstance(choices[0], dict):
+            message = choices[0].get("message")
+            if isinstance(message, dict):
+                answer = message.get("content") or ""
+        return cls(answer=answer, status=data.get("status", "success"), data=data)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The response body as the LLM service sent it"""
+        return self.data or {"status": self.status, "received_data": {"answer": self.answer}}
+
+
 class LLMService:
 
     """
@@ -41,34 +78,29 @@ class LLMService:
 
         logger.info(f"LLM Service initialized with URL: {self.url}")
 
-    def create_chat_completion(self, 
-                              messages: List[Message], 
-                              system_prompt: Optional[str] = None,
-                              temperature: Optional[float] = None,
-                              max_tokens: Optional[int] = None,
-                              object_details: Optional[str] = None) -> Dict[str, Any]:
-        """
-        Send a chat completion request to the LLM service.
-        Args:
-            messages: List of message objects with role and content
-            system_prompt: Override the default system prompt
-            temperature: Override the default temperature
-            max_tokens: Override the default max_tokens
-            
-        Returns:
-            Dict containing the LLM response
-        """
+    @property
+    def backend(self) -> BackendClient:
+        """Pooled, rate-limited client of the LLM server, shared by every LLMService with the same URL"""
+        return get_backend("llm", self.url)
+
+    def _build_payload(self,
+                       messages: List[Message],
+                       system_prompt: Optional[str] = None,
+                       temperature: Optional[float] = None,
+                       max_tokens: Optional[int] = None,
+                       object_details: Optional[str] = None,
+                       conversation_id: Optional[int] = None) -> Dict[str, Any]:
+        """Build the request body shared by the blocking and streaming endpoints."""
 
-        # No need for params variable as it's not used
-        
-        endpoint = f"{self.url}/generate_answer"
-    
         ## What we send to the LLM service
 
         ## Here what to send to LLM service - simplified to match working test implementation
         payload = {
                 "messages": [{"role": msg.role, "content": msg.content} for msg in messages]
                 }
+        if conversation_id is not None:
+            # Lets the LLM server reuse the tokenization of earlier turns
+            payload["conversation_id"] = str(conversation_id)
   
         # Keep these parameters for debugging/logging purposes only
         debug_info = {
@@ -90,40 +122,173 @@ class LLMService:
                 msg.content = msg.content + f".These are the objects {object_details}. You shouldn't give any exact information about them. Instead, as a part of the game, you may give hints. Some descriptive words. Whenever,ever, you get one of this object in the User prompt, you should congratulate the user. ALways give the riddle one by one"
                 payload["messages"].insert(0, {"role": "system", "content": msg.content})
 
+        return payload
+
+    def create_chat_completion(self, 
+                              messages: List[Message], 
+                              system_prompt: Optional[str] = None,
+                              temperature: Optional[float] = None,
+                              max_tokens: Optional[int] = None,
+                              object_details: Optional[str] = None,
+                              conversation_id: Optional[int] = None) -> Optional[LLMResponse]:
+        """
+        Send a chat completion request to the LLM service.
+        Args:
+            messages: List of message objects with role and content
+            system_prompt: Override the default system prompt
+            temperature: Override the default temperature
+            max_tokens: Override the default max_tokens
+            conversation_id: Conversation the messages belong to, if any
+            
+        Returns:
+            The LLM response, None if the LLM service failed
+        """
+
+        payload = self._build_payload(messages, system_prompt, temperature, max_tokens, object_details,
+                                      conversation_id)
+        return self._send(payload)
+
+    def complete(self,
+                 messages: List[Message],
+                 temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None) -> Optional[LLMResponse]:
+        """
+        Send the messages as they are, without the game's system prompt and object details,
+        for tasks like generating a scene's riddles.
+        Args:
+            messages: List of message objects with role and content
+            temperature: Override the default temperature
+            max_tokens: Override the default max_tokens
+
+        Returns:
+            The LLM response, None if the LLM service failed
+        """
+        return self._send({
+            "messages": [{"role": msg.role, "content": msg.content} for msg in messages],
+            "temperature": temperature if temperature is not None else self.temperature,
+            "max_tokens": max_tokens if max_tokens is not None else self.max_tokens,
+        })
+
+    def _send(self, payload: Dict[str, Any]) -> Optional[LLMResponse]:
+        """POST a payload to /generate_answer"""
         try:
-            logger.debug("Sending request to {endpoint} with payload: {payload}")
+            logger.debug(f"Sending request to {self.url}/generate_answer with payload: {payload}")
 
             ## Here I need to send the request to the LLM service
 
-            response = requests.post(
-                endpoint, 
-                json=payload,
-                timeout=80,
-                verify=False  # verify=False to ignore SSL certificate validation
+            response = self.backend.request(
+                "POST",
+                "/generate_answer",
+                data=wire.dumps_json(payload),
+                headers=wire.request_headers(),
+                timeout=80
             )
-        # Check if the request was successful
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-                    logger.info("Chat completion successful!")
-                    logger.info(f"Response: {json.dumps(result, indent=2)}")
-                    return json.dumps(result, indent=2)
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse response as JSON: {response.text}")
-                    return False
-            else:
-                logger.error(f"Chat completion failed with status code {response.status_code}: {response.text}")
-                return False
-
-        except requests.exceptions.RequestException as e:
+            return self._completion_result(response.status_code, response.content,
+                                           response.headers.get("Content-Type", ""))
+
+        except (requests.exceptions.RequestException, BackendUnavailable) as e:
             logger.error(f"Error communicating with LLM service: {str(e)}")
             raise Exception(f"Failed to communicate with LLM service: {str(e)}")
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing LLM service response: {str(e)}")
-            raise Exception(f"Failed to parse LLM service response: {str(e)}")
+    async def acreate_chat_completion(self,
+                                      messages: List[Message],
+                                      system_prompt: Optional[str] = None,
+                                      temperature: Optional[float] = None,
+                                      max_tokens: Optional[int] = None,
+                                      object_details: Optional[str] = None,
+                                      conversation_id: Optional[int] = None) -> Optional[LLMResponse]:
+        """
+        create_chat_completion for async views, sent over the event loop's shared connection pool.
+        Takes the same arguments and returns the same result.
+        """
+
+        payload = self._build_payload(messages, system_prompt, temperature, max_tokens, object_details,
+                                      conversation_id)
+
+        try:
+            response = await self.backend.arequest("POST", "/generate_answer", content=wire.dumps_json(payload),
+                                                   headers=wire.request_headers(), timeout=80)
+        except (httpx.HTTPError, BackendUnavailable) as e:
+            logger.error(f"Error communicating with LLM service: {str(e)}")
+            raise Exception(f"Failed to communicate with LLM service: {str(e)}")
+        return self._completion_result(response.status_code, response.content,
+                                       response.headers.get("Content-Type", ""))
+
+    def _completion_result(self, status_code: int, body: bytes, content_type: str) -> Optional[LLMResponse]:
+        """The completion decoded from a response body, or None when the LLM service failed"""
+        # Check if the request was successful
+        if status_code != 200:
+            logger.error(f"Chat completion failed with status code {status_code}: {body[:1000]!r}")
+            return None
+        try:
+            result = wire.decode(body, content_type)
+        except ValueError:
+            logger.error(f"Failed to parse {content_type or 'untyped'} response: {body[:1000]!r}")
+            return None
+        if not isinstance(result, dict):
+            logger.error(f"Unexpected chat completion response: {body[:1000]!r}")
+            return None
+        response = LLMResponse.from_dict(result)
+        logger.debug(f"Chat completion successful, {len(response.answer)} characters")
+        return response
+
+    def stream_chat_completion(self,
+                               messages: List[Message],
+                               system_prompt: Optional[str] = None,
+                               temperature: Optional[float] = None,
+                               max_tokens: Optional[int] = None,
+                               object_details: Optional[str] = None,
+                               conversation_id: Optional[int] = None) -> Iterator[str]:
+        """
+        Stream a chat completion from the LLM service's Server-Sent Events endpoint.
+        Args:
+            messages: List of message objects with role and content
+            system_prompt: Override the default system prompt
+            temperature: Override the default temperature
+            max_tokens: Override the default max_tokens
+            conversation_id: Conversation the messages belong to, if any
+
+        Yields:
+            Text chunks of the answer as soon as the LLM service decodes them
+        """
+
+        payload = self._build_payload(messages, system_prompt, temperature, max_tokens, object_details,
+                                      conversation_id)
+
+        try:
+            # The read timeout applies between chunks, not to the whole completion
+            with self.backend.stream("POST", "/generate_answer_stream", json=payload, timeout=(10, 80)) as response:
+                if response.status_code != 200:
+                    logger.error(f"Chat completion stream failed with status code {response.status_code}: {response.text}")
+                    raise Exception(f"LLM service returned status code {response.status_code}")
+
+                for event, data in iter_sse(response.iter_lines(decode_unicode=True)):
+                    if event == "error":
+                        raise Exception(f"LLM service error: {data.get('error')}")
+                    if event == "done":
+                        return
+                    if data.get("delta"):
+                        yield data["delta"]
+
+        except (requests.exceptions.RequestException, BackendUnavailable) as e:
+            logger.error(f"Error communicating with LLM service: {str(e)}")
+            raise Exception(f"Failed to communicate with LLM service: {str(e)}")
 
 
+def iter_sse(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    """Parse a Server-Sent Events line stream into (event name, JSON data) pairs."""
+    event, data = None, []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
 
 
 if __name__ == "__main__":
@@ -149,7 +314,7 @@ if __name__ == "__main__":
         # Print the response
         print("\nConnection test successful!")
         print("Response from LLM service:")
-        print(json.dumps(response, indent=2))
+        print(response.answer if response else response)
         
     except Exception as e:
         print(f"\nConnection test failed: {str(e)}")
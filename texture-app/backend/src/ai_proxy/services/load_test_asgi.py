@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Concurrent capacity of the chat endpoint served blocking (WSGI) vs async (ASGI).
+
+A fake LLM backend answers every request after --delay seconds, like a busy
+GPU box. --requests chat turns are fired at once:
+
+  wsgi: the blocking chat/message/ view on a pool of --threads worker threads,
+        the way gunicorn --threads serves texture_app.wsgi
+  asgi: the async/chat/message/ view, every request on one event loop through
+        Django's ASGI handler, the way uvicorn serves texture_app.asgi
+
+For each it reports the wall time, the throughput and the most backend calls
+that were in flight at once. Under WSGI that is capped by the thread count,
+under ASGI every request can wait on the backend at the same time.
+
+    python load_test_asgi.py
+    python load_test_asgi.py --requests 500 --delay 2 --threads 16
+
+Against real servers (start the fake backend with --backend-only and point
+LLM_SERVICE_URL/LLM_SERVICE_PORT of both servers at it):
+
+    python load_test_asgi.py --backend-only --backend-port 8390
+    gunicorn -w 1 --threads 16 -b :8000 texture_app.wsgi
+    uvicorn --port 8001 texture_app.asgi:application
+    python load_test_asgi.py --url http://localhost:8000/api/ai_proxy/chat/message/ \\
+                             --url http://localhost:8001/api/ai_proxy/async/chat/message/
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class FakeLLMBackend:
+    """LLM service stand-in that answers /generate_answer after a fixed delay and counts concurrent calls"""
+
+    def __init__(self, delay, port=0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with backend._lock:
+                    backend.calls += 1
+                    backend.in_flight += 1
+                    backend.max_in_flight = max(backend.max_in_flight, backend.in_flight)
+                time.sleep(backend.delay)
+                with backend._lock:
+                    backend.in_flight -= 1
+                body = json.dumps({"received_data": {"answer": "It has four legs."}, "status": "success"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # Room for every request of the burst in the listen backlog
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", port), Handler)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self):
+        self.max_in_flight = 0
+        self.calls = 0
+
+
+def setup_django(backend):
+    os.environ["LLM_SERVICE_URL"] = "http://127.0.0.1"
+    os.environ["LLM_SERVICE_PORT"] = str(backend.port)
+    os.environ.setdefault("CHATBOT_SYSTEM_PROMPT", "You are the riddle master.")
+    sys.path.append(str(Path(__file__).resolve().parents[3]))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "texture_app.settings")
+
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    # A throwaway database file, the real one is left alone. SQLite's in-memory database
+    # locks whole tables across threads, a file with a busy timeout behaves like production.
+    connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "load_test.sqlite3")
+    connection.settings_dict["OPTIONS"]["timeout"] = 60
+    connection.creation.create_test_db(verbosity=0)
+
+
+def report(name, seconds, statuses, backend=None):
+    ok = sum(1 for status in statuses if status == 200)
+    line = f"{name:>5}: {len(statuses)} requests in {seconds:6.2f} s, {len(statuses) / seconds:7.1f} req/s, {ok} ok"
+    if backend is not None:
+        line += f", max backend calls in flight {backend.max_in_flight}"
+    print(line)
+
+
+def run_wsgi(count, threads):
+    from django.test import Client
+
+    def turn(i):
+        return Client().post("/api/ai_proxy/chat/message/", {"message": f"Is it a chair? {i}"},
+                             content_type="application/json").status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(turn, range(count)))
+    return time.perf_counter() - start, statuses
+
+
+async def run_asgi(count):
+    from django.test import AsyncClient
+
+    async def turn(i):
+        response = await AsyncClient().post("/api/ai_proxy/async/chat/message/", {"message": f"Is it a chair? {i}"},
+                                            content_type="application/json")
+        return response.status_code
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(turn(i) for i in range(count)))
+    return time.perf_counter() - start, statuses
+
+
+async def run_url(url, count):
+    import httpx
+
+    limits = httpx.Limits(max_connections=count)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600.0)) as client:
+        async def turn(i):
+            response = await client.post(url, json={"message": f"Is it a chair? {i}"})
+            return response.status_code
+
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(turn(i) for i in range(count)))
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare WSGI and ASGI concurrent capacity of the chat endpoint")
+    parser.add_argument("--requests", type=int, default=200, help="Chat turns fired at once")
+    parser.add_argument("--delay", type=float, default=1.0, help="Seconds the fake backend takes per answer")
+    parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads")
+    parser.add_argument("--url", action="append", help="Load test a running server instead (repeatable)")
+    parser.add_argument("--backend-only", action="store_true", help="Only run the fake LLM backend")
+    parser.add_argument("--backend-port", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = FakeLLMBackend(args.delay, args.backend_port).start()
+    if args.backend_only:
+        print(f"Fake LLM backend on port {backend.port}, {args.delay} s per answer")
+        threading.Event().wait()
+
+    if args.url:
+        for url in args.url:
+            seconds, statuses = asyncio.run(run_url(url, args.requests))
+            report(url, seconds, statuses)
+        return
+
+    setup_django(backend)
+    print(f"{args.requests} concurrent chat turns, backend answers in {args.delay} s")
+
+    seconds, statuses = run_wsgi(args.requests, args.threads)
+    report("wsgi", seconds, statuses, backend)
+
+    backend.reset()
+    seconds, statuses = asyncio.run(run_asgi(args.requests))
+    report("asgi", seconds, statuses, backend)
+
+
+if __name__ == "__main__":
+    main()
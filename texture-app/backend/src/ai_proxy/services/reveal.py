@@ -0,0 +1,222 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitmask import BBox, BitMask
+from .scene_pack import ScenePacks
+from .segmentation_cache import SegmentationCache
+
+logger = logging.getLogger(__name__)
+
+
+class SceneMasks:
+    """Object masks of recently played scenes as BitMasks, by scene id (the scene image's pixel hash)
+
+    Masks are decoded once from the segmentation result when a scene is
+    loaded, or read from the scene's pack. A process that hasn't loaded the
+    scene itself decodes them from the shared segmentation cache. The least
+    recently used scenes are dropped once their masks take more than
+    ``max_bytes``.
+
+    Args:
+        packs: Scene packs to read masks from for scenes that aren't in memory
+        max_bytes: Memory budget of the decoded masks
+        cache: Segmentation results to decode masks from for scenes that are in neither
+    """
+
+    def __init__(self, packs: Optional[ScenePacks] = None, max_bytes: int = 64 * 1024 * 1024,
+                 cache: Optional[SegmentationCache] = None):
+        self.packs = packs
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._scenes: "OrderedDict[str, Dict[str, BitMask]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, scene: str, masks: Dict[str, BitMask]) -> None:
+        with self._lock:
+            self._drop(scene)
+            self._scenes[scene] = masks
+            self.bytes += sum(mask.nbytes for mask in masks.values())
+            while self.bytes > self.max_bytes and len(self._scenes) > 1:
+                self._drop(next(iter(self._scenes)))
+
+    def remember(self, scene: str, result: Dict[str, Any]) -> Dict[str, BitMask]:
+        """The scene's masks, decoded from the class_mask_pairs of its segmentation result unless known already"""
+        masks = self._known(scene)
+        return masks if masks is not None else self._decode(scene, result)
+
+    def get(self, scene: str) -> Optional[Dict[str, BitMask]]:
+        """The scene's masks by object name, None if the scene is unknown"""
+        masks = self._known(scene)
+        if masks is not None:
+            return masks
+        result = self.cache.result_of(scene) if self.cache is not None else None
+        return self._decode(scene, result) if result is not None else None
+
+    def _known(self, scene: str) -> Optional[Dict[str, BitMask]]:
+        """The scene's masks if they are in memory or in its pack"""
+        with self._lock:
+            masks = self._scenes.get(scene)
+            if masks is not None:
+                self._scenes.move_to_end(scene)
+                return masks
+        pack = self.packs.get(scene) if self.packs is not None else None
+        # Pack masks are views of the mapped file, they cost no memory of their own
+        return pack.masks() if pack is not None else None
+
+    def _decode(self, scene: str, result: Dict[str, Any]) -> Dict[str, BitMask]:
+        masks: Dict[str, BitMask] = {}
+        for name, mask in (result.get("class_mask_pairs") or {}).items():
+            bits = BitMask.from_image(mask) if isinstance(mask, (str, bytes)) else None
+            if bits is None:
+                continue
+            if masks and bits.shape != next(iter(masks.values())).shape:
+                logger.warning(f"Mask of {name} in scene {scene} has another size than the others, skipped")
+                continue
+            masks[name] = bits
+        self.put(scene, masks)
+        return masks
+
+    def _drop(self, scene: str) -> None:
+        masks = self._scenes.pop(scene, None)
+        if masks is not None:
+            self.bytes -= sum(mask.nbytes for mask in masks.values())
+
+
+@dataclass
+class RevealDelta:
+    """What one guess uncovered: the pixels that became visible, as RLE of their bounding box
+
+    The client ORs the run lengths into its reveal mask inside ``bbox``, the
+    rest of the image is unchanged. A client whose version is not
+    ``base_version`` missed a delta and asks RevealCompositor.state() instead.
+
+    Args:
+        version: Reveal state version after this delta, the number of objects found
+        base_version: Version the delta applies to
+        objects: Objects uncovered
+        size: (width, height) of the scene's masks
+        bbox: (left, top, right, bottom) of the changed region, None if nothing changed
+        counts: BitMask.to_rle() of the newly visible pixels inside bbox
+    """
+    version: int
+    base_version: int
+    objects: List[str]
+    size: Tuple[int, int]
+    bbox: Optional[BBox]
+    counts: List[int]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "base_version": self.base_version,
+            "objects": self.objects,
+            "size": list(self.size),
+            "bbox": list(self.bbox) if self.bbox is not None else None,
+            "counts": self.counts,
+        }
+
+
+class RevealStore:
+    """Objects found per conversation, in this process's memory
+
+    What RevealCompositor keeps its state in. For a single process, tests and
+    benchmarks; several processes share theirs through the database
+    (reveal_store.ConversationReveals) and must use that.
+
+    Args:
+        max_entries: Conversations kept, the least recently used are forgotten
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._found: "OrderedDict[Any, Tuple[str, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def advance(self, conversation_id: Any, scene: str, objects: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """Add objects to those found in the scene, starting over if the conversation played another one
+
+        Returns:
+            (the objects found before, the objects newly found)
+        """
+        with self._lock:
+            previous = self._revealed(conversation_id, scene)
+            new = [name for name in dict.fromkeys(objects) if name not in previous]
+            self._found[conversation_id] = (scene, previous + new)
+            self._found.move_to_end(conversation_id)
+            while len(self._found) > self.max_entries:
+                self._found.popitem(last=False)
+            return previous, new
+
+    def revealed(self, conversation_id: Any, scene: str) -> List[str]:
+        with self._lock:
+            return self._revealed(conversation_id, scene)
+
+    def forget(self, conversation_id: Any) -> None:
+        with self._lock:
+            self._found.pop(conversation_id, None)
+
+    def _revealed(self, conversation_id: Any, scene: str) -> List[str]:
+        found_scene, found = self._found.get(conversation_id, (None, []))
+        return list(found) if found_scene == scene else []
+
+
+class RevealCompositor:
+    """Reveal state of each live conversation, updated one guess at a time
+
+    Instead of sending the whole re-encoded image or mask after every correct
+    guess, reveal() unions the guessed objects' masks into the conversation's
+    revealed pixels and returns only what changed (RevealDelta).
+
+    Only the objects found are stored, the revealed pixels are rebuilt from
+    the scene's masks when needed. The version of a conversation's state is
+    the number of objects found, so any process with the same store hands out
+    the same versions and deltas.
+
+    Args:
+        masks: Where the scenes' masks come from
+        store: Where the objects found are kept, anything with RevealStore's methods. This
+            process's memory by default.
+    """
+
+    def __init__(self, masks: SceneMasks, store: Optional[Any] = None):
+        self.masks = masks
+        self.store = store if store is not None else RevealStore()
+
+    def reveal(self, conversation_id: Any, scene: str, objects: Sequence[str]) -> Optional[RevealDelta]:
+        """Uncover objects in the conversation's scene, None if the scene's masks are unknown"""
+        masks = self.masks.get(scene)
+        if not masks:
+            return None
+        by_name = {name.lower(): name for name in masks}
+        names = [by_name[name.lower()] for name in objects if name.lower() in by_name]
+        previous, new = self.store.advance(conversation_id, scene, names)
+
+        added = self._union(masks, new) - self._union(masks, previous)
+        bbox = added.bbox()
+        return RevealDelta(version=len(previous) + len(new), base_version=len(previous), objects=new,
+                           size=(added.width, added.height), bbox=bbox,
+                           counts=added.crop(bbox).to_rle() if bbox is not None else [])
+
+    def state(self, conversation_id: Any, scene: str) -> Optional[Dict[str, Any]]:
+        """The conversation's whole reveal mask as RLE, for clients that missed a delta. None if the scene is unknown."""
+        masks = self.masks.get(scene)
+        if not masks:
+            return None
+        found = self.store.revealed(conversation_id, scene)
+        return {"version": len(found), "objects": sorted(found), **self._union(masks, found).as_rle_dict()}
+
+    def forget(self, conversation_id: Any) -> None:
+        self.store.forget(conversation_id)
+
+    @staticmethod
+    def _union(masks: Dict[str, BitMask], names: Sequence[str]) -> BitMask:
+        first = next(iter(masks.values()))
+        union = BitMask.empty(first.width, first.height)
+        for name in names:
+            if name in masks:
+                union = union | masks[name]
+        return union
@@ -0,0 +1,39 @@
+from typing import Any, List, Sequence, Tuple
+
+from django.db import transaction
+
+from ..models import Conversation
+
+
+class ConversationReveals:
+    """The objects found in each conversation's scene, kept on its Conversation row
+
+    The RevealStore of RevealCompositor for deployments with several
+    processes: every process reads and advances the same state, so they hand
+    out the same versions and deltas, and any of them can answer chat/reveal/.
+    """
+
+    def advance(self, conversation_id: Any, scene: str, objects: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """Add objects to those found in the scene, starting over if the conversation played another one
+
+        Returns:
+            (the objects found before, the objects newly found), both empty for an unknown conversation
+        """
+        with transaction.atomic():
+            row = Conversation.objects.select_for_update().filter(id=conversation_id).values(
+                "reveal_scene", "revealed_objects").first()
+            if row is None:
+                return [], []
+            previous = list(row["revealed_objects"]) if row["reveal_scene"] == scene else []
+            new = [name for name in dict.fromkeys(objects) if name not in previous]
+            if new or row["reveal_scene"] != scene:
+                Conversation.objects.filter(id=conversation_id).update(
+                    reveal_scene=scene, revealed_objects=previous + new)
+        return previous, new
+
+    def revealed(self, conversation_id: Any, scene: str) -> List[str]:
+        row = Conversation.objects.filter(id=conversation_id).values("reveal_scene", "revealed_objects").first()
+        return list(row["revealed_objects"]) if row is not None and row["reveal_scene"] == scene else []
+
+    def forget(self, conversation_id: Any) -> None:
+        Conversation.objects.filter(id=conversation_id).update(reveal_scene="", revealed_objects=[])
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Sequence, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .guess_matcher import lemma, normalize
+from .llm_service import LLMService, Message
+from ..models import Conversation, Riddle
+
+logger = logging.getLogger(__name__)
+
+RIDDLE_PROMPT = os.environ.get(
+    'RIDDLE_PROMPT',
+    "You write riddles for a hidden object game. For every object the user lists, write one short riddle "
+    "that describes it without naming it, and {hints} hints from vague to obvious that don't name it either. "
+    'Answer only with a JSON object mapping each object to {{"riddle": "...", "hints": ["...", ...]}}.'
+)
+HINTS_PER_RIDDLE = int(os.environ.get('RIDDLE_HINTS', '2'))
+
+# Words asking for a riddle or a hint. Long messages and negated ones ("I don't need a hint")
+# are left to the LLM.
+RIDDLE_WORDS = {"riddle", "puzzle"}
+NEXT_WORDS = {"next", "another", "skip", "more"}
+HINT_WORDS = {"hint", "clue"}
+HELP_WORDS = {"help", "stuck"}
+NEGATIONS = {"not", "nt", "no", "dont"}
+
+
+def riddle_intent(message: str) -> Optional[str]:
+    """"hint" or "riddle" if the message asks for one, None for anything else (guesses, questions, chat)"""
+    words = [lemma(word) for word in normalize(message)]
+    vocabulary = set(words)
+    if vocabulary & NEGATIONS:
+        return None
+    if vocabulary & HINT_WORDS or (len(words) <= 4 and vocabulary & HELP_WORDS):
+        return "hint"
+    if vocabulary & RIDDLE_WORDS and (len(words) <= 6 or vocabulary & NEXT_WORDS):
+        return "riddle"
+    if len(words) <= 3 and vocabulary & NEXT_WORDS:
+        return "riddle"
+    return None
+
+
+def parse_riddles(text: str, objects: Sequence[str]) -> Dict[str, Dict[str, object]]:
+    """Riddles and hints per object from the LLM's JSON answer
+
+    Objects the answer leaves out, and riddles or hints that give away the
+    object's name, are dropped.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    by_name = {name.lower(): entry for name, entry in parsed.items() if isinstance(entry, dict)}
+    riddles = {}
+    for name in objects:
+        entry = by_name.get(name.lower())
+        if entry is None:
+            continue
+        name_words = [lemma(word) for word in normalize(name)]
+
+        def gives_away(text):
+            words = [lemma(word) for word in normalize(text)]
+            return any(words[i:i + len(name_words)] == name_words for i in range(len(words)))
+
+        riddle = entry.get("riddle")
+        if not isinstance(riddle, str) or not riddle.strip() or gives_away(riddle):
+            continue
+        hints = [hint.strip() for hint in entry.get("hints") or [] if isinstance(hint, str) and hint.strip()]
+        riddles[name] = {"riddle": riddle.strip(), "hints": [hint for hint in hints if not gives_away(hint)]}
+    return riddles
+
+
+class RiddleService:
+    """Pre-generates a scene's riddles in one LLM call and serves them from a per-conversation queue
+
+    Riddles are cached per scene (its set of objects), so every player of a
+    scene shares one generation call; players who start a scene while its
+    riddles are being written wait for that call instead of making their own.
+    Each conversation gets its own Riddle rows and works through them in
+    order, skipping objects already found.
+
+    Args:
+        llm_service: LLM used for generation
+        max_scenes: Scenes whose riddles are kept in memory
+    """
+
+    _scenes: "OrderedDict[Tuple[str, ...], Dict[str, Dict[str, object]]]" = OrderedDict()
+    _scenes_lock = threading.Lock()
+    _in_flight: Dict[Tuple[str, ...], Future] = {}
+
+    def __init__(self, llm_service: Optional[LLMService] = None, max_scenes: int = 256):
+        self.llm_service = llm_service or LLMService()
+        self.max_scenes = max_scenes
+
+    def generate(self, objects: Sequence[str]) -> Dict[str, Dict[str, object]]:
+        """{object: {"riddle": str, "hints": [str]}} for the objects, from the cache or one LLM call"""
+        key = tuple(sorted(name.lower() for name in objects))
+        with self._scenes_lock:
+            riddles = self._scenes.get(key)
+            if riddles is not None:
+                self._scenes.move_to_end(key)
+                return riddles
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            riddles = self._write(key, objects)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(riddles)
+            return riddles
+        finally:
+            with self._scenes_lock:
+                del self._in_flight[key]
+
+    def _write(self, key: Tuple[str, ...], objects: Sequence[str]) -> Dict[str, Dict[str, object]]:
+        """The one LLM call of generate(), its riddles are cached under ``key`` unless there are none"""
+        response = self.llm_service.complete(
+            messages=[
+                Message(role="system", content=RIDDLE_PROMPT.format(hints=HINTS_PER_RIDDLE)),
+                Message(role="user", content="Objects: " + ", ".join(objects)),
+            ],
+            max_tokens=100 + 150 * len(objects),
+        )
+        if response is None:
+            raise Exception("LLM service failed to generate riddles")
+        riddles = parse_riddles(response.answer, objects)
+        logger.info(f"Generated riddles for {len(riddles)} of {len(objects)} objects in one call")
+
+        if riddles:
+            with self._scenes_lock:
+                self._scenes[key] = riddles
+                while len(self._scenes) > self.max_scenes:
+                    self._scenes.popitem(last=False)
+        return riddles
+
+    def fill_queue(self, conversation: Conversation, objects: Sequence[str],
+                   known: Optional[Dict[str, Dict[str, object]]] = None) -> int:
+        """Queue riddles for the objects that don't have one queued in the conversation yet
+
+        Args:
+            conversation: Conversation to queue them for
+            objects: The scene's hidden objects
+            known: Riddles written offline (a scene pack's), used instead of the LLM
+
+        Returns:
+            Number of riddles added
+        """
+        queued = {name.lower() for name in Riddle.objects.filter(
+            conversation=conversation, served_at__isnull=True).values_list("object_name", flat=True)}
+        missing = [name for name in objects if name.lower() not in queued]
+        if not missing:
+            return 0
+        if known is None:
+            riddles = self.generate(missing)
+        else:
+            riddles = {name: known[name] for name in missing if name in known}
+        Riddle.objects.bulk_create([
+            Riddle(conversation=conversation, object_name=name, riddle=riddle["riddle"], hints=riddle["hints"])
+            for name, riddle in riddles.items()
+        ])
+        return len(riddles)
+
+    @staticmethod
+    def next_riddle(conversation: Conversation, hidden: Sequence[str]) -> Optional[str]:
+        """Serve the next queued riddle about an object that is still hidden, None if there is none"""
+        hidden = {name.lower() for name in hidden}
+        with transaction.atomic():
+            for riddle in Riddle.objects.select_for_update().filter(conversation=conversation,
+                                                                    served_at__isnull=True):
+                if riddle.object_name.lower() in hidden:
+                    riddle.served_at = timezone.now()
+                    riddle.save(update_fields=["served_at"])
+                    return riddle.riddle
+        return None
+
+    @staticmethod
+    def current_riddle(conversation: Conversation, hidden: Sequence[str], for_update: bool = False) -> Optional[Riddle]:
+        """The last riddle given, None if there is none or its object has been found (is not in ``hidden``)"""
+        riddles = Riddle.objects.select_for_update() if for_update else Riddle.objects
+        riddle = riddles.filter(conversation=conversation, served_at__isnull=False).order_by("-served_at", "-id").first()
+        if riddle is None or riddle.object_name.lower() not in {name.lower() for name in hidden}:
+            return None
+        return riddle
+
+    @staticmethod
+    def next_hint(conversation: Conversation, hidden: Sequence[str]) -> Optional[str]:
+        """Serve the next hint of the last riddle given, None if it is solved or out of hints"""
+        with transaction.atomic():
+            riddle = RiddleService.current_riddle(conversation, hidden, for_update=True)
+            if riddle is None or riddle.hints_served >= len(riddle.hints):
+                return None
+            hint = riddle.hints[riddle.hints_served]
+            riddle.hints_served += 1
+            riddle.save(update_fields=["hints_served"])
+            return hint
@@ -0,0 +1,221 @@
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+
+from . import wire
+from .bitmask import BitMask
+from .segmentation_cache import ImageKey
+
+logger = logging.getLogger(__name__)
+
+# Layout of a .pack file, all integers little endian:
+#   b"TXPK", u16 format version, u16 reserved, u32 header length
+#   header: JSON with the scene's key, size, segmentation result (masks taken out),
+#           riddles and, per object, the offset and length of its mask
+#   masks:  one bitset per object, the bits of its BitMask, 8 byte aligned
+MAGIC = b"TXPK"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGN = 8
+_DATA_URL_PREFIX = "data:image/png;base64,"
+_HEX = re.compile(r"[0-9a-f]{64}")
+
+
+def write_scene_pack(path: str, key: ImageKey, result: Dict[str, Any],
+                     riddles: Optional[Dict[str, Dict[str, object]]] = None, source: str = "") -> int:
+    """Write a scene's segmentation result and riddles as a pack, atomically
+
+    Masks in the result's class_mask_pairs that decode as images are stored as
+    bitsets and given back by ScenePack.result() as Base64 PNGs again (data URLs
+    if they were). Anything else in the result is kept as it is.
+
+    Args:
+        path: The .pack file
+        key: The scene image's key
+        result: The /process_image result of the image
+        riddles: RiddleService.generate() of the scene's objects
+        source: Where the image came from, for humans
+
+    Returns:
+        Size of the pack in bytes
+    """
+    result = dict(result)
+    pairs = dict(result.get("class_mask_pairs") or {})
+    objects, blobs, offset, shape = {}, [], 0, None
+    for name, mask in list(pairs.items()):
+        bits = BitMask.from_image(mask) if isinstance(mask, (str, bytes)) else None
+        if bits is None:
+            continue
+        if shape is not None and bits.shape != shape:
+            raise ValueError(f"Mask of {name} is {bits.width}x{bits.height}, the others {shape[1]}x{shape[0]}")
+        shape = bits.shape
+        packed = bits.bits.tobytes()
+        bbox = bits.bbox()
+        objects[name] = {
+            "offset": offset,
+            "length": len(packed),
+            "area": bits.count(),
+            # (left, top, right, bottom), right and bottom exclusive, None for an empty mask
+            "bbox": list(bbox) if bbox is not None else None,
+            "data_url": isinstance(mask, str) and mask.startswith("data:"),
+        }
+        padding = -len(packed) % _ALIGN
+        blobs.append(packed + b"\0" * padding)
+        offset += len(packed) + padding
+        del pairs[name]
+    result["class_mask_pairs"] = pairs
+
+    header = wire.dumps_json({
+        "pixels": key.pixels,
+        "dhash": key.dhash,
+        "width": shape[1] if shape else 0,
+        "height": shape[0] if shape else 0,
+        "source": source,
+        "result": result,
+        "riddles": riddles or {},
+        "objects": objects,
+    })
+    header += b" " * (-(_PREAMBLE.size + len(header)) % _ALIGN)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return _PREAMBLE.size + len(header) + offset
+
+
+class ScenePack:
+    """A scene pack mapped into memory, masks are read from the page cache on demand
+
+    Raises ValueError if the file is not a pack or has another format version.
+
+    Args:
+        path: The .pack file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _PREAMBLE.size:
+                raise ValueError(f"{path} is not a scene pack")
+            magic, version, _, header_length = _PREAMBLE.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a scene pack")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} is a version {version} scene pack, expected {FORMAT_VERSION}")
+            self.header = wire.loads_json(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        except BaseException:
+            self._map.close()
+            raise
+        self._data = _PREAMBLE.size + header_length
+        self.key = ImageKey(pixels=self.header["pixels"], dhash=self.header["dhash"])
+        self.width = self.header["width"]
+        self.height = self.header["height"]
+        self.objects: Dict[str, Dict[str, Any]] = self.header["objects"]
+        self.riddles: Dict[str, Dict[str, object]] = self.header["riddles"]
+
+    def mask(self, name: str) -> BitMask:
+        """Mask of an object, its bits read straight from the mapped file. KeyError if the pack has none."""
+        entry = self.objects[name]
+        bits = np.frombuffer(self._map, dtype=np.uint8, count=entry["length"], offset=self._data + entry["offset"])
+        return BitMask(self.width, self.height, bits)
+
+    def masks(self) -> Dict[str, BitMask]:
+        return {name: self.mask(name) for name in self.objects}
+
+    def result(self, mask_format: str = "png") -> Dict[str, Any]:
+        """The segmentation result the pack was built from, masks encoded as PNGs again (or as RLE)"""
+        result = dict(self.header["result"])
+        pairs = dict(result.get("class_mask_pairs") or {})
+        for name, entry in self.objects.items():
+            if mask_format == "rle":
+                pairs[name] = self.mask(name).as_rle_dict()
+                continue
+            encoded = self.mask(name).to_png()
+            pairs[name] = _DATA_URL_PREFIX + encoded if entry["data_url"] else encoded
+        result["class_mask_pairs"] = pairs
+        result["scene"] = result["scene_pack"] = self.key.pixels
+        return result
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class ScenePacks:
+    """The scene packs of a directory, by image content
+
+    Packs are built offline by the build_scene_packs management command and
+    named after the scene image's pixel hash, so a pack built while the proxy
+    runs is picked up by the next game of its scene. Packs are opened (mapped)
+    when their scene is first played and kept open.
+
+    Args:
+        directory: Where the packs live, None disables them
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._open: Dict[str, ScenePack] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ScenePacks":
+        """Configured by SCENE_PACK_DIR, unset disables scene packs"""
+        return cls(os.environ.get("SCENE_PACK_DIR") or None)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @staticmethod
+    def path_of(directory: str, key: Union[ImageKey, str]) -> str:
+        pixels = key.pixels if isinstance(key, ImageKey) else key
+        return os.path.join(directory, f"{pixels}.pack")
+
+    def get(self, key: Union[ImageKey, str]) -> Optional[ScenePack]:
+        """The pack of an image key or pixel hash, None if there is none (or it can't be read)"""
+        if not self.enabled:
+            return None
+        pixels = key.pixels if isinstance(key, ImageKey) else key
+        if not _HEX.fullmatch(pixels):
+            return None
+        with self._lock:
+            pack = self._open.get(pixels)
+            if pack is None:
+                path = self.path_of(self.directory, pixels)
+                try:
+                    pack = self._open[pixels] = ScenePack(path)
+                except FileNotFoundError:
+                    self.misses += 1
+                    return None
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping scene pack {path}: {str(e)}")
+                    self.misses += 1
+                    return None
+            self.hits += 1
+            return pack
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "open": len(self._open),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
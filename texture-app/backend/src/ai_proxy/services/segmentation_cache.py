@@ -0,0 +1,331 @@
+import asyncio
+import base64
+import binascii
+import glob
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from PIL import Image, UnidentifiedImageError
+
+from . import wire
+
+logger = logging.getLogger(__name__)
+
+# ImageKey.pixels, a SHA-256 hex digest
+_PIXELS = re.compile(r"[0-9a-f]{64}")
+
+
+@dataclass(frozen=True)
+class ImageKey:
+    """Cache key of an image
+
+    Args:
+        pixels: SHA-256 of the decoded pixels, equal for any lossless re-encoding of the image
+        dhash: 64 bit difference hash, close (in bits) for images that look alike
+    """
+    pixels: str
+    dhash: int
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """Difference hash: one bit per neighbouring pixel pair of a (size+1) x size grayscale thumbnail"""
+    pixels = image.convert("L").resize((size + 1, size), Image.BILINEAR).tobytes()
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return bits
+
+
+def image_key(image: Union[str, bytes]) -> Optional[ImageKey]:
+    """The key of a Base64 or raw encoded image, None if it isn't an image Pillow can read"""
+    try:
+        if isinstance(image, str):
+            image = base64.b64decode(image.split(",", 1)[-1] if image.startswith("data:") else image)
+        with Image.open(io.BytesIO(image)) as decoded:
+            decoded.load()
+            rgba = decoded.convert("RGBA")
+    except (binascii.Error, ValueError, OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return None
+    digest = hashlib.sha256(f"{rgba.width}x{rgba.height}".encode())
+    digest.update(rgba.tobytes())
+    return ImageKey(pixels=digest.hexdigest(), dhash=dhash(rgba))
+
+
+@dataclass
+class _Entry:
+    path: str
+    size: int
+    dhash: int
+
+
+class SegmentationCache:
+    """Disk-backed LRU of /process_image results, keyed by image content.
+
+    Scene images are shared by every player, so the same pixels get segmented
+    again and again. Results are stored as one JSON file per image, named
+    after its pixel hash and dHash; the least recently used files are deleted
+    once they take more than ``max_bytes``. With ``max_distance`` > 0 an image
+    whose dHash is at most that many bits away from a cached one reuses its
+    result (e.g. a re-compressed JPEG of the same scene).
+
+    Concurrent requests for the same image share one segmentation call
+    (singleflight): the first computes, the others wait for its result or
+    error. Errors are not cached.
+
+    Several processes may share the directory. Each keeps its own index,
+    picks up files the others wrote on a miss and treats files they evicted
+    as misses, so the bound holds per process rather than exactly.
+
+    Args:
+        directory: Where the result files live, created on first write
+        max_bytes: Disk budget, 0 disables the cache
+        max_distance: Largest dHash distance in bits treated as the same image, 0 for exact matches only
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024, max_distance: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls) -> "SegmentationCache":
+        """Configured by IMAGE_CACHE_DIR, IMAGE_CACHE_MB (0 disables) and IMAGE_CACHE_MAX_DISTANCE"""
+        return cls(
+            directory=os.environ.get("IMAGE_CACHE_DIR",
+                                     os.path.join(tempfile.gettempdir(), "texture_segmentation_cache")),
+            max_bytes=int(os.environ.get("IMAGE_CACHE_MB", "512")) * 1024 * 1024,
+            max_distance=int(os.environ.get("IMAGE_CACHE_MAX_DISTANCE", "0")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key_of(self, image: Union[str, bytes]) -> Optional[ImageKey]:
+        """image_key(), None as well when the cache is disabled"""
+        return image_key(image) if self.enabled else None
+
+    def get(self, key: ImageKey) -> Optional[Dict[str, Any]]:
+        """The cached result of the image or of a near duplicate, None on a miss"""
+        result, near = self._lookup(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            elif near:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+        return result
+
+    def result_of(self, pixels: str) -> Optional[Dict[str, Any]]:
+        """The cached result of exactly these pixels (an ImageKey.pixels), None if there is none. Not counted in the stats."""
+        # Scene ids come from clients, and end up in a glob pattern
+        if not self.enabled or not _PIXELS.fullmatch(pixels):
+            return None
+        with self._lock:
+            self._load()
+            entry = self._entries.get(pixels) or self._adopt(pixels)
+        return self._read(entry) if entry is not None else None
+
+    def put(self, key: ImageKey, result: Dict[str, Any]) -> None:
+        """Store a result, evicting the least recently used ones beyond max_bytes. Raises OSError if the disk does."""
+        body = wire.dumps_json(result)
+        if len(body) > self.max_bytes:
+            return
+        path = os.path.join(self.directory, f"{key.pixels}-{key.dhash:016x}.json")
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name and renamed, readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._load()
+            self._forget(key.pixels)
+            self._entries[key.pixels] = _Entry(path, len(body), key.dhash)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+                try:
+                    os.remove(evicted.path)
+                except FileNotFoundError:
+                    pass
+
+    def get_or_compute(self, key: ImageKey, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """The cached result, or compute() it once however many threads ask at the same time"""
+        result = self.get(key)
+        if result is not None:
+            return result
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            # A leader that finished between our miss and _join() may have cached it already
+            result = self._lookup(key)[0]
+            if result is None:
+                result = compute()
+                self._store(key, result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key)
+
+    async def aget_or_compute(self, key: ImageKey,
+                              compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """get_or_compute() for coroutines, the disk is read and written in a worker thread"""
+        result = await asyncio.to_thread(self.get, key)
+        if result is not None:
+            return result
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = (await asyncio.to_thread(self._lookup, key))[0]
+            if result is None:
+                result = await compute()
+                await asyncio.to_thread(self._store, key, result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+    def _lookup(self, key: ImageKey) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """The cached result or None, and whether it is a near duplicate's"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key.pixels) or self._adopt(key.pixels)
+            near = entry is None and self.max_distance > 0
+            if near:
+                entry = self._nearest(key.dhash)
+        return (self._read(entry) if entry is not None else None), near
+
+    def _store(self, key: ImageKey, result: Dict[str, Any]) -> None:
+        """put(), a full or read-only disk only costs the next request a segmentation call"""
+        try:
+            self.put(key, result)
+        except OSError as e:
+            logger.warning(f"Could not cache segmentation result in {self.directory}: {str(e)}")
+
+    def _join(self, key: ImageKey) -> Tuple[Future, bool]:
+        """The in-flight computation of the image, and whether the caller has to run it"""
+        with self._lock:
+            future = self._in_flight.get(key.pixels)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._in_flight[key.pixels] = Future()
+            return future, True
+
+    def _leave(self, key: ImageKey) -> None:
+        with self._lock:
+            self._in_flight.pop(key.pixels, None)
+
+    def _load(self) -> None:
+        """Index the files already on disk, least recently used first"""
+        if self._loaded:
+            return
+        self._loaded = True
+        paths = glob.glob(os.path.join(self.directory, "*-*.json"))
+        for path in sorted(paths, key=_mtime):
+            self._index(path)
+        if self._entries:
+            logger.info(f"Segmentation cache has {len(self._entries)} results, {self.bytes} bytes")
+
+    def _adopt(self, pixels: str) -> Optional[_Entry]:
+        """Index a result another process wrote since we loaded"""
+        for path in glob.glob(os.path.join(self.directory, f"{pixels}-*.json")):
+            return self._index(path)
+        return None
+
+    def _index(self, path: str) -> Optional[_Entry]:
+        pixels, _, dhash_hex = os.path.basename(path)[:-len(".json")].partition("-")
+        try:
+            entry = _Entry(path, os.path.getsize(path), int(dhash_hex, 16))
+        except (OSError, ValueError):
+            return None
+        self._forget(pixels)
+        self._entries[pixels] = entry
+        self.bytes += entry.size
+        return entry
+
+    def _forget(self, pixels: str) -> None:
+        entry = self._entries.pop(pixels, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def _nearest(self, target: int) -> Optional[_Entry]:
+        best, best_distance = None, self.max_distance + 1
+        for entry in self._entries.values():
+            distance = bin(entry.dhash ^ target).count("1")
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def _read(self, entry: _Entry) -> Optional[Dict[str, Any]]:
+        pixels = os.path.basename(entry.path).partition("-")[0]
+        try:
+            with open(entry.path, "rb") as f:
+                result = wire.loads_json(f.read())
+            os.utime(entry.path)  # the file's mtime is its LRU position after a restart
+        except (OSError, ValueError):
+            # Evicted by another process, or unreadable
+            result = None
+        with self._lock:
+            if result is None and self._entries.get(pixels) is entry:
+                self._forget(pixels)
+            elif result is not None and pixels in self._entries:
+                self._entries.move_to_end(pixels)
+        return result
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
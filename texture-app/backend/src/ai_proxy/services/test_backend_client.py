@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared backend client: concurrency limit, circuit breaker and stats.
+
+    python -m pytest test_backend_client.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.backend_client import BackendBusy, BackendClient, BackendUnavailable, CircuitBreaker
+
+
+class Backend:
+    """HTTP server answering every request with ``status`` after ``delay`` seconds"""
+
+    def __init__(self, status=200, delay=0.0):
+        self.status = status
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with backend.lock:
+                    backend.in_flight += 1
+                    backend.max_in_flight = max(backend.max_in_flight, backend.in_flight)
+                time.sleep(backend.delay)
+                with backend.lock:
+                    backend.in_flight -= 1
+                self.send_response(backend.status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def backend():
+    server = Backend(delay=0.05)
+    yield server
+    server.close()
+
+
+def test_blocking_calls_are_capped_at_max_in_flight(backend):
+    client = BackendClient("test", backend.url, max_in_flight=3)
+    threads = [threading.Thread(target=client.request, args=("GET", "/")) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.max_in_flight == 3
+    assert client.as_dict()["calls"] == 12
+    assert client.as_dict()["in_flight"] == 0
+
+
+def test_async_calls_are_capped_at_max_in_flight(backend):
+    client = BackendClient("test", backend.url, max_in_flight=4)
+
+    async def burst():
+        return await asyncio.gather(*(client.arequest("GET", "/") for _ in range(16)))
+
+    responses = asyncio.run(burst())
+    assert {response.status_code for response in responses} == {200}
+    assert backend.max_in_flight == 4
+
+
+def test_limit_holds_across_event_loops_and_blocking_callers(backend):
+    # Every asyncio.run() has its own loop, like each avatar request and WSGI-served async view
+    backend.delay = 0.1
+    client = BackendClient("test", backend.url, max_in_flight=3)
+
+    async def burst():
+        return await asyncio.gather(*(client.arequest("GET", "/") for _ in range(4)))
+
+    threads = [threading.Thread(target=asyncio.run, args=(burst(),)) for _ in range(3)]
+    threads += [threading.Thread(target=client.request, args=("GET", "/")) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.max_in_flight == 3
+    assert client.as_dict()["calls"] == 15 and client.as_dict()["in_flight"] == 0
+
+
+def test_async_waiters_do_not_hold_executor_threads(backend):
+    backend.delay = 0.2
+    client = BackendClient("test", backend.url, max_in_flight=1)
+
+    async def scenario():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        calls = [asyncio.ensure_future(client.arequest("GET", "/")) for _ in range(8)]
+        await asyncio.sleep(0.05)
+        # Other worker thread work on the loop isn't stuck behind the calls waiting for a slot
+        started = time.perf_counter()
+        await asyncio.to_thread(time.sleep, 0)
+        waited = time.perf_counter() - started
+        await asyncio.gather(*calls)
+        return waited
+
+    assert asyncio.run(scenario()) < 0.1
+    assert backend.max_in_flight == 1
+
+
+def test_cancelled_waiters_give_their_slot_back(backend):
+    backend.delay = 0.1
+    client = BackendClient("test", backend.url, max_in_flight=1)
+
+    async def scenario():
+        running = asyncio.ensure_future(client.arequest("GET", "/"))
+        waiting = [asyncio.ensure_future(client.arequest("GET", "/")) for _ in range(3)]
+        await asyncio.sleep(0.02)
+        for call in waiting[:2]:
+            call.cancel()
+        await asyncio.gather(running, waiting[2])
+        return await client.arequest("GET", "/")
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert client._slots.value == 1
+    assert client.as_dict()["in_flight"] == 0
+
+
+def test_open_circuit_fails_fast_instead_of_waiting_for_a_slot(backend):
+    backend.delay = 0.5
+    client = BackendClient("test", backend.url, max_in_flight=1, queue_timeout=5)
+    running = threading.Thread(target=client.request, args=("GET", "/"))
+    running.start()
+    time.sleep(0.1)
+    client.breaker.state, client.breaker.opened_at = "open", client.breaker.clock()
+
+    started = time.perf_counter()
+    with pytest.raises(BackendUnavailable):
+        client.request("GET", "/")
+    with pytest.raises(BackendUnavailable):
+        asyncio.run(client.arequest("GET", "/"))
+    assert time.perf_counter() - started < 0.1
+    running.join()
+
+
+def test_busy_backend_rejects_after_queue_timeout(backend):
+    backend.delay = 0.5
+    client = BackendClient("test", backend.url, max_in_flight=1, queue_timeout=0.05)
+    running = threading.Thread(target=client.request, args=("GET", "/"))
+    running.start()
+    time.sleep(0.1)
+    with pytest.raises(BackendBusy):
+        client.request("GET", "/")
+    with pytest.raises(BackendBusy):
+        asyncio.run(client.arequest("GET", "/"))
+    running.join()
+    assert client.as_dict()["rejected"] == 2
+
+
+def test_circuit_opens_on_server_errors_and_recovers(backend):
+    backend.status = 503
+    client = BackendClient("test", backend.url, failure_threshold=2, reset_timeout=0.2)
+    # 5xx answers reach the caller, but count against the backend
+    assert client.request("GET", "/").status_code == 503
+    assert client.request("GET", "/").status_code == 503
+    assert client.breaker.state == "open"
+    with pytest.raises(BackendUnavailable):
+        client.request("GET", "/")
+
+    backend.status = 200
+    time.sleep(0.25)
+    assert client.request("GET", "/").status_code == 200
+    assert client.as_dict()["circuit"] == "closed"
+    assert client.as_dict()["errors"] == 2
+
+
+def test_connection_errors_open_the_circuit():
+    server = Backend()
+    url = server.url
+    server.close()
+    client = BackendClient("down", url, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(Exception):
+        client.request("GET", "/")
+    started = time.perf_counter()
+    with pytest.raises(BackendUnavailable):
+        client.request("GET", "/")
+    assert time.perf_counter() - started < 0.05
+
+
+def test_half_open_circuit_lets_one_trial_call_through():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    with pytest.raises(BackendUnavailable):
+        breaker.before_call()
+
+    now[0] = 10.0
+    breaker.before_call()
+    with pytest.raises(BackendUnavailable):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Tests for the asyncio ComfyUI client and the parallel avatar pose generation
+built on it, run against an in-process fake ComfyUI.
+
+    python -m pytest test_comfy_client.py
+"""
+
+import asyncio
+import base64
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.comfy_client import AsyncComfyUIClient, ComfyUIError
+from services.comfy_fake_server import FakeComfyUI
+from services.comfy_service import ComfyUIAPIWrapper, defined_poses
+from services.upload_registry import UploadRegistry
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=30))
+
+
+def test_concurrent_prompts_are_routed_by_prompt_id():
+    async def scenario():
+        async with FakeComfyUI(job_seconds=0.02) as comfy:
+            async with AsyncComfyUIClient(comfy.base_url, comfy.ws_url) as client:
+                workflows = [{"label": f"pose-{i}"} for i in range(6)]
+                images = await asyncio.gather(*(client.generate_img(workflow) for workflow in workflows))
+                return comfy, images
+
+    comfy, images = run(scenario())
+    assert [json.loads(image)["label"] for image in images] == [f"pose-{i}" for i in range(6)]
+    # All six were queued on the server together, not one after another
+    assert comfy.max_queue_seen >= 4
+
+
+def test_other_clients_in_the_queue_do_not_block_completion():
+    async def scenario():
+        async with FakeComfyUI(job_seconds=0.02) as comfy:
+            async with AsyncComfyUIClient(comfy.base_url, comfy.ws_url) as ours, \
+                    AsyncComfyUIClient(comfy.base_url, comfy.ws_url) as theirs:
+                mine = await ours.submit({"label": "mine"})
+                for i in range(3):
+                    await theirs.submit({"label": f"theirs-{i}"})
+                outputs = await ours.wait(mine)
+                # Our prompt is done while the other client's prompts are still queued
+                assert len(comfy.history) < 4
+                return outputs
+
+    outputs = run(scenario())
+    assert outputs["21"]["images"][0]["filename"].startswith("no_bg_")
+
+
+def test_execution_error_is_raised():
+    async def scenario():
+        async with FakeComfyUI() as comfy:
+            async with AsyncComfyUIClient(comfy.base_url, comfy.ws_url) as client:
+                await client.generate_img({"fail": True})
+
+    with pytest.raises(ComfyUIError, match="simulated failure"):
+        run(scenario())
+
+
+def test_prompt_finishing_during_reconnect_is_recovered():
+    async def scenario():
+        async with FakeComfyUI(job_seconds=0.2) as comfy:
+            async with AsyncComfyUIClient(comfy.base_url, comfy.ws_url) as client:
+                prompt_id = await client.submit({"label": "survivor"})
+                await comfy.drop_websockets()
+                outputs = await client.wait(prompt_id, timeout=10)
+                return await client.fetch_image(outputs["21"]["images"][0])
+
+    assert json.loads(run(scenario()))["label"] == "survivor"
+
+
+def reference_of(image_base64):
+    return json.loads(base64.b64decode(image_base64))["10"]["inputs"]["image"]
+
+
+def test_avatar_poses_are_queued_up_front_and_yielded_as_they_complete(tmp_path):
+    job_seconds = 0.1
+
+    async def scenario():
+        async with FakeComfyUI(job_seconds=job_seconds) as comfy:
+            wrapper = ComfyUIAPIWrapper(base_url=comfy.base_url, ws_url=comfy.ws_url,
+                                        uploads=UploadRegistry(str(tmp_path / "uploads.json")))
+            start = time.perf_counter()
+            poses = [pose async for pose in wrapper.iter_avatar_poses({"positive_prompt": "a knight"})]
+            return comfy, poses, time.perf_counter() - start
+
+    comfy, poses, elapsed = run(scenario())
+    names = [name for name, _ in poses]
+    assert sorted(names) == sorted(["initial_pose", *defined_poses.values()])
+    assert reference_of(dict(poses)["initial_pose"]).startswith("pose1-")
+    assert reference_of(dict(poses)["yay"]).startswith("pose8-")
+    # Every pose was in ComfyUI's queue before the first one finished
+    assert comfy.max_queue_seen >= len(poses) - 1
+    assert comfy.upload_count == len(poses)
+    assert elapsed < job_seconds * len(poses) + 1.0
+
+
+def test_avatars_on_one_loop_share_one_websocket(tmp_path):
+    async def scenario():
+        async with FakeComfyUI(job_seconds=0.02) as comfy:
+            wrapper = ComfyUIAPIWrapper(base_url=comfy.base_url, ws_url=comfy.ws_url,
+                                        uploads=UploadRegistry(str(tmp_path / "uploads.json")))
+
+            async def avatar():
+                return [pose async for pose in wrapper.iter_avatar_poses({"positive_prompt": "a knight"})]
+
+            avatars = await asyncio.gather(*(avatar() for _ in range(3)))
+            avatars.append(await avatar())
+            return comfy, avatars
+
+    comfy, avatars = run(scenario())
+    assert all(len(poses) == 1 + len(defined_poses) for poses in avatars)
+    assert comfy.ws_connections == 1
+
+
+@contextmanager
+def fake_comfy_in_thread(**kwargs):
+    """FakeComfyUI on its own event loop, for code that calls asyncio.run itself"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    comfy = FakeComfyUI(**kwargs)
+    asyncio.run_coroutine_threadsafe(comfy.__aenter__(), loop).result()
+    try:
+        yield comfy
+    finally:
+        asyncio.run_coroutine_threadsafe(comfy.__aexit__(None, None, None), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_generate_avatar_with_poses_reports_each_pose(tmp_path):
+    with fake_comfy_in_thread(job_seconds=0.02) as comfy:
+        wrapper = ComfyUIAPIWrapper(base_url=comfy.base_url, ws_url=comfy.ws_url,
+                                    uploads=UploadRegistry(str(tmp_path / "uploads.json")))
+        seen = []
+        result = wrapper.generate_avatar_with_poses({"positive_prompt": "a knight"},
+                                                    on_pose=lambda name, image: seen.append(name))
+
+    assert set(result) == {"initial_pose", *defined_poses.values()}
+    assert sorted(seen) == sorted(result)
+
+
+def test_generate_avatar_with_poses_requires_a_prompt():
+    assert "error" in ComfyUIAPIWrapper().generate_avatar_with_poses({})
+
+
+def test_reference_images_are_uploaded_once(tmp_path):
+    manifest = str(tmp_path / "uploads.json")
+
+    async def avatar(comfy, registry):
+        wrapper = ComfyUIAPIWrapper(base_url=comfy.base_url, ws_url=comfy.ws_url, uploads=registry)
+        return [pose async for pose in wrapper.iter_avatar_poses({"positive_prompt": "a knight"})]
+
+    async def scenario():
+        async with FakeComfyUI(job_seconds=0.01) as comfy:
+            registry = UploadRegistry(manifest)
+            await avatar(comfy, registry)
+            uploads, checks = comfy.upload_count, comfy.head_count
+            await avatar(comfy, registry)
+            # Warm: no uploads and no existence checks
+            assert (comfy.upload_count, comfy.head_count) == (uploads, checks)
+
+            # A fresh process trusts the persisted manifest
+            await avatar(comfy, UploadRegistry(manifest))
+            assert comfy.upload_count == uploads
+
+            # An expired manifest is re-checked against ComfyUI instead of re-uploading
+            await avatar(comfy, UploadRegistry(manifest, max_age=0))
+            assert comfy.upload_count == uploads
+            assert comfy.head_count > checks
+            return uploads
+
+    assert run(scenario()) == 1 + len(defined_poses)
+
+
+def test_changed_file_gets_a_new_name(tmp_path):
+    image = tmp_path / "pose.jpg"
+    image.write_bytes(b"first")
+    registry = UploadRegistry(str(tmp_path / "uploads.json"))
+    first = registry.content_name(str(image))
+    assert first == registry.content_name(str(image))
+    image.write_bytes(b"second!")
+    assert registry.content_name(str(image)) != first
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the local guess matcher that answers correct guesses without the LLM.
+
+    python -m pytest test_guess_matcher.py
+"""
+
+import sys
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.guess_matcher import GuessMatcher, GuessMatchers, lemma, normalize, parse_objects
+
+SCENE = ["chair", "couch", "keyboard", "tv"]
+
+
+def test_object_details_from_the_frontend_and_plain_lists():
+    assert parse_objects(' {"chair":"/mask_images/mask_chair.png","tv":"/mask_images/mask_tv.png"}') == ["chair", "tv"]
+    assert parse_objects(" chair, couch ") == ["chair", "couch"]
+    assert parse_objects('["potted plant"]') == ["potted plant"]
+    assert parse_objects(None) == parse_objects(" ") == []
+
+
+def test_normalized_lemmas():
+    assert normalize("Is it the TÉLÉ, isn't it?") == ["is", "it", "the", "tele", "is", "nt", "it"]
+    assert [lemma(word) for word in ["chairs", "couches", "boxes", "shelves", "glass", "bus", "tv"]] == \
+        ["chair", "couch", "box", "shelf", "glass", "bus", "tv"]
+
+
+def test_names_synonyms_and_plurals_hit():
+    matcher = GuessMatcher(SCENE)
+    for guess, found in [("Is it a chair?", "chair"), ("the SOFA!", "couch"), ("television", "tv"),
+                         ("is it the keyboards", "keyboard"), ("Couches?", "couch"), ("tv set", "tv")]:
+        match = matcher.match(guess)
+        assert (match.status, match.hit) == ("hit", found), guess
+
+
+def test_messages_that_only_mention_an_object_are_not_guesses():
+    matcher = GuessMatcher([*SCENE, "lamp"])
+    for guess in ["give me a hint about the tv", "where is the chair?", "tell me about the couch",
+                  "my seat is comfy", "I see a light"]:
+        match = matcher.match(guess)
+        assert (match.status, match.hit) == ("ambiguous", None), guess
+    for guess in ["I think it's the lamp", "how about the light?", "my guess is the tv", "It is a chair!"]:
+        assert matcher.match(guess).status == "hit", guess
+
+
+def test_negations_comparisons_and_several_objects_go_to_the_llm():
+    matcher = GuessMatcher(SCENE)
+    for guess in ["It's not the chair", "isn't it the couch?", "is it bigger than the tv?",
+                  "is it next to the keyboard", "chair or couch?"]:
+        assert matcher.match(guess).status == "ambiguous", guess
+    assert matcher.match("give me a hint").status == "miss"
+    # Objects that are not in the scene are never hits, whatever their synonyms
+    assert GuessMatcher(["chair"]).match("is it the sofa?").status == "miss"
+
+
+def trigram_embed(texts, dim=512):
+    """A deterministic stand-in for a sentence embedding model: hashed character trigrams"""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f"  {text.lower()}  "
+        for i in range(len(padded) - 2):
+            vectors[row, zlib.crc32(padded[i:i + 3].encode()) % dim] += 1.0
+    return vectors
+
+
+def test_embedding_similarity_catches_misspellings():
+    matcher = GuessMatcher(SCENE, embed=trigram_embed, hit_threshold=0.6, ambiguous_threshold=0.4)
+    match = matcher.match("keybaord")
+    assert (match.status, match.hit, match.method) == ("hit", "keyboard", "embedding")
+    assert matcher.match("what colour is the sky").status == "miss"
+    assert matcher.match("is it the keybaord?").hit == "keyboard"
+    # A sentence about a misspelled object is no guess of it
+    assert matcher.match("where did you hide the keybaord").hit is None
+
+    # Without an embedding function misspellings are left to the LLM
+    assert GuessMatcher(SCENE).match("keybaord").status == "miss"
+
+
+def test_matchers_are_built_once_per_scene():
+    matchers = GuessMatchers(max_entries=1)
+    assert matchers.get(SCENE) is matchers.get(list(SCENE))
+    first = matchers.get(SCENE)
+    matchers.get(["lamp"])
+    assert matchers.get(SCENE) is not first
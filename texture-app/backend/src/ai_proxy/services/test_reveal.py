@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for BitMask and the incremental reveal compositor.
+
+    python -m pytest test_reveal.py
+"""
+
+import base64
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.bitmask import BitMask
+from services.reveal import RevealCompositor, RevealStore, SceneMasks
+from services.scene_pack import ScenePacks, write_scene_pack
+from services.segmentation_cache import ImageKey, SegmentationCache
+
+SCENE = "a" * 64
+
+
+def scene_masks(width=37, height=23):
+    chair = np.zeros((height, width), dtype=bool)
+    chair[2:12, 3:15] = True
+    couch = np.zeros((height, width), dtype=bool)
+    couch[8:20, 10:35] = True
+    return {"chair": chair, "couch": couch}
+
+
+def png(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array.astype(np.uint8) * 255).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def apply(client, delta):
+    """What a client does with a reveal delta"""
+    left, top, right, bottom = delta["bbox"]
+    region = BitMask.from_rle(right - left, bottom - top, delta["counts"]).to_array()
+    client[top:bottom, left:right] |= region
+
+
+def test_bitmask_operations_match_numpy():
+    rng = np.random.default_rng(7)
+    a, b = rng.random((23, 37)) > 0.5, rng.random((23, 37)) > 0.7
+    ma, mb = BitMask.from_array(a), BitMask.from_array(b)
+
+    assert ma.nbytes == (23 * 37 + 7) // 8
+    assert np.array_equal((ma | mb).to_array(), a | b)
+    assert np.array_equal((ma & mb).to_array(), a & b)
+    assert np.array_equal((ma - mb).to_array(), a & ~b)
+    assert ma.count() == a.sum() and (ma - ma).count() == 0
+    with pytest.raises(ValueError):
+        ma | BitMask.empty(36, 23)
+
+
+@pytest.mark.parametrize("array", [
+    np.zeros((4, 5), dtype=bool), np.ones((4, 5), dtype=bool), scene_masks()["couch"], np.eye(6, dtype=bool),
+])
+def test_rle_round_trips(array):
+    mask = BitMask.from_array(array)
+    counts = mask.to_rle()
+    assert sum(counts) == array.size and all(count > 0 for count in counts[1:])
+    assert BitMask.from_rle(mask.width, mask.height, counts) == mask
+    with pytest.raises(ValueError):
+        BitMask.from_rle(mask.width, mask.height, counts + [1])
+
+
+def test_bbox_and_crop():
+    mask = BitMask.from_array(scene_masks()["chair"])
+    assert mask.bbox() == (3, 2, 15, 12)
+    assert mask.crop(mask.bbox()).count() == mask.count() == 120
+    assert BitMask.empty(4, 4).bbox() is None
+
+
+def test_deltas_add_up_to_the_revealed_objects():
+    arrays = scene_masks()
+    masks = SceneMasks()
+    masks.remember(SCENE, {"class_mask_pairs": {name: png(array) for name, array in arrays.items()}})
+    compositor = RevealCompositor(masks)
+    client = np.zeros((23, 37), dtype=bool)
+
+    first = compositor.reveal(1, SCENE, ["Chair"]).as_dict()
+    assert (first["version"], first["base_version"], first["objects"]) == (1, 0, ["chair"])
+    assert first["bbox"] == [3, 2, 15, 12]
+    apply(client, first)
+
+    # Only the part of the couch the chair didn't already uncover is sent
+    second = compositor.reveal(1, SCENE, ["couch", "chair"]).as_dict()
+    assert (second["version"], second["objects"]) == (2, ["couch"])
+    assert sum(second["counts"][1::2]) == (arrays["couch"] & ~arrays["chair"]).sum()
+    apply(client, second)
+    assert np.array_equal(client, arrays["chair"] | arrays["couch"])
+
+    # Guessing again changes nothing
+    again = compositor.reveal(1, SCENE, ["couch"]).as_dict()
+    assert (again["version"], again["bbox"], again["counts"]) == (2, None, [])
+
+    state = compositor.state(1, SCENE)
+    assert state["version"] == 2 and state["objects"] == ["chair", "couch"]
+    assert np.array_equal(BitMask.from_rle(37, 23, state["counts"]).to_array(), client)
+    assert compositor.state(2, SCENE)["version"] == 0
+    assert compositor.reveal(1, "b" * 64, ["chair"]) is None
+
+
+def test_pack_masks_are_used_without_decoding(tmp_path):
+    arrays = scene_masks()
+    key = ImageKey(pixels=SCENE, dhash=0)
+    packs = ScenePacks(str(tmp_path))
+    write_scene_pack(ScenePacks.path_of(str(tmp_path), key), key,
+                     {"class_mask_pairs": {name: png(array) for name, array in arrays.items()}})
+
+    delta = RevealCompositor(SceneMasks(packs)).reveal(1, SCENE, ["couch"])
+    assert delta.bbox == (10, 8, 35, 20)
+    assert delta.size == (37, 23)
+
+
+def test_scene_masks_stay_within_budget():
+    masks = SceneMasks(max_bytes=2 * BitMask.empty(64, 64).nbytes)
+    for scene in ("a", "b", "c"):
+        masks.put(scene, {"chair": BitMask.empty(64, 64)})
+    assert masks.get("a") is None and masks.get("c") is not None
+    assert masks.bytes == 2 * 512
+
+
+def test_processes_sharing_a_store_and_cache_hand_out_the_same_deltas(tmp_path):
+    arrays = scene_masks()
+    cache = SegmentationCache(str(tmp_path))
+    cache.put(ImageKey(pixels=SCENE, dhash=0), {"class_mask_pairs": {name: png(array) for name, array in arrays.items()}})
+    store = RevealStore()
+    # Two workers: neither has seen the scene's segmentation result, they share the cache directory and the store
+    first, second = (RevealCompositor(SceneMasks(cache=SegmentationCache(str(tmp_path))), store) for _ in range(2))
+
+    assert first.reveal(1, SCENE, ["chair"]).as_dict()["version"] == 1
+    delta = second.reveal(1, SCENE, ["couch"]).as_dict()
+    assert (delta["base_version"], delta["version"], delta["objects"]) == (1, 2, ["couch"])
+    assert sum(delta["counts"][1::2]) == (arrays["couch"] & ~arrays["chair"]).sum()
+    assert first.state(1, SCENE) == second.state(1, SCENE)
+    assert SceneMasks(cache=cache).get("../" + SCENE) is None
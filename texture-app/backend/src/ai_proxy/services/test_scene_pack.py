@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for scene packs: bitset masks, mmap loading and games started without the GPU.
+
+    python -m pytest test_scene_pack.py
+"""
+
+import asyncio
+import base64
+import io
+import struct
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.image_service import ImageGenerationParameters, ImageGenerationService
+from services.bitmask import decode_mask
+from services.scene_pack import ScenePack, ScenePacks, write_scene_pack
+from services.segmentation_cache import SegmentationCache, image_key
+
+RIDDLES = {"chair": {"riddle": "I have four legs but never walk.", "hints": ["You sit on me."]}}
+
+
+def png(array, mode="L"):
+    buffer = io.BytesIO()
+    Image.fromarray(array).convert(mode).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def scene():
+    pixels = np.zeros((30, 45, 3), dtype=np.uint8)
+    pixels[5:20, 3:13] = (40, 60, 90)
+    pixels[10:25, 20:41] = (220, 40, 40)
+    return png(pixels, "RGB")
+
+
+def masks():
+    chair = np.zeros((30, 45), dtype=np.uint8)
+    chair[5:20, 3:13] = 255
+    couch = np.zeros((30, 45), dtype=np.uint8)
+    couch[10:25, 20:41] = 255
+    return chair > 0, couch > 0
+
+
+def segmentation_result():
+    chair, couch = masks()
+    return {
+        "status": "success",
+        "class_mask_pairs": {
+            "chair": base64.b64encode(png(chair.astype(np.uint8) * 255)).decode(),
+            "couch": "data:image/png;base64," + base64.b64encode(png(couch.astype(np.uint8) * 255)).decode(),
+            "lamp": "/mask_images/mask_lamp.png",
+        },
+    }
+
+
+def test_masks_round_trip_through_bitsets(tmp_path):
+    key = image_key(scene())
+    path = str(tmp_path / "scene.pack")
+    size = write_scene_pack(path, key, segmentation_result(), RIDDLES, source="room.png")
+    assert size == Path(path).stat().st_size
+
+    pack = ScenePack(path)
+    chair, couch = masks()
+    assert pack.key == key and (pack.width, pack.height) == (45, 30)
+    assert np.array_equal(pack.mask("chair").to_array(), chair) and np.array_equal(pack.mask("couch").to_array(), couch)
+    assert pack.objects["couch"]["bbox"] == [20, 10, 41, 25] and pack.objects["chair"]["area"] == 150
+    assert pack.riddles == RIDDLES
+
+    result = pack.result()
+    pairs = result["class_mask_pairs"]
+    assert result["status"] == "success" and result["scene_pack"] == key.pixels
+    assert np.array_equal(decode_mask(pairs["chair"]), chair)
+    assert pairs["couch"].startswith("data:image/png;base64,")
+    assert np.array_equal(decode_mask(pairs["couch"]), couch)
+    # Masks given as links are kept as they are
+    assert pairs["lamp"] == "/mask_images/mask_lamp.png"
+    pack.close()
+
+
+def test_other_versions_and_files_are_not_loaded(tmp_path):
+    key = image_key(scene())
+    packs = ScenePacks(str(tmp_path))
+    path = ScenePacks.path_of(str(tmp_path), key)
+    write_scene_pack(path, key, segmentation_result())
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<H", 99))
+
+    assert packs.get(key) is None
+    assert packs.get("../../etc/passwd") is None
+    assert ScenePacks(None).get(key) is None
+    assert packs.as_dict()["misses"] == 1
+
+
+def test_known_scenes_are_answered_from_their_pack(tmp_path, monkeypatch):
+    image = scene()
+    key = image_key(image)
+    packs = ScenePacks(str(tmp_path / "packs"))
+    service = ImageGenerationService(base_url="http://127.0.0.1:9", packs=packs,
+                                     cache=SegmentationCache(str(tmp_path / "cache"), max_bytes=0))
+    calls = []
+    monkeypatch.setattr(service, "_process_image", lambda params: calls.append(params) or {"objects": []})
+
+    # A pack written while the proxy runs is picked up by the next game
+    assert service.generate_image(ImageGenerationParameters(image=image)) == {"objects": [], "scene": key.pixels}
+    write_scene_pack(ScenePacks.path_of(packs.directory, key), key, segmentation_result(), RIDDLES)
+    result = service.generate_image(ImageGenerationParameters(image=base64.b64encode(image).decode()))
+
+    assert len(calls) == 1
+    assert result["scene_pack"] == key.pixels and sorted(result["class_mask_pairs"]) == ["chair", "couch", "lamp"]
+    assert packs.as_dict()["hits"] == 1
+
+
+def test_async_games_open_packs_off_the_event_loop(tmp_path, monkeypatch):
+    image = scene()
+    key = image_key(image)
+    packs = ScenePacks(str(tmp_path))
+    write_scene_pack(ScenePacks.path_of(packs.directory, key), key, segmentation_result(), RIDDLES)
+    service = ImageGenerationService(base_url="http://127.0.0.1:9", packs=packs,
+                                     cache=SegmentationCache(str(tmp_path / "cache"), max_bytes=0))
+    opened_on = []
+    get = packs.get
+    monkeypatch.setattr(packs, "get", lambda key: opened_on.append(threading.current_thread()) or get(key))
+
+    result = asyncio.run(service.agenerate_image(ImageGenerationParameters(image=image)))
+
+    assert result["scene_pack"] == key.pixels
+    assert opened_on and threading.main_thread() not in opened_on
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the segmentation result cache: content keys, LRU on disk and singleflight.
+
+    python -m pytest test_segmentation_cache.py
+"""
+
+import asyncio
+import base64
+import io
+import sys
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.image_service import ImageGenerationParameters, ImageGenerationService
+from services.segmentation_cache import SegmentationCache, image_key
+
+
+def scene(shade=0, size=(64, 48), fmt="PNG", **save_args):
+    image = Image.new("RGB", size, (200, 180, 150))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((8, 8, 30, 40), fill=(40 + shade, 60, 90))
+    draw.ellipse((36, 10, 60, 34), fill=(220, 40 + shade, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **save_args)
+    return buffer.getvalue()
+
+
+def test_key_depends_on_pixels_not_encoding():
+    fast, small = scene(compress_level=0), scene(compress_level=9)
+    assert fast != small
+    assert image_key(fast) == image_key(small) == image_key(base64.b64encode(fast).decode())
+    assert image_key(scene(shade=1)).pixels != image_key(fast).pixels
+    assert image_key(b"not an image") is None
+    assert image_key("!!not base64!!") is None
+
+
+def test_results_survive_a_restart_and_evict_least_recently_used(tmp_path):
+    cache = SegmentationCache(str(tmp_path), max_bytes=200)
+    keys = [image_key(scene(shade=shade)) for shade in range(3)]
+    cache.put(keys[0], {"objects": ["chair"], "pad": "x" * 50})
+    cache.put(keys[1], {"objects": ["couch"], "pad": "x" * 50})
+
+    reopened = SegmentationCache(str(tmp_path), max_bytes=200)
+    assert reopened.get(keys[0])["objects"] == ["chair"]  # now the most recently used
+    reopened.put(keys[2], {"objects": ["lamp"], "pad": "x" * 50})
+
+    assert reopened.get(keys[1]) is None
+    assert [reopened.get(key)["objects"] for key in (keys[0], keys[2])] == [["chair"], ["lamp"]]
+    assert reopened.as_dict()["evictions"] == 1 and reopened.bytes <= 200
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def test_near_duplicates_only_when_enabled(tmp_path):
+    original, recompressed = scene(fmt="JPEG", quality=95), scene(fmt="JPEG", quality=60)
+    SegmentationCache(str(tmp_path)).put(image_key(original), {"objects": ["chair"]})
+
+    assert SegmentationCache(str(tmp_path)).get(image_key(recompressed)) is None
+    near = SegmentationCache(str(tmp_path), max_distance=4)
+    assert near.get(image_key(recompressed)) == {"objects": ["chair"]}
+    assert near.as_dict()["near_hits"] == 1
+
+
+def test_concurrent_misses_make_one_call(tmp_path):
+    cache = SegmentationCache(str(tmp_path))
+    key = image_key(scene())
+    calls = []
+
+    def segment():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"objects": ["chair"]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(key, segment)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"objects": ["chair"]}] * 8
+    assert cache.as_dict()["coalesced"] == 7
+
+
+def test_errors_reach_every_waiter_and_are_not_cached(tmp_path):
+    cache = SegmentationCache(str(tmp_path))
+    key = image_key(scene())
+    calls = []
+
+    async def segment():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        if len(calls) == 1:
+            raise ConnectionError("segmentation service is down")
+        return {"objects": ["chair"]}
+
+    async def run():
+        return await asyncio.gather(*(cache.aget_or_compute(key, segment) for _ in range(5)),
+                                    return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(run()))
+    assert asyncio.run(run()) == [{"objects": ["chair"]}] * 5
+    assert len(calls) == 2
+
+
+def test_disabled_cache_has_no_keys(tmp_path):
+    assert SegmentationCache(str(tmp_path), max_bytes=0).key_of(scene()) is None
+
+
+def test_image_service_segments_each_scene_once(tmp_path, monkeypatch):
+    service = ImageGenerationService(base_url="http://127.0.0.1:9", cache=SegmentationCache(str(tmp_path)))
+    calls = []
+    monkeypatch.setattr(service, "_process_image", lambda params: calls.append(params) or {"objects": ["chair"]})
+
+    first = service.generate_image(ImageGenerationParameters(image=base64.b64encode(scene()).decode()))
+    again = service.generate_image(ImageGenerationParameters(image=scene(compress_level=9)))
+
+    assert first == again == {"objects": ["chair"], "scene": image_key(scene()).pixels}
+    assert len(calls) == 1
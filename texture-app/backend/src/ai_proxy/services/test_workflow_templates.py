@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the cached, hot-reloaded ComfyUI workflow templates.
+
+    python -m pytest test_workflow_templates.py
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the parent directory to the path so we can import the services modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.comfy_service import SLOTS, ComfyUIAPI, Parameters
+from services.workflow_templates import WorkflowTemplate, WorkflowTemplateError, WorkflowTemplates
+
+PARAMETERS = Parameters(positive_prompt="a knight", negative_prompt="blurry", reference_img="pose2.jpg")
+
+
+def legacy_workflow(path, parameters):
+    with open(path, "r") as f:
+        workflow = json.load(f)
+    workflow["7"]["inputs"]["text"] = parameters.positive_prompt
+    workflow["9"]["inputs"]["text"] = parameters.negative_prompt
+    workflow["10"]["inputs"]["image"] = parameters.reference_img
+    return workflow
+
+
+def test_rendered_workflow_matches_reloading_the_file():
+    api = ComfyUIAPI()
+    assert api.get_workflow(PARAMETERS) == legacy_workflow(api.workflow_path, PARAMETERS)
+
+
+def test_render_copies_only_patched_nodes():
+    api = ComfyUIAPI()
+    template = WorkflowTemplate(api.workflow_path, SLOTS)
+    first = template.render(positive_prompt="a", negative_prompt="b", reference_img="c.jpg")
+    second = template.render(positive_prompt="x", negative_prompt="y", reference_img="z.jpg")
+
+    assert first["7"]["inputs"]["text"] == "a" and second["7"]["inputs"]["text"] == "x"
+    assert first["7"]["inputs"]["clip"] is template.nodes["7"]["inputs"]["clip"]
+    assert template.nodes["10"]["inputs"]["image"] not in ("c.jpg", "z.jpg")
+    shared = [node_id for node_id in first if first[node_id] is template.nodes[node_id]]
+    assert len(shared) == len(template.nodes) - len(SLOTS)
+
+
+def test_invalid_mapping_is_rejected(tmp_path):
+    path = tmp_path / "workflow.json"
+    path.write_text(json.dumps({"7": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}}}))
+
+    with pytest.raises(WorkflowTemplateError, match="missing node 10"):
+        WorkflowTemplate(str(path), {"prompt": ("7", "text"), "image": ("10", "image")})
+    with pytest.raises(WorkflowTemplateError, match="input 'image'"):
+        WorkflowTemplate(str(path), {"prompt": ("7", "image")})
+    with pytest.raises(WorkflowTemplateError, match="missing parameters"):
+        WorkflowTemplate(str(path), {"prompt": ("7", "text")}).render()
+
+
+def test_template_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "workflow.json"
+    slots = {"prompt": ("7", "text")}
+    path.write_text(json.dumps({"7": {"class_type": "A", "inputs": {"text": ""}}}))
+    templates = WorkflowTemplates(check_interval=0)
+
+    first = templates.get(str(path), slots)
+    assert templates.get(str(path), slots) is first
+
+    path.write_text(json.dumps({"7": {"class_type": "B", "inputs": {"text": ""}}}))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert templates.get(str(path), slots).nodes["7"]["class_type"] == "B"
+
+    # A broken edit keeps the last good version
+    path.write_text("{")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2 * 10**9))
+    assert templates.get(str(path), slots).nodes["7"]["class_type"] == "B"
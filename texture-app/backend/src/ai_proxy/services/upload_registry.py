@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class UploadRegistry:
+    """Content-addressed record of the images already uploaded to ComfyUI
+
+    Images are uploaded under a name derived from their content hash
+    (``pose1-<sha256 prefix>.jpg``), so a name that ComfyUI has always holds
+    the same bytes. The registry remembers, per ComfyUI server, when each name
+    was last seen there and persists it to a JSON manifest. Callers only need
+    to check ComfyUI (``/view``) or upload when an entry is missing or older
+    than ``max_age``.
+
+    Args:
+        manifest_path: JSON manifest file (default: COMFYUI_UPLOAD_MANIFEST or services/temp/comfy_uploads.json)
+        max_age: Seconds an entry is trusted before ComfyUI is asked again
+    """
+
+    def __init__(self, manifest_path: str = None, max_age: float = 3600):
+        self.manifest_path = manifest_path or os.environ.get(
+            "COMFYUI_UPLOAD_MANIFEST", os.path.join(os.path.dirname(__file__), "temp", "comfy_uploads.json")
+        )
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._names: Dict[str, Tuple[int, int, str]] = {}
+        self._manifest: Dict[str, Dict[str, float]] = self._load()
+
+    def content_name(self, path: str) -> str:
+        """Name to upload the file under, hashed once per file version"""
+        stat = os.stat(path)
+        cached = self._names.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        stem, ext = os.path.splitext(os.path.basename(path))
+        name = f"{stem}-{digest.hexdigest()[:16]}{ext}"
+        self._names[path] = (stat.st_mtime_ns, stat.st_size, name)
+        return name
+
+    def is_uploaded(self, base_url: str, name: str) -> bool:
+        seen_at = self._manifest.get(base_url, {}).get(name)
+        return seen_at is not None and time.time() - seen_at < self.max_age
+
+    def mark_uploaded(self, base_url: str, name: str) -> None:
+        with self._lock:
+            self._manifest.setdefault(base_url, {})[name] = time.time()
+            self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._manifest = {}
+            self._save()
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable upload manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Could not save upload manifest {self.manifest_path}: {str(e)}")
@@ -0,0 +1,49 @@
+import json
+from typing import Any, Dict
+
+# orjson and msgpack are optional, see texture/backend/llm/wire.py for the server side.
+# Without msgpack the proxy asks for JSON, without orjson it parses with the standard library.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+
+def dumps_json(data: Any) -> bytes:
+    """Compact JSON, never pretty-printed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads_json(body: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def request_headers() -> Dict[str, str]:
+    """Headers of a request with a dumps_json() body, asking for the most compact answer available"""
+    accept = f"{MSGPACK}, {JSON};q=0.9" if msgpack is not None else JSON
+    return {"Content-Type": JSON, "Accept": accept}
+
+
+def decode(body: bytes, content_type: str) -> Any:
+    """A response body, MessagePack if the server says so and JSON otherwise
+
+    Raises:
+        ValueError: If the body is malformed
+    """
+    if content_type.split(";")[0].strip() == MSGPACK:
+        if msgpack is None:
+            raise ValueError("Got a MessagePack body but msgpack is not installed")
+        return msgpack.unpackb(body)
+    return loads_json(body)
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Parameter name -> (node id, input name) it is written to
+Slots = Dict[str, Tuple[str, str]]
+
+
+class WorkflowTemplateError(Exception):
+    """Raised when a workflow does not have the nodes its parameters map to"""
+
+
+class WorkflowTemplate:
+    """A ComfyUI API-format workflow parsed once, rendered per request
+
+    render() returns a new top-level dict that shares every node it does not
+    patch with the template; only the patched nodes (and their inputs) are
+    copied. Rendered workflows are meant to be serialized and sent, not
+    modified in place.
+
+    Args:
+        path: Workflow JSON file
+        slots: Parameter name -> (node id, input name)
+        nodes: Parsed workflow, read from path if not given
+    """
+
+    def __init__(self, path: str, slots: Slots, nodes: Dict[str, Any] = None):
+        self.path = path
+        self.slots = dict(slots)
+        if nodes is None:
+            with open(path, "r") as f:
+                nodes = json.load(f)
+        self.nodes = nodes
+        self._validate()
+
+    def render(self, **values: Any) -> Dict[str, Any]:
+        """Workflow with the given parameters filled in
+
+        Args:
+            values: Parameter values by slot name; every slot must be given
+        """
+        missing = self.slots.keys() - values.keys()
+        unknown = values.keys() - self.slots.keys()
+        if missing or unknown:
+            raise WorkflowTemplateError(
+                f"{os.path.basename(self.path)}: missing parameters {sorted(missing)}, unknown {sorted(unknown)}"
+            )
+
+        workflow = dict(self.nodes)
+        for name, value in values.items():
+            node_id, input_name = self.slots[name]
+            node = workflow[node_id]
+            if node is self.nodes[node_id]:
+                node = workflow[node_id] = {**node, "inputs": dict(node["inputs"])}
+            node["inputs"][input_name] = value
+        return workflow
+
+    def _validate(self) -> None:
+        for name, (node_id, input_name) in self.slots.items():
+            node = self.nodes.get(node_id)
+            if node is None:
+                raise WorkflowTemplateError(f"{os.path.basename(self.path)}: '{name}' maps to missing node {node_id}")
+            if input_name not in node.get("inputs", {}):
+                raise WorkflowTemplateError(
+                    f"{os.path.basename(self.path)}: '{name}' maps to input '{input_name}' "
+                    f"which node {node_id} ({node.get('class_type')}) does not have"
+                )
+
+
+class WorkflowTemplates:
+    """Process-wide cache of WorkflowTemplate objects, reloaded when their file changes
+
+    The file's mtime is checked at most every check_interval seconds. If a
+    changed file fails to parse or validate, the previous template stays in
+    use and the error is logged.
+
+    Args:
+        check_interval: Seconds between mtime checks of a cached template
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # path -> (template, mtime_ns, time of last check)
+        self._cache: Dict[str, Tuple[WorkflowTemplate, int, float]] = {}
+
+    def get(self, path: str, slots: Slots) -> WorkflowTemplate:
+        now = time.monotonic()
+        cached = self._cache.get(path)
+        if cached is not None and now - cached[2] < self.check_interval and cached[0].slots == slots:
+            return cached[0]
+
+        with self._lock:
+            mtime = os.stat(path).st_mtime_ns
+            cached = self._cache.get(path)
+            if cached is not None and cached[1] == mtime and cached[0].slots == slots:
+                self._cache[path] = (cached[0], mtime, now)
+                return cached[0]
+
+            try:
+                template = WorkflowTemplate(path, slots)
+            except (OSError, ValueError, WorkflowTemplateError) as e:
+                if cached is None or cached[0].slots != slots:
+                    raise
+                logger.error(f"Keeping the previous version of {path}, reload failed: {str(e)}")
+                self._cache[path] = (cached[0], mtime, now)
+                return cached[0]
+
+            logger.info(f"Loaded workflow template {path}")
+            self._cache[path] = (template, mtime, now)
+            return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+workflow_templates = WorkflowTemplates()
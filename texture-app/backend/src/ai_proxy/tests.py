@@ -1,3 +1,656 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import F
 from django.test import TestCase
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+
+from .models import Conversation, Message, Riddle
+from .services.async_http import get_async_client
+from .services.chat_service import ChatBOT, conversation_cache
+from .services.comfy_service import ComfyUIAPIWrapper
+from .services.jobs import JobManager, JobQueueFull
+from .services import wire
+from .services.llm_service import LLMResponse, LLMService, Message as LLMMessage, iter_sse
+from .services.riddle_service import RiddleService, parse_riddles, riddle_intent
+from .services.bitmask import BitMask
+from .services.image_service import ImageGenerationService
+from .services.reveal import RevealCompositor, SceneMasks
+from .services.reveal_store import ConversationReveals
+from .services.scene_pack import ScenePacks
+from .services.segmentation_cache import SegmentationCache, image_key
 
 # Create your tests here.
+
+SYSTEM_PROMPT = {"CHATBOT_SYSTEM_PROMPT": "You are the riddle master."}
+
+
+class StreamingChatTests(TestCase):
+
+    def test_iter_sse_parses_events(self):
+        lines = [
+            'data: {"delta": "Hel"}', '',
+            'data: {"delta": "lo"}', '',
+            'event: done', 'data: {"received_data": {"answer": "Hello"}}', '',
+        ]
+        self.assertEqual(list(iter_sse(lines)), [
+            (None, {"delta": "Hel"}),
+            (None, {"delta": "lo"}),
+            ("done", {"received_data": {"answer": "Hello"}}),
+        ])
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    @mock.patch.object(LLMService, "stream_chat_completion", return_value=iter(["It has ", "four legs."]))
+    def test_chat_message_stream_relays_chunks_and_saves_answer(self, stream):
+        response = self.client.post(
+            "/api/ai_proxy/chat/message/stream/",
+            {"message": "Is it soft? $ chair, couch"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn('data: {"delta": "It has "}', body)
+        self.assertIn('data: {"delta": "four legs."}', body)
+        self.assertIn("event: done", body)
+        self.assertEqual(stream.call_args.kwargs["object_details"], " chair, couch")
+        done = json.loads(body.split("event: done\ndata: ", 1)[1])
+        self.assertEqual(done["history"][-1], {"role": "assistant", "content": "It has four legs."})
+        self.assertEqual(done["cursor"], Message.objects.latest("id").id)
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(
+            [(m.role, m.content) for m in conversation.messages.all()],
+            [("system", "You are the riddle master."), ("user", "Is it soft? "), ("assistant", "It has four legs.")],
+        )
+
+        # With the cursor of that answer only the new turn comes back
+        stream.return_value = iter(["No."])
+        body = b"".join(self.client.post(
+            "/api/ai_proxy/chat/message/stream/",
+            {"message": "Is it red?", "conversation_id": done["conversation_id"], "since_id": done["cursor"]},
+            content_type="application/json",
+        ).streaming_content).decode()
+        self.assertEqual(json.loads(body.split("event: done\ndata: ", 1)[1])["history"],
+                         [{"role": "user", "content": "Is it red?"}, {"role": "assistant", "content": "No."}])
+
+
+class LLMResponseTests(TestCase):
+
+    def serve(self, status, body, content_type="application/json"):
+        """An LLM server stand-in answering every POST with ``body``, recording the requests"""
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests_seen.append((dict(self.headers), self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        service = LLMService()
+        service.url = f"http://127.0.0.1:{server.server_address[1]}"
+        return service, requests_seen
+
+    def test_completion_is_decoded_once_into_a_typed_response(self):
+        service, requests_seen = self.serve(200, b'{"status":"success","received_data":{"answer":"A chair."}}')
+        messages = [LLMMessage(role="system", content="Riddles."), LLMMessage(role="user", content="ping")]
+
+        response = service.create_chat_completion(messages=messages)
+
+        self.assertEqual((response.answer, response.status), ("A chair.", "success"))
+        self.assertEqual(response.as_dict()["received_data"], {"answer": "A chair."})
+        headers, body = requests_seen[0]
+        self.assertEqual(headers["Accept"], wire.request_headers()["Accept"])
+        self.assertEqual(json.loads(body)["messages"][-1], {"role": "user", "content": "ping"})
+        self.assertNotIn(b"\n", body)
+
+    def test_failed_completion_is_none_and_fails_the_turn(self):
+        service, _ = self.serve(500, b'{"error": "CUDA out of memory"}')
+        messages = [LLMMessage(role="system", content="Riddles."), LLMMessage(role="user", content="ping")]
+
+        self.assertIsNone(service.create_chat_completion(messages=messages))
+        with self.assertRaisesMessage(Exception, "LLM service failed"):
+            ChatBOT._extract_answer(None)
+
+    def test_openai_style_choices_are_read_too(self):
+        response = LLMResponse.from_dict({"choices": [{"message": {"role": "assistant", "content": "Yes."}}]})
+        self.assertEqual(response.answer, "Yes.")
+        self.assertEqual(LLMResponse.from_dict({"choices": []}).answer, "")
+
+
+class ChatHistoryTests(TestCase):
+
+    def setUp(self):
+        conversation_cache.clear()
+
+    @mock.patch.dict(os.environ, {**SYSTEM_PROMPT, "CHATBOT_MAX_HISTORY": "4"})
+    def test_add_message_trims_in_one_delete_and_keeps_system_prompt(self):
+        chatbot = ChatBOT(llm_service=mock.Mock())
+        for i in range(6):
+            # Version bump, INSERT and DELETE, however long the history is. The transaction
+            # is a savepoint pair here because TestCase already wraps each test in one.
+            with self.assertNumQueries(5):
+                chatbot.add_message("user", f"message {i}")
+
+        self.assertEqual(chatbot.get_history(), [
+            {"role": "system", "content": "You are the riddle master."},
+            {"role": "user", "content": "message 3"},
+            {"role": "user", "content": "message 4"},
+            {"role": "user", "content": "message 5"},
+        ])
+
+    @mock.patch.dict(os.environ, {**SYSTEM_PROMPT, "CHATBOT_MAX_HISTORY": "2"})
+    def test_trim_without_system_prompt_keeps_newest(self):
+        chatbot = ChatBOT(llm_service=mock.Mock())
+        chatbot.clear_history(keep_system_prompt=False)
+        for i in range(4):
+            chatbot.add_message("assistant" if i % 2 else "user", f"message {i}")
+
+        self.assertEqual([m["content"] for m in chatbot.get_history()], ["message 2", "message 3"])
+        self.assertEqual(list(chatbot.conversation.messages.values_list("content", flat=True)),
+                         ["message 2", "message 3"])
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_turn_reads_the_conversation_once_and_writes_once(self):
+        llm = mock.Mock()
+        llm.create_chat_completion.return_value = LLMResponse(answer="No.")
+        conversation_id = ChatBOT(llm_service=llm).conversation.id
+
+        # One row read to validate the cached messages, then version bump, INSERT and DELETE
+        with self.assertNumQueries(6):
+            chatbot = ChatBOT(conversation_id=conversation_id, llm_service=llm)
+            chatbot.generate_response("Is it a chair?")
+            history = chatbot.get_history()
+
+        self.assertEqual([m["content"] for m in history], ["You are the riddle master.", "Is it a chair?", "No."])
+        self.assertEqual(len(llm.create_chat_completion.call_args.kwargs["messages"]), 2)
+        self.assertEqual(Message.objects.filter(conversation_id=conversation_id).count(), 3)
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_write_from_another_process_invalidates_the_cache(self):
+        chatbot = ChatBOT(llm_service=mock.Mock())
+        conversation_id = chatbot.conversation.id
+        chatbot.add_message("user", "first")
+
+        # What another worker's ChatBOT does when it flushes
+        Message.objects.create(conversation_id=conversation_id, role="assistant", content="from elsewhere")
+        Conversation.objects.filter(id=conversation_id).update(version=F("version") + 1)
+
+        history = ChatBOT(conversation_id=conversation_id, llm_service=mock.Mock()).get_history()
+        self.assertEqual([m["content"] for m in history], ["You are the riddle master.", "first", "from elsewhere"])
+
+        # A stale instance still appends, but the next request reloads instead of trusting memory
+        chatbot.add_message("user", "second")
+        history = ChatBOT(conversation_id=conversation_id, llm_service=mock.Mock()).get_history()
+        self.assertEqual([m["content"] for m in history][-2:], ["from elsewhere", "second"])
+
+
+class ChatSyncTests(TestCase):
+
+    def setUp(self):
+        conversation_cache.clear()
+
+    def turn(self, message, **extra):
+        with mock.patch.object(LLMService, "create_chat_completion", return_value=LLMResponse(answer=f"Not {message}")):
+            return self.client.post("/api/ai_proxy/chat/message/", {"message": message, **extra},
+                                    content_type="application/json").json()
+
+    def playing(self, name):
+        """A new conversation whose last riddle served is about ``name``"""
+        conversation = ChatBOT(llm_service=mock.Mock()).conversation
+        Riddle.objects.create(conversation=conversation, object_name=name, riddle=f"Guess the {name}.",
+                              served_at=timezone.now())
+        return conversation.id
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_chat_message_returns_only_messages_after_the_cursor(self):
+        first = self.turn("a chair")
+        self.assertTrue(first["full"])
+        self.assertEqual(len(first["history"]), 3)
+
+        second = self.turn("a couch", conversation_id=first["conversation_id"], since_id=first["cursor"])
+        self.assertFalse(second["full"])
+        self.assertEqual(second["history"], [{"role": "user", "content": "a couch"},
+                                             {"role": "assistant", "content": "Not a couch"}])
+        self.assertGreater(second["cursor"], first["cursor"])
+
+        # A cursor the conversation no longer has (here: cleared) gets the whole history
+        self.client.post("/api/ai_proxy/chat/clear/", {"conversation_id": first["conversation_id"]},
+                         content_type="application/json")
+        history = self.client.get("/api/ai_proxy/chat/history/", {
+            "conversation_id": first["conversation_id"], "since_id": second["cursor"]}).json()
+        self.assertTrue(history["full"])
+        self.assertEqual(history["history"], [{"role": "system", "content": "You are the riddle master."}])
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_correct_guess_is_answered_without_the_llm(self):
+        objects = json.dumps({"chair": "/mask_images/mask_chair.png", "tv": "/mask_images/mask_tv.png"})
+        with mock.patch.object(LLMService, "create_chat_completion") as llm:
+            hit = self.client.post("/api/ai_proxy/chat/message/", {
+                "message": f"Is it the television? $ {objects}", "conversation_id": self.playing("tv"),
+            }, content_type="application/json").json()
+        llm.assert_not_called()
+        self.assertEqual(hit["reveal"], ["tv"])
+        self.assertIn("Congratulations", hit["response"])
+        self.assertEqual(hit["history"][-1], {"role": "assistant", "content": hit["response"]})
+
+        # Anything the matcher can't confirm is still the LLM's call
+        miss = self.turn(f"It's not the chair, right? $ {objects}", conversation_id=hit["conversation_id"])
+        self.assertTrue(miss["response"].startswith("Not It's not the chair"))
+        self.assertEqual(miss["reveal"], [])
+
+        # So are messages that only mention an object, and requests for a hint or a riddle about one
+        for message in ["give me a hint about the chair", "where is the chair?", "tell me about the chair",
+                        "my seat is comfy", "a riddle about the chair please"]:
+            reply = self.turn(f"{message} $ {objects}", conversation_id=hit["conversation_id"])
+            self.assertTrue(reply["response"].startswith(f"Not {message}"))
+            self.assertEqual(reply["reveal"], [])
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_correct_guess_sends_only_the_uncovered_pixels(self):
+        scene = "c" * 64
+        tv = np.zeros((12, 16), dtype=bool)
+        tv[3:6, 4:10] = True
+        masks = SceneMasks()
+        masks.put(scene, {"tv": BitMask.from_array(tv), "chair": BitMask.empty(16, 12)})
+        objects = json.dumps({"chair": "/mask_images/mask_chair.png", "tv": "/mask_images/mask_tv.png"})
+
+        with mock.patch("src.ai_proxy.views.chat_views.reveal_compositor",
+                        RevealCompositor(masks, ConversationReveals())):
+            hit = self.client.post("/api/ai_proxy/chat/message/", {
+                "message": f"the tv! $ {objects}", "scene": scene, "conversation_id": self.playing("tv"),
+            }, content_type="application/json").json()
+        # Another process answers from the state in the database
+        with mock.patch("src.ai_proxy.views.chat_views.reveal_compositor",
+                        RevealCompositor(masks, ConversationReveals())):
+            state = self.client.get("/api/ai_proxy/chat/reveal/",
+                                    {"conversation_id": hit["conversation_id"], "scene": scene}).json()
+            unknown = self.client.get("/api/ai_proxy/chat/reveal/",
+                                      {"conversation_id": hit["conversation_id"], "scene": "d" * 64})
+
+        self.assertEqual(hit["reveal_delta"], {"version": 1, "base_version": 0, "objects": ["tv"], "size": [16, 12],
+                                               "bbox": [4, 3, 10, 6], "counts": [0, 18]})
+        self.assertEqual((state["version"], state["objects"]), (1, ["tv"]))
+        self.assertEqual(BitMask.from_rle(16, 12, state["counts"]), BitMask.from_array(tv))
+        self.assertEqual(Conversation.objects.get(id=hit["conversation_id"]).revealed_objects, ["tv"])
+        self.assertEqual(unknown.status_code, 404)
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_chat_history_is_not_modified_until_the_next_turn(self):
+        conversation_id = self.turn("a chair")["conversation_id"]
+        url = "/api/ai_proxy/chat/history/"
+
+        response = self.client.get(url, {"conversation_id": conversation_id})
+        etag = response["ETag"]
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, {"conversation_id": conversation_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((not_modified.status_code, not_modified.content), (304, b""))
+
+        self.turn("a couch", conversation_id=conversation_id)
+        changed = self.client.get(url, {"conversation_id": conversation_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+    def test_conversation_list_pages_by_cursor(self):
+        for i in range(5):
+            Conversation.objects.create(title=f"game {i}")
+        url = "/api/ai_proxy/chat/history/"
+
+        titles, cursor = [], None
+        while True:
+            page = self.client.get(url, {"limit": 2, **({"cursor": cursor} if cursor else {})}).json()
+            titles += [conversation["title"] for conversation in page["conversations"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(titles, [f"game {i}" for i in reversed(range(5))])
+
+        first = self.client.get(url, {"limit": 2})
+        self.assertEqual(self.client.get(url, {"limit": 2}, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        self.assertEqual(self.client.get(url, {"cursor": "not a cursor"}).status_code, 400)
+
+
+class RiddleQueueTests(TestCase):
+
+    RIDDLES = json.dumps({
+        "chair": {"riddle": "I have four legs but never walk.", "hints": ["You sit on me.", "Not a couch."]},
+        "tv": {"riddle": "I show stories in a box.", "hints": ["I have a remote.", "Turn on the TV!"]},
+        "couch": {"riddle": "A comfy couch for three.", "hints": []},
+    })
+
+    def setUp(self):
+        conversation_cache.clear()
+        RiddleService._scenes.clear()
+
+    def test_riddles_that_give_the_object_away_are_dropped(self):
+        riddles = parse_riddles(f"Sure! Here they are:\n```json\n{self.RIDDLES}\n```", ["chair", "tv", "couch", "lamp"])
+        self.assertEqual(sorted(riddles), ["chair", "tv"])
+        self.assertEqual(riddles["tv"]["hints"], ["I have a remote."])
+        self.assertEqual(parse_riddles("I can't do that", ["chair"]), {})
+
+    def test_riddle_and_hint_requests(self):
+        for message, intent in [("Give me a riddle", "riddle"), ("next", "riddle"), ("hint please", "hint"),
+                                ("I'm stuck, help", "hint"), ("Is it a chair?", None),
+                                ("I don't understand the riddle", None), ("no hints", None)]:
+            self.assertEqual(riddle_intent(message), intent, message)
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_scene_riddles_are_generated_once_and_served_without_the_llm(self):
+        objects = {"chair": "/mask_images/mask_chair.png", "tv": "/mask_images/mask_tv.png"}
+        with mock.patch.object(LLMService, "complete", return_value=LLMResponse(answer=self.RIDDLES)) as complete:
+            queued = self.client.post("/api/ai_proxy/chat/riddles/", {"objects": list(objects)},
+                                      content_type="application/json").json()
+            # Another player of the same scene reuses the generated riddles
+            other = self.client.post("/api/ai_proxy/chat/riddles/", {"objects": ["tv", "chair"]},
+                                     content_type="application/json").json()
+        self.assertEqual(complete.call_count, 1)
+        self.assertEqual((queued["queued"], other["queued"]), (2, 2))
+        self.assertNotEqual(queued["conversation_id"], other["conversation_id"])
+
+        def say(message, hidden):
+            return self.client.post("/api/ai_proxy/chat/message/", {
+                "message": f"{message} $ {json.dumps(hidden)}", "conversation_id": queued["conversation_id"],
+            }, content_type="application/json").json()["response"]
+
+        with mock.patch.object(LLMService, "create_chat_completion") as llm:
+            self.assertEqual(say("Give me a riddle", objects), "I have four legs but never walk.")
+            self.assertEqual(say("hint", objects), "Hint: You sit on me.")
+        # Naming another hidden object is no answer to this riddle, the LLM replies
+        with mock.patch.object(LLMService, "create_chat_completion", return_value=LLMResponse(answer="No.")):
+            self.assertEqual(say("is it the tv?", objects), "No.")
+        with mock.patch.object(LLMService, "create_chat_completion") as llm:
+            self.assertIn("Congratulations", say("the chair!", objects))
+            self.assertEqual(say("next riddle", {"tv": objects["tv"]}), "I show stories in a box.")
+        llm.assert_not_called()
+
+        # Out of hints, or out of riddles, the LLM answers as before
+        with mock.patch.object(LLMService, "create_chat_completion", return_value=LLMResponse(answer="Think harder.")):
+            self.assertEqual(say("hint", {"tv": objects["tv"]}), "Hint: I have a remote.")
+            self.assertEqual(say("hint", {"tv": objects["tv"]}), "Think harder.")
+            self.assertEqual(say("another riddle", {"tv": objects["tv"]}), "Think harder.")
+        self.assertEqual(Riddle.objects.filter(conversation_id=queued["conversation_id"],
+                                               served_at__isnull=True).count(), 0)
+
+
+    def test_concurrent_players_of_a_new_scene_share_one_generation_call(self):
+        started, release = threading.Event(), threading.Event()
+
+        def complete(**kwargs):
+            started.set()
+            release.wait(5)
+            return LLMResponse(answer=self.RIDDLES)
+
+        llm = mock.Mock(complete=mock.Mock(side_effect=complete))
+        results = []
+        players = [threading.Thread(target=lambda: results.append(RiddleService(llm).generate(["chair", "tv"])))
+                   for _ in range(4)]
+        for player in players:
+            player.start()
+        started.wait(5)
+        time.sleep(0.05)
+        release.set()
+        for player in players:
+            player.join()
+
+        self.assertEqual(llm.complete.call_count, 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(RiddleService._in_flight, {})
+
+
+class ScenePackTests(TestCase):
+
+    RIDDLES = json.dumps({
+        "chair": {"riddle": "I have four legs but never walk.", "hints": ["You sit on me."]},
+        "tv": {"riddle": "I show stories in a box.", "hints": ["I have a remote."]},
+    })
+
+    def setUp(self):
+        conversation_cache.clear()
+        RiddleService._scenes.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.images, self.packs = os.path.join(tmp.name, "images"), os.path.join(tmp.name, "packs")
+        os.makedirs(self.images)
+        for shade, name in enumerate(["kitchen.png", "room.jpg"]):
+            Image.new("RGB", (16, 12), (shade * 90, 80, 40)).save(os.path.join(self.images, name))
+        with open(os.path.join(self.images, "notes.txt"), "w") as f:
+            f.write("not a scene")
+        cache = mock.patch("src.ai_proxy.services.image_service.segmentation_cache",
+                           SegmentationCache(tmp.name, max_bytes=0))
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def segmentation(self, params):
+        mask = Image.new("L", (16, 12))
+        mask.paste(255, (2, 2, 8, 10))
+        buffer = io.BytesIO()
+        mask.save(buffer, "PNG")
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return {"status": "success", "class_mask_pairs": {"chair": encoded, "tv": encoded}}
+
+    def build(self, *args):
+        out = io.StringIO()
+        call_command("build_scene_packs", self.images, "--out", self.packs, "--workers", "2", *args, stdout=out)
+        return out.getvalue()
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_scenes_are_packed_once_and_played_without_the_backends(self):
+        with mock.patch.object(ImageGenerationService, "_process_image", side_effect=self.segmentation) as segment, \
+                mock.patch.object(LLMService, "complete", return_value=LLMResponse(answer=self.RIDDLES)) as complete:
+            self.assertIn("2 of 2 scenes packed", self.build())
+            self.assertIn("up to date", self.build())
+        self.assertEqual(segment.call_count, 2)
+        # Base64 JSON, the body every segmentation server accepts
+        self.assertIsInstance(segment.call_args.args[0].image, str)
+        self.assertLessEqual(complete.call_count, 2)
+        self.assertEqual(len(os.listdir(self.packs)), 2)
+
+        with open(os.path.join(self.images, "kitchen.png"), "rb") as f:
+            pixels = image_key(f.read()).pixels
+        with mock.patch("src.ai_proxy.views.chat_views.scene_packs", ScenePacks(self.packs)), \
+                mock.patch.object(LLMService, "complete") as complete:
+            queued = self.client.post("/api/ai_proxy/chat/riddles/", {"scene_pack": pixels},
+                                      content_type="application/json").json()
+        complete.assert_not_called()
+        self.assertEqual(queued["queued"], 2)
+
+        with mock.patch.object(LLMService, "create_chat_completion") as llm:
+            response = self.client.post("/api/ai_proxy/chat/message/", {
+                "message": 'riddle $ {"tv": "/mask_images/mask_tv.png"}', "conversation_id": queued["conversation_id"],
+            }, content_type="application/json").json()
+        llm.assert_not_called()
+        self.assertEqual(response["response"], "I show stories in a box.")
+
+
+class GeneratePosesTests(TestCase):
+
+    def test_generate_poses_stream_sends_each_pose_when_ready(self):
+        def generate(wrapper, params, on_pose=None):
+            for name in ("yay", "initial_pose"):
+                on_pose(name, f"{name}-image")
+            return {}
+
+        with mock.patch.object(ComfyUIAPIWrapper, "generate_avatar_with_poses", autospec=True, side_effect=generate):
+            response = self.client.post(
+                "/api/ai_proxy/comfy/generate-poses/stream/", {"prompt": "a knight"}, content_type="application/json"
+            )
+            body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(body.count("event: pose"), 2)
+        self.assertLess(body.index('"name": "yay"'), body.index('"name": "initial_pose"'))
+        self.assertTrue(body.endswith("event: done\ndata: {}\n\n"))
+
+    def test_generate_poses_returns_raw_images_as_multipart(self):
+        poses = {"initial_pose": b"\x89PNG first", "yay": b"\x89PNG second"}
+        with mock.patch.object(ComfyUIAPIWrapper, "generate_avatar_with_poses", return_value=poses) as generate:
+            response = self.client.post(
+                "/api/ai_proxy/comfy/generate-poses/", {"prompt": "a knight"},
+                content_type="application/json", HTTP_ACCEPT="multipart/form-data",
+            )
+
+        self.assertEqual(generate.call_args.kwargs["as_base64"], False)
+        self.assertTrue(response["Content-Type"].startswith("multipart/form-data; boundary="))
+        self.assertIn(b'name="yay"; filename="yay"\r\nContent-Type: image/png\r\n\r\n\x89PNG second', response.content)
+
+
+class AvatarJobTests(TestCase):
+
+    def test_job_reports_partial_poses_then_result(self):
+        first_pose_sent = threading.Event()
+        release = threading.Event()
+
+        def generate(wrapper, params, on_pose=None):
+            on_pose("initial_pose", "first-image")
+            first_pose_sent.set()
+            release.wait(5)
+            on_pose("yay", "second-image")
+            return {"initial_pose": "first-image", "yay": "second-image"}
+
+        references = [("initial_pose", "initial.png"), ("yay", "yay.jpg")]
+        with mock.patch.object(ComfyUIAPIWrapper, "generate_avatar_with_poses", autospec=True, side_effect=generate), \
+                mock.patch.object(ComfyUIAPIWrapper, "_pose_references", return_value=references):
+            response = self.client.post(
+                "/api/ai_proxy/comfy/generate-poses/jobs/", {"prompt": "a knight"}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 202)
+            job = response.json()
+            self.assertEqual(response["Location"], job["status_url"])
+
+            first_pose_sent.wait(5)
+            status = self.client.get(job["status_url"]).json()
+            self.assertEqual((status["status"], status["progress"], status["ready"]), ("running", 0.5, ["initial_pose"]))
+            self.assertEqual(self.client.get(job["result_url"]).status_code, 202)
+            partial = self.client.get(job["result_url"] + "?partial=1")
+            self.assertEqual(partial.status_code, 200)
+            self.assertEqual((partial.json()["status"], partial.json()["partial"]),
+                             ("running", {"initial_pose": "first-image"}))
+
+            release.set()
+            for _ in range(500):
+                if self.client.get(job["status_url"]).json()["status"] == "succeeded":
+                    break
+                time.sleep(0.01)
+            result = self.client.get(job["result_url"])
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json(), {"initial_pose": "first-image", "yay": "second-image"})
+
+    def test_job_validation_and_unknown_ids(self):
+        response = self.client.post("/api/ai_proxy/comfy/generate-poses/jobs/", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/ai_proxy/comfy/jobs/nope/").status_code, 404)
+        self.assertEqual(self.client.get("/api/ai_proxy/comfy/jobs/nope/result/").status_code, 404)
+
+    def test_manager_bounds_pending_jobs_and_expires_results(self):
+        now = [0.0]
+        release = threading.Event()
+        manager = JobManager("test", max_workers=1, max_pending=1, ttl=10, clock=lambda: now[0])
+        try:
+            job = manager.submit("test", lambda job: release.wait(5) and "done")
+            with self.assertRaises(JobQueueFull):
+                manager.submit("test", lambda job: None)
+            release.set()
+        finally:
+            manager.shutdown()
+
+        self.assertEqual((job.status, job.result), ("succeeded", "done"))
+        now[0] = 9.0
+        self.assertIs(manager.get(job.id), job)
+        now[0] = 10.0
+        self.assertIsNone(manager.get(job.id))
+        self.assertEqual(manager.stats()["expired"], 1)
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        conversation_cache.clear()
+
+    @mock.patch.dict(os.environ, SYSTEM_PROMPT)
+    def test_async_chat_message_awaits_the_llm_and_saves_the_turn(self):
+        answer = LLMResponse(answer="It has four legs.")
+        with mock.patch.object(LLMService, "acreate_chat_completion", new=mock.AsyncMock(return_value=answer)):
+            response = self.client.post(
+                "/api/ai_proxy/async/chat/message/", {"message": "Is it a chair?"}, content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["response"], "It has four legs.")
+        conversation = Conversation.objects.get(id=response.json()["conversation_id"])
+        self.assertEqual([m.content for m in conversation.messages.all()][1:], ["Is it a chair?", "It has four legs."])
+
+    def test_async_generate_poses_collects_every_pose(self):
+        async def poses(wrapper, params, as_base64=True):
+            for name in ("yay", "initial_pose"):
+                yield name, f"{name}-image"
+
+        with mock.patch.object(ComfyUIAPIWrapper, "iter_avatar_poses", autospec=True, side_effect=poses):
+            response = self.client.post(
+                "/api/ai_proxy/async/comfy/generate-poses/", {"prompt": "a knight"}, content_type="application/json"
+            )
+            missing = self.client.post("/api/ai_proxy/async/comfy/generate-poses/", {}, content_type="application/json")
+
+        self.assertEqual(response.json(), {"yay": "yay-image", "initial_pose": "initial_pose-image"})
+        self.assertEqual(missing.status_code, 400)
+
+    def test_acreate_chat_completion_uses_one_pool_per_event_loop(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                body = json.dumps({"received_data": {"answer": "pong"}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service = LLMService()
+        service.url = f"http://127.0.0.1:{server.server_address[1]}"
+        messages = [LLMMessage(role="system", content="Riddles."), LLMMessage(role="user", content="ping")]
+
+        async def run():
+            results = await asyncio.gather(*(service.acreate_chat_completion(messages=messages) for _ in range(10)))
+            self.assertIs(get_async_client(), get_async_client())
+            return results, get_async_client()
+
+        try:
+            results, first_client = asyncio.run(run())
+            _, second_client = asyncio.run(run())
+        finally:
+            server.shutdown()
+
+        self.assertEqual({result.answer for result in results}, {"pong"})
+        # A new loop gets its own client, a client is never used across loops, and is closed with its loop
+        self.assertIsNot(first_client, second_client)
+        self.assertTrue(first_client.is_closed and second_client.is_closed)
+
+        # Every call went through the LLM backend's client and shows up in its stats
+        stats = self.client.get("/api/ai_proxy/backends/stats/").json()
+        llm_stats = [backend for backend in stats.values() if backend["url"] == service.url]
+        self.assertEqual((llm_stats[0]["calls"], llm_stats[0]["errors"], llm_stats[0]["circuit"]), (20, 0, "closed"))
@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views import llm_views, chat_views
+from .views import llm_views, chat_views, comfy_views, async_views, backend_views
 
 app_name = 'ai_proxy'
 
@@ -13,9 +13,28 @@ urlpatterns = [
     
     # Chat endpoints
     path('chat/message/', chat_views.chat_message, name='chat_message'),
+    path('chat/message/stream/', chat_views.chat_message_stream, name='chat_message_stream'),
     path('chat/history/', chat_views.chat_history, name='chat_history'),
     path('chat/clear/', chat_views.clear_chat, name='clear_chat'),
+    path('chat/riddles/', chat_views.queue_riddles, name='queue_riddles'),
+    path('chat/reveal/', chat_views.chat_reveal, name='chat_reveal'),
 
     # ComfyUI endpoints
+    path('comfy/generate-poses/', comfy_views.generate_poses, name='generate_poses'),
+    path('comfy/generate-poses/stream/', comfy_views.generate_poses_stream, name='generate_poses_stream'),
+    path('comfy/generate-poses/jobs/', comfy_views.submit_poses_job, name='submit_poses_job'),
+    path('comfy/jobs/stats/', comfy_views.avatar_job_stats, name='avatar_job_stats'),
+    path('comfy/jobs/<str:job_id>/', comfy_views.avatar_job_status, name='avatar_job_status'),
+    path('comfy/jobs/<str:job_id>/result/', comfy_views.avatar_job_result, name='avatar_job_result'),
     #path('comfy/status/', views.comfy_status, name='comfy_status'),
+
+    # Backend pool, circuit breaker and latency stats
+    path('backends/stats/', backend_views.backends_stats, name='backends_stats'),
+    path('image/cache/stats/', backend_views.image_cache_stats, name='image_cache_stats'),
+
+    # Async versions of the slow endpoints, for serving under ASGI
+    path('async/llm/generate/', async_views.generate_text, name='async_generate_text'),
+    path('async/chat/message/', async_views.chat_message, name='async_chat_message'),
+    path('async/comfy/generate-poses/', async_views.generate_poses, name='async_generate_poses'),
+    path('async/image/generate/', async_views.generate_image, name='async_generate_image'),
 ]
\ No newline at end of file
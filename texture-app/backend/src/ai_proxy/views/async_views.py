@@ -0,0 +1,167 @@
+## Async views, for serving the proxy under ASGI (texture_app.asgi)
+#
+# DRF 3.14 has no async support, so these are plain Django views. Each request
+# awaits its backend call on the event loop instead of holding a worker thread,
+# which lets one process keep hundreds of slow GPU calls in flight. Database work
+# runs through sync_to_async. Under WSGI the blocking views in the other modules
+# remain the better choice.
+import functools
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from ..services.chat_service import ChatBOT
+from ..services.image_service import ImageGenerationParameters, ImageGenerationService
+from ..services.llm_service import Message
+from .chat_views import _reveal_delta, _since_id
+from .comfy_views import _multipart_poses, _pose_params, comfy_wrapper
+from .llm_views import llm_service
+
+logger = logging.getLogger(__name__)
+
+image_service = ImageGenerationService()
+
+
+def async_post(view):
+    """require_POST plus csrf_exempt (as DRF's api_view does) for async views
+
+    Django 4.2's own decorators wrap views in sync functions, which would hide the coroutine from the handler.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        return await view(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _request_data(request):
+    """Fields of a JSON or form request body, None if the JSON is malformed"""
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except json.JSONDecodeError:
+            return None
+    return request.POST.dict()
+
+
+@async_post
+async def generate_text(request):
+    """
+    Async endpoint to generate text from the LLM service
+    """
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"error": "Malformed JSON body"}, status=400)
+
+    try:
+        response = await llm_service.acreate_chat_completion(
+            messages=[Message(role="user", content=data.get('message', ''))],
+            system_prompt=data.get('system_prompt'),
+            temperature=data.get('temperature'),
+            max_tokens=data.get('max_tokens')
+        )
+        if response is None:
+            return JsonResponse({"error": "LLM service failed to generate a response"}, status=502)
+        return JsonResponse(response.as_dict())
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@async_post
+async def chat_message(request):
+    """
+    Async endpoint to send a message to the chatbot and get a response
+    """
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"error": "Malformed JSON body"}, status=400)
+
+    user_message = data.get('message', '')
+    if not user_message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+
+    try:
+        chatbot = await sync_to_async(ChatBOT)(conversation_id=data.get('conversation_id'))
+        assistant_response = await chatbot.agenerate_response(
+            user_message=user_message,
+            temperature=data.get('temperature')
+        )
+        return JsonResponse({
+            "response": assistant_response,
+            "reveal": chatbot.revealed,
+            # Reads and advances the reveal state in the database
+            "reveal_delta": await sync_to_async(_reveal_delta)(chatbot, data.get('scene')),
+            **chatbot.get_history_since(_since_id(data.get('since_id'))),
+            "conversation_id": chatbot.conversation.id
+        })
+
+    except Exception as e:
+        logger.error(f"Error in async chat_message: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@async_post
+async def generate_poses(request):
+    """
+    Async endpoint to generate an avatar in all of its poses
+
+    Poses come back as Base64 strings in JSON, or as raw images in a
+    multipart/form-data body if the client sends "Accept: multipart/form-data".
+    """
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"error": "Malformed JSON body"}, status=400)
+
+    params = _pose_params(data)
+    if not params["positive_prompt"]:
+        return JsonResponse({"error": "Missing positive_prompt parameter"}, status=400)
+
+    binary = "multipart/form-data" in request.headers.get("Accept", "")
+    try:
+        poses = {}
+        async for pose_name, pose_image in comfy_wrapper.iter_avatar_poses(params, as_base64=not binary):
+            poses[pose_name] = pose_image
+        if binary:
+            return _multipart_poses(poses)
+        return JsonResponse(poses)
+
+    except Exception as e:
+        logger.error(f"Error in async generate_poses: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@async_post
+async def generate_image(request):
+    """
+    Async endpoint to process an image with the image generation service
+
+    Takes {"image": <Base64>} as JSON, or the image as a multipart file named "image".
+    With mask_format "rle" the masks come back as run lengths instead of PNGs.
+    """
+    if "image" in request.FILES:
+        image = request.FILES["image"].read()
+        mask_format = request.POST.get("mask_format", "png")
+    else:
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"error": "Malformed JSON body"}, status=400)
+        image = data.get("image")
+        mask_format = data.get("mask_format", "png")
+    if not image:
+        return JsonResponse({"error": "No image provided"}, status=400)
+    if mask_format not in ("png", "rle"):
+        return JsonResponse({"error": "mask_format must be png or rle"}, status=400)
+
+    try:
+        return JsonResponse(await image_service.agenerate_image(
+            ImageGenerationParameters(image=image, mask_format=mask_format)))
+
+    except Exception as e:
+        logger.error(f"Error in async generate_image: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
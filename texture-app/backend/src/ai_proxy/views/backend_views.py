@@ -0,0 +1,21 @@
+## Health of the GPU backends behind the proxy
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from ..services.backend_client import backend_stats
+from ..services.image_service import scene_packs, segmentation_cache
+
+
+@api_view(['GET'])
+def backends_stats(request):
+    """
+    Endpoint with the connection limits, circuit breaker state and latencies of every backend
+    """
+    return Response(backend_stats())
+
+
+@api_view(['GET'])
+def image_cache_stats(request):
+    """
+    Endpoint with the size and hit rate of the segmentation result cache, and of the scene packs
+    """
+    return Response({**segmentation_cache.as_dict(), "scene_packs": scene_packs.as_dict()})
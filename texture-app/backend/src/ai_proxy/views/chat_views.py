@@ -1,13 +1,32 @@
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from ..services.chat_service import ChatBOT
+from ..services.guess_matcher import parse_objects
+from ..services.image_service import scene_masks, scene_packs
+from ..services.reveal import RevealCompositor
+from ..services.reveal_store import ConversationReveals
+from ..services.riddle_service import RiddleService
 from ..models import Conversation
+import base64
+import binascii
+import hashlib
 import logging
 import json
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Conversations per page of the conversation list, clients may ask for up to MAX_CONVERSATIONS_PAGE_SIZE
+CONVERSATIONS_PAGE_SIZE = 50
+MAX_CONVERSATIONS_PAGE_SIZE = 200
+
+# What each conversation has uncovered of its scene so far, kept in the database for every process
+reveal_compositor = RevealCompositor(scene_masks, ConversationReveals())
+
+
 @api_view(['POST'])
 def chat_message(request):
     """
@@ -33,9 +52,14 @@ def chat_message(request):
             temperature=temperature
         )
         
+        # Only the messages after since_id if the client sent the cursor of its previous response
         return Response({
             "response": assistant_response,
-            "history": chatbot.get_history(),
+            # Objects the guess found, the client uncovers them
+            "reveal": chatbot.revealed,
+            # Only the pixels they uncover, when the client sent the scene id of its image
+            "reveal_delta": _reveal_delta(chatbot, data.get('scene')),
+            **chatbot.get_history_since(_since_id(data.get('since_id'))),
             "conversation_id": chatbot.conversation.id
         })
     
@@ -43,40 +67,204 @@ def chat_message(request):
         logger.error(f"Error in chat_message: {str(e)}")
         return Response({"error": str(e)}, status=500)
 
+@api_view(['POST'])
+def chat_message_stream(request):
+    """
+    Endpoint to send a message to the chatbot and stream the response back as Server-Sent Events
+
+    Events: `meta` with the conversation id, one `data: {"delta": ...}` per text chunk,
+    then `done` with the full response, the objects it reveals and, like chat_message,
+    the history after the since_id cursor (or `error`).
+    """
+    data = request.data
+    user_message = data.get('message', '')
+    conversation_id = data.get('conversation_id')
+
+    if not user_message:
+        return Response({"error": "Message is required"}, status=400)
+
+    try:
+        chatbot = ChatBOT(conversation_id=conversation_id)
+    except Exception as e:
+        logger.error(f"Error in chat_message_stream: {str(e)}")
+        return Response({"error": str(e)}, status=500)
+
+    def events():
+        yield sse_event({"conversation_id": chatbot.conversation.id}, event="meta")
+        chunks = []
+        try:
+            for chunk in chatbot.stream_response(user_message=user_message, temperature=data.get('temperature')):
+                chunks.append(chunk)
+                yield sse_event({"delta": chunk})
+            yield sse_event({"response": "".join(chunks), "reveal": chatbot.revealed,
+                             "reveal_delta": _reveal_delta(chatbot, data.get('scene')),
+                             **chatbot.get_history_since(_since_id(data.get('since_id'))),
+                             "conversation_id": chatbot.conversation.id}, event="done")
+        except Exception as e:
+            logger.error(f"Error in chat_message_stream: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
 @api_view(['GET'])
 def chat_history(request):
     """
     Endpoint to get the current chat history
+
+    With conversation_id: the conversation's messages, only those after the
+    since_id cursor when given. Answers 304 if If-None-Match has the ETag of an
+    unchanged history.
+
+    Without: a page of conversations, most recently updated first. Pass the
+    next_cursor of a page as cursor to get the next one, limit sets the page size.
     """
     try:
         conversation_id = request.query_params.get('conversation_id')
         
         if not conversation_id:
-            # Return list of all conversations for a single-user app
-            conversations = Conversation.objects.all().order_by('-updated_at')
-            
-            return Response({
-                "conversations": [
-                    {
-                        "id": conv.id,
-                        "title": conv.title,
-                        "created_at": conv.created_at,
-                        "updated_at": conv.updated_at
-                    } for conv in conversations
-                ]
-            })
+            # Return a page of conversations for a single-user app
+            return _conversation_page(request)
         
         # Get specific conversation history
         chatbot = ChatBOT(conversation_id=conversation_id)
+        if _not_modified(request, chatbot.etag):
+            return Response(status=304, headers={"ETag": chatbot.etag})
         return Response({
             "conversation_id": chatbot.conversation.id,
-            "history": chatbot.get_history()
-        })
+            **chatbot.get_history_since(_since_id(request.query_params.get('since_id')))
+        }, headers={"ETag": chatbot.etag, "Cache-Control": "no-cache"})
     
     except Exception as e:
         logger.error(f"Error in chat_history: {str(e)}")
         return Response({"error": str(e)}, status=500)
 
+
+def _conversation_page(request):
+    """One page of the conversation list, keyset paginated on (updated_at, id) so any page costs the same"""
+    try:
+        limit = min(int(request.query_params.get('limit', CONVERSATIONS_PAGE_SIZE)), MAX_CONVERSATIONS_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return Response({"error": "Invalid limit or cursor"}, status=400)
+    if limit < 1:
+        return Response({"error": "Invalid limit or cursor"}, status=400)
+
+    conversations = Conversation.objects.order_by('-updated_at', '-id')
+    if after is not None:
+        updated_at, last_id = after
+        conversations = conversations.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=last_id))
+    page = list(conversations.values('id', 'title', 'created_at', 'updated_at')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    etag = '"%s"' % hashlib.md5(json.dumps(
+        [[conv['id'], conv['title'], conv['updated_at'].isoformat()] for conv in page] + [has_more]
+    ).encode()).hexdigest()
+    if _not_modified(request, etag):
+        return Response(status=304, headers={"ETag": etag})
+
+    return Response({
+        "conversations": page,
+        "next_cursor": _encode_cursor(page[-1]['updated_at'], page[-1]['id']) if has_more else None,
+    }, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def _encode_cursor(updated_at, conversation_id):
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{conversation_id}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """(updated_at, id) of a next_cursor, raises ValueError if it is malformed"""
+    try:
+        updated_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    return datetime.fromisoformat(updated_at), int(conversation_id)
+
+
+def _since_id(value):
+    """The since_id cursor sent by a client, None if it is missing or malformed (the client then gets everything)"""
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _reveal_delta(chatbot, scene):
+    """The pixels the last guess uncovered in the scene, None if it found nothing or the scene's masks are unknown"""
+    if not chatbot.revealed or not scene:
+        return None
+    delta = reveal_compositor.reveal(chatbot.conversation.id, scene, chatbot.revealed)
+    return delta.as_dict() if delta is not None else None
+
+
+def _not_modified(request, etag):
+    """Whether the client's If-None-Match has ``etag``"""
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    return etag in etags or "*" in etags
+
+@api_view(['POST'])
+def queue_riddles(request):
+    """
+    Endpoint to pre-generate the riddles of a scene and queue them for a conversation
+
+    Takes the scene's objects (a list of names, the {name: mask} pairs of the
+    scene, or object details text) and an optional conversation_id. One LLM call
+    writes every riddle and hint; ChatBOT then serves them without the LLM when
+    the player asks for a riddle or a hint. With the scene_pack id of a scene
+    that has one, its precomputed riddles are queued and the LLM isn't called.
+    """
+    try:
+        data = request.data
+        pack = scene_packs.get(data['scene_pack']) if data.get('scene_pack') else None
+        known = pack.riddles if pack is not None and pack.riddles else None
+        objects = data.get('objects') or (list(known) if known else None)
+        objects = parse_objects(objects if isinstance(objects, str) else json.dumps(objects or []))
+        if not objects:
+            return Response({"error": "objects is required"}, status=400)
+
+        chatbot = ChatBOT(conversation_id=data.get('conversation_id'))
+        queued = RiddleService(chatbot.llm_service).fill_queue(
+            chatbot.conversation, objects, known=known)
+        return Response({"conversation_id": chatbot.conversation.id, "queued": queued})
+
+    except Exception as e:
+        logger.error(f"Error in queue_riddles: {str(e)}")
+        return Response({"error": str(e)}, status=500)
+
+
+@api_view(['GET'])
+def chat_reveal(request):
+    """
+    Endpoint with everything a conversation has uncovered of its scene, as run lengths
+
+    For clients that start late or missed a reveal_delta (its base_version is
+    not the version they have). Takes conversation_id and scene.
+    """
+    try:
+        conversation_id = int(request.query_params.get('conversation_id'))
+    except (TypeError, ValueError):
+        conversation_id = None
+    scene = request.query_params.get('scene')
+    if conversation_id is None or not scene:
+        return Response({"error": "conversation_id and scene are required"}, status=400)
+    state = reveal_compositor.state(conversation_id, scene)
+    if state is None:
+        return Response({"error": "Unknown scene"}, status=404)
+    return Response(state)
+
+
 @api_view(['POST'])
 def clear_chat(request):
     """
@@ -92,6 +280,7 @@ def clear_chat(request):
         
         chatbot = ChatBOT(conversation_id=conversation_id)
         chatbot.clear_history(keep_system_prompt=keep_system_prompt)
+        reveal_compositor.forget(chatbot.conversation.id)
         
         return Response({
             "message": "Chat history cleared",
@@ -1 +1,197 @@
 ## GET POST for comfy
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from ..services.comfy_service import ComfyUIAPIWrapper
+from ..services.jobs import JobManager, JobQueueFull
+from .chat_views import sse_event
+import logging
+import os
+import queue
+import threading
+from urllib3.filepost import encode_multipart_formdata
+
+logger = logging.getLogger(__name__)
+
+# Initialize the service once
+comfy_wrapper = ComfyUIAPIWrapper()
+
+# Avatar generations submitted through the job API. ComfyUI renders one prompt at a time,
+# so a couple of concurrent avatars already keep its queue full.
+avatar_jobs = JobManager(
+    "avatar",
+    max_workers=int(os.environ.get("COMFY_JOB_WORKERS", "2")),
+    max_pending=int(os.environ.get("COMFY_JOB_MAX_PENDING", "16")),
+    ttl=float(os.environ.get("COMFY_JOB_TTL", "3600")),
+)
+
+
+def _pose_params(data):
+    # The character page posts {"prompt": ...}
+    return {"positive_prompt": data.get('positive_prompt') or data.get('prompt', '')}
+
+
+class MultipartPosesRenderer(BaseRenderer):
+    """Makes "Accept: multipart/form-data" negotiable, generate_poses builds that body itself"""
+    media_type = "multipart/form-data"
+    format = "multipart"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+def _image_type(data):
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def _multipart_poses(poses):
+    """multipart/form-data body with one file part per pose, readable in the browser with response.formData()"""
+    body, content_type = encode_multipart_formdata({
+        name: (name, image, _image_type(image)) for name, image in poses.items()
+    })
+    return HttpResponse(body, content_type=content_type)
+
+
+@api_view(['POST'])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [MultipartPosesRenderer])
+def generate_poses(request):
+    """
+    Endpoint to generate an avatar in all of its poses
+
+    Poses come back as Base64 strings in JSON, or as raw images in a
+    multipart/form-data body if the client sends "Accept: multipart/form-data".
+    """
+    try:
+        binary = isinstance(request.accepted_renderer, MultipartPosesRenderer)
+        result = comfy_wrapper.generate_avatar_with_poses(_pose_params(request.data), as_base64=not binary)
+        if "error" in result:
+            return JsonResponse(result, status=400)
+        if binary:
+            return _multipart_poses(result)
+        return Response(result)
+
+    except Exception as e:
+        logger.error(f"Error in generate_poses: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@api_view(['POST'])
+def generate_poses_stream(request):
+    """
+    Endpoint to generate an avatar and stream each pose as soon as it is ready, as Server-Sent Events
+
+    Events: `pose` with {"name", "image"} per pose in completion order, then `done` (or `error`).
+    """
+    params = _pose_params(request.data)
+    if not params["positive_prompt"]:
+        return Response({"error": "Missing positive_prompt parameter"}, status=400)
+
+    poses = queue.Queue()
+
+    def generate():
+        try:
+            comfy_wrapper.generate_avatar_with_poses(params, on_pose=lambda name, image: poses.put((name, image)))
+            poses.put(None)
+        except Exception as e:
+            logger.error(f"Error in generate_poses_stream: {str(e)}")
+            poses.put(e)
+
+    def events():
+        threading.Thread(target=generate, daemon=True).start()
+        while True:
+            item = poses.get()
+            if item is None:
+                yield sse_event({}, event="done")
+                return
+            if isinstance(item, Exception):
+                yield sse_event({"error": str(item)}, event="error")
+                return
+            name, image = item
+            yield sse_event({"name": name, "image": image}, event="pose")
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _generate_poses_job(job, params):
+    total = len(comfy_wrapper._pose_references())
+
+    def on_pose(name, image):
+        job.add_partial(name, image, total=total)
+
+    result = comfy_wrapper.generate_avatar_with_poses(params, on_pose=on_pose)
+    if "error" in result:
+        raise ValueError(result["error"])
+    return result
+
+
+def _job_urls(request, job):
+    return {
+        "status_url": request.build_absolute_uri(reverse("ai_proxy:avatar_job_status", args=[job.id])),
+        "result_url": request.build_absolute_uri(reverse("ai_proxy:avatar_job_result", args=[job.id])),
+    }
+
+
+@api_view(['POST'])
+def submit_poses_job(request):
+    """
+    Start generating an avatar in all of its poses and return at once with 202 and the job id
+
+    Poll the status URL for progress (the names of finished poses are listed
+    under "ready"), then fetch the poses from the result URL.
+    """
+    params = _pose_params(request.data)
+    if not params["positive_prompt"]:
+        return Response({"error": "Missing positive_prompt parameter"}, status=400)
+
+    try:
+        job = avatar_jobs.submit("avatar", _generate_poses_job, params)
+    except JobQueueFull as e:
+        return Response({"error": str(e)}, status=503)
+
+    urls = _job_urls(request, job)
+    return Response({**job.as_dict(), **urls}, status=202, headers={"Location": urls["status_url"]})
+
+
+@api_view(['GET'])
+def avatar_job_status(request, job_id):
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        return Response({"error": f"Unknown or expired job {job_id}"}, status=404)
+    return Response(job.as_dict())
+
+
+@api_view(['GET'])
+def avatar_job_result(request, job_id):
+    """
+    Poses of a finished avatar job as Base64 strings, 202 with the job status while it runs
+
+    ?partial=1 returns the job status with the poses that are already done under
+    "partial", without waiting for the rest.
+    """
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        return Response({"error": f"Unknown or expired job {job_id}"}, status=404)
+    if job.status == "failed":
+        return Response(job.as_dict(), status=500)
+    if job.status == "succeeded":
+        return Response(job.result)
+    if request.query_params.get("partial"):
+        return Response({**job.as_dict(), "partial": job.partial_results()})
+    return Response(job.as_dict(), status=202)
+
+
+@api_view(['GET'])
+def avatar_job_stats(request):
+    return Response(avatar_jobs.stats())
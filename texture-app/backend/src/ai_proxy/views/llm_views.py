@@ -35,7 +35,9 @@ def generate_text(request):
             max_tokens=max_tokens
         )
         
-        return Response(response)
+        if response is None:
+            return Response({"error": "LLM service failed to generate a response"}, status=502)
+        return Response(response.as_dict())
     
     except Exception as e:
         return Response({"error": str(e)}, status=500)
\ No newline at end of file
@@ -0,0 +1,245 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InpaintJob:
+    """One inpaint request waiting for, or running in, a pipeline batch."""
+    prompt: str
+    init_image: Image.Image
+    mask_image: Image.Image
+    guidance_scale: float
+    num_inference_steps: int
+    scheduler: Optional[str] = None
+    job_id: int = 0
+    result: Optional[Image.Image] = None
+    error: Optional[BaseException] = None
+    batch_size: int = 0
+    progress: float = 0.0
+    submitted_at: float = field(default_factory=time.perf_counter)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def batch_key(self) -> Tuple[Any, ...]:
+        """Jobs with equal keys can share one pipeline call"""
+        return self.init_image.size, self.num_inference_steps, self.guidance_scale, self.scheduler
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def status(self) -> str:
+        if not self.finished:
+            return "queued" if self.started_at is None else "running"
+        return "failed" if self.error is not None else "succeeded"
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+    def wait(self, timeout: Optional[float] = None) -> Image.Image:
+        """Block until the job's batch has run and return the inpainted image."""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Inpaint job {self.job_id} did not finish within {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@dataclass
+class BatcherStats:
+    """Counters exported by the batcher (read without locking, they are only informative)."""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    batches: int = 0
+    batched_jobs: int = 0
+    max_batch_seen: int = 0
+    busy_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "max_batch_seen": self.max_batch_seen,
+            "mean_batch_size": self.batched_jobs / self.batches if self.batches else 0.0,
+            "busy_seconds": self.busy_seconds,
+        }
+
+
+class InpaintBatcher:
+    """Micro-batching queue in front of an inpainting pipeline.
+
+    A single worker thread owns the pipeline, so concurrent Flask requests no
+    longer contend on it. When a job arrives the worker waits up to
+    ``max_wait`` seconds for more jobs with the same image size, step count,
+    guidance scale and scheduler, then runs up to ``max_batch_size`` of them as
+    one pipeline call. Jobs that do not match keep their place in line for the
+    next batch.
+
+    The inpainter has to provide:
+        generate_batch(prompts, init_images, mask_images, guidance_scale, num_inference_steps, scheduler, on_step)
+            -> List[Image]
+    where on_step(steps_done, total_steps) is called after every denoising step.
+    """
+
+    def __init__(self, inpainter, max_batch_size: int = 4, max_wait: float = 0.05, max_queue_size: int = 64):
+        self.inpainter = inpainter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = BatcherStats()
+
+        self._queue: "queue.Queue[InpaintJob]" = queue.Queue(maxsize=max_queue_size)
+        self._pending: List[InpaintJob] = []
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "InpaintBatcher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="inpaint-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, prompt: str, init_image: Image.Image, mask_image: Image.Image,
+               guidance_scale: float = 5, num_inference_steps: int = 150,
+               scheduler: Optional[str] = None) -> InpaintJob:
+        """Queue an inpaint job. Raises ``queue.Full`` when the backlog is saturated.
+
+        ``scheduler`` names a diffusers scheduler class, None keeps the pipeline's own.
+        """
+        job = InpaintJob(
+            prompt=prompt,
+            init_image=init_image,
+            mask_image=mask_image,
+            guidance_scale=guidance_scale,
+            num_inference_steps=num_inference_steps,
+            scheduler=scheduler,
+            job_id=next(self._ids),
+        )
+        self._queue.put_nowait(job)
+        self.stats.submitted += 1
+        return job
+
+    def generate(self, prompt: str, init_image: Image.Image, mask_image: Image.Image,
+                 guidance_scale: float = 5, num_inference_steps: int = 150, scheduler: Optional[str] = None,
+                 timeout: Optional[float] = None) -> Image.Image:
+        return self.submit(prompt, init_image, mask_image, guidance_scale, num_inference_steps,
+                           scheduler).wait(timeout)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() + len(self._pending)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._execute(batch)
+        # Fail whatever is left so no caller blocks forever on shutdown
+        self._drain()
+        for job in self._pending:
+            self._finish(job, error=RuntimeError("Batcher stopped"))
+        self._pending = []
+
+    def _drain(self, timeout: Optional[float] = None) -> bool:
+        """Move queued jobs to the pending list, waiting up to timeout for the first. Returns True if any moved."""
+        moved = False
+        try:
+            if timeout is not None and timeout > 0:
+                self._pending.append(self._queue.get(timeout=timeout))
+                moved = True
+            while True:
+                self._pending.append(self._queue.get_nowait())
+                moved = True
+        except queue.Empty:
+            return moved
+
+    def _next_batch(self) -> List[InpaintJob]:
+        self._drain()
+        if not self._pending and not self._drain(timeout=0.1):
+            return []
+
+        # The oldest job decides the batch, compatible younger ones ride along
+        head = self._pending[0]
+        deadline = head.submitted_at + self.max_wait
+        while True:
+            batch = [job for job in self._pending if job.batch_key == head.batch_key][:self.max_batch_size]
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch_size or remaining <= 0 or self._stop.is_set():
+                break
+            self._drain(timeout=remaining)
+
+        taken = set(id(job) for job in batch)
+        self._pending = [job for job in self._pending if id(job) not in taken]
+        return batch
+
+    def _execute(self, batch: List[InpaintJob]) -> None:
+        head = batch[0]
+        start = time.perf_counter()
+        for job in batch:
+            job.started_at = start
+            job.batch_size = len(batch)
+        try:
+            images = self.inpainter.generate_batch(
+                [job.prompt for job in batch],
+                [job.init_image for job in batch],
+                [job.mask_image for job in batch],
+                guidance_scale=head.guidance_scale,
+                num_inference_steps=head.num_inference_steps,
+                scheduler=head.scheduler,
+                on_step=lambda step, total: self._progress(batch, step / total),
+            )
+        except Exception as e:
+            logger.exception(f"Inpaint batch of {len(batch)} failed")
+            for job in batch:
+                self._finish(job, error=e)
+            return
+        finally:
+            self.stats.busy_seconds += time.perf_counter() - start
+
+        self.stats.batches += 1
+        self.stats.batched_jobs += len(batch)
+        self.stats.max_batch_seen = max(self.stats.max_batch_seen, len(batch))
+        for job, image in zip(batch, images):
+            self._finish(job, result=image)
+
+    @staticmethod
+    def _progress(batch: List[InpaintJob], progress: float) -> None:
+        for job in batch:
+            job.progress = progress
+
+    def _finish(self, job: InpaintJob, result: Optional[Image.Image] = None,
+                error: Optional[BaseException] = None) -> None:
+        job.result = result
+        job.error = error
+        job.finished_at = time.perf_counter()
+        if error is None:
+            job.progress = 1.0
+            self.stats.completed += 1
+        else:
+            self.stats.failed += 1
+        job._done.set()
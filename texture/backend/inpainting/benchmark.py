@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Throughput / latency benchmark for the inpaint micro-batcher.
+
+Runs the batcher in-process with the stub pipeline (default, CPU only) or the
+real Inpainter, and compares batch size 1 (the old one request at a time
+behaviour) against micro-batching.
+
+    python benchmark.py --clients 8 --requests 4
+    python benchmark.py --backend diffusers --steps 30
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+from PIL import Image
+
+from batcher import InpaintBatcher
+
+
+def load_inpainter(args):
+    if args.backend == "stub":
+        from stub_pipeline import StubInpainter
+        return StubInpainter(step_ms=args.step_ms, image_ms=args.image_ms)
+
+    from inpaint import Inpainter
+    return Inpainter()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run(inpainter, max_batch_size, max_wait, clients, requests_per_client, steps, size):
+    batcher = InpaintBatcher(inpainter, max_batch_size=max_batch_size, max_wait=max_wait).start()
+    scene = Image.new("RGB", (size, size), (120, 110, 100))
+    mask = Image.new("L", (size, size), 0)
+    mask.paste(255, (size // 4, size // 4, size // 2, size // 2))
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        for i in range(requests_per_client):
+            job = batcher.submit(f"object {index}-{i}", scene, mask, num_inference_steps=steps)
+            job.wait()
+            with lock:
+                latencies.append(job.latency)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    batcher.stop()
+
+    return {
+        "max_batch_size": max_batch_size,
+        "requests": len(latencies),
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_s": statistics.median(latencies),
+        "p99_s": percentile(latencies, 99),
+        "mean_batch": batcher.stats.as_dict()["mean_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inpaint micro-batcher")
+    parser.add_argument("--backend", choices=["stub", "diffusers"], default="stub")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=4, help="Requests per client")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-wait-ms", type=float, default=50.0)
+    parser.add_argument("--step-ms", type=float, default=2.0, help="Stub denoising step cost")
+    parser.add_argument("--image-ms", type=float, default=0.5, help="Stub per-image step cost")
+    args = parser.parse_args()
+
+    inpainter = load_inpainter(args)
+    print(f"{'batch':>6} {'reqs':>5} {'req/s':>8} {'p50 s':>8} {'p99 s':>8} {'mean batch':>11}")
+    for batch_size in args.batch_sizes:
+        result = run(inpainter, batch_size, args.max_wait_ms / 1000.0, args.clients, args.requests,
+                     args.steps, args.size)
+        print(f"{result['max_batch_size']:>6} {result['requests']:>5} {result['requests_per_s']:>8.2f} "
+              f"{result['p50_s']:>8.2f} {result['p99_s']:>8.2f} {result['mean_batch']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
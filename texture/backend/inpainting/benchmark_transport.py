@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Payload size and CPU cost of moving one inpaint request and response.
+
+Compares the base64-in-JSON transport with multipart/form-data requests and
+raw image/png or image/webp response bodies. Decoding time includes turning
+the payload back into a PIL image, which every path has to do.
+
+    python benchmark_transport.py
+    python benchmark_transport.py --image scene.png --mask mask.png
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+from urllib3.filepost import encode_multipart_formdata
+
+from image_io import decode_image, encode_image, to_data_uri
+
+
+def synthetic_image(size):
+    """Gradient plus noise, compresses about like a photo"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size]
+    pixels = np.stack([x, y, (x + y) // 2], axis=-1) * (255 / size)
+    pixels = pixels + rng.normal(0, 12, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def synthetic_mask(size):
+    mask = np.zeros((size, size), dtype=np.uint8)
+    mask[size // 4:size // 2, size // 3:size * 2 // 3] = 255
+    return Image.fromarray(mask)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON/base64 against binary image transport")
+    parser.add_argument("--image", help="Scene image, a synthetic one if not given")
+    parser.add_argument("--mask", help="Mask image, a synthetic one if not given")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert("RGB") if args.image else synthetic_image(args.size)
+    mask = Image.open(args.mask).convert("RGB") if args.mask else synthetic_mask(args.size)
+    png_image, png_mask = encode_image(image), encode_image(mask)
+
+    # Requests: the client has encoded PNGs, the server needs PIL images
+    def json_request():
+        return json.dumps({"prompt": "a chair", "image": to_data_uri(png_image), "mask": to_data_uri(png_mask)})
+
+    def multipart_request():
+        return encode_multipart_formdata({
+            "prompt": "a chair",
+            "image": ("image.png", png_image, "image/png"),
+            "mask": ("mask.png", png_mask, "image/png"),
+        })[0]
+
+    json_body = json_request()
+    multipart_body = multipart_request()
+    image_start = multipart_body.index(png_image)
+    mask_start = multipart_body.index(png_mask, image_start + len(png_image))
+
+    def json_decode():
+        data = json.loads(json_body)
+        return decode_image(data["image"]), decode_image(data["mask"])
+
+    def multipart_decode():
+        # The server parses the parts and hands PIL a view of each file, as Werkzeug's streams do
+        view = memoryview(multipart_body)
+        return (decode_image(view[image_start:image_start + len(png_image)]),
+                decode_image(view[mask_start:mask_start + len(png_mask)]))
+
+    # Responses: the server has a PIL image, the client needs the encoded file
+    responses = {
+        "json png": (lambda: json.dumps({"result": to_data_uri(encode_image(image))}).encode(),
+                     lambda body: json.loads(body)["result"]),
+        "raw png": (lambda: encode_image(image), lambda body: body),
+        "raw webp": (lambda: encode_image(image, format="WEBP", quality=90), lambda body: body),
+    }
+
+    print(f"{'request':<12} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for name, encode, decode in [("json", json_request, json_decode), ("multipart", multipart_request, multipart_decode)]:
+        encode_time, body = timed(encode, args.repeat)
+        decode_time, _ = timed(decode, args.repeat)
+        print(f"{name:<12} {len(body):>10} {encode_time * 1e3:>10.2f} {decode_time * 1e3:>10.2f}")
+
+    print(f"\n{'response':<12} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for name, (encode, decode) in responses.items():
+        encode_time, body = timed(encode, args.repeat)
+        decode_time, _ = timed(lambda: decode_image(decode(body)), args.repeat)
+        print(f"{name:<12} {len(body):>10} {encode_time * 1e3:>10.2f} {decode_time * 1e3:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import base64
+import io
+from typing import Union
+
+from PIL import Image
+
+# Response formats a client can ask for with the Accept header
+BINARY_FORMATS = {
+    "image/png": "PNG",
+    "image/webp": "WEBP",
+}
+
+ImageSource = Union[str, bytes, bytearray, memoryview, io.IOBase, Image.Image]
+
+
+class _ViewReader(io.RawIOBase):
+    """Read-only file over a memoryview, so PIL can decode a buffer without copying it first"""
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self._view) - self._pos)
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def decode_image(source: ImageSource, mode: str = "RGB") -> Image.Image:
+    """
+    Decode an image from any of the forms it can arrive in.
+
+    Args:
+        source: Base64 string (may include a data URI prefix), raw encoded bytes,
+            a memoryview over them, a binary file object (e.g. an uploaded file's
+            stream) or an already decoded PIL Image
+        mode (str): PIL mode to convert to, None to keep the original
+
+    Returns:
+        PIL.Image.Image: Decoded image
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        if isinstance(source, str):
+            if "base64," in source:
+                source = source.split("base64,")[1]
+            source = io.BytesIO(base64.b64decode(source))
+        elif isinstance(source, bytes):
+            source = io.BytesIO(source)  # shares the bytes object, no copy
+        elif isinstance(source, (bytearray, memoryview)):
+            source = _ViewReader(memoryview(source))
+        image = Image.open(source)
+        image.load()
+
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def encode_image(image: Image.Image, format: str = "PNG", **save_args) -> bytes:
+    """
+    Encode a PIL Image to bytes.
+
+    Args:
+        image (PIL.Image.Image): Image to encode
+        format (str): Image format (PNG, WEBP, JPEG, ...)
+        save_args: Extra arguments for Image.save, e.g. quality or lossless for WEBP
+
+    Returns:
+        bytes: Encoded image
+    """
+    buffered = io.BytesIO()
+    image.save(buffered, format=format, **save_args)
+    return buffered.getvalue()
+
+
+def to_data_uri(data: bytes, format: str = "PNG") -> str:
+    """Base64 data URI of encoded image bytes, the form the JSON API returns"""
+    return f"data:image/{format.lower()};base64,{base64.b64encode(data).decode()}"
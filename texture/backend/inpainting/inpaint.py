@@ -2,48 +2,86 @@ import PIL
 import requests
 import torch
 from io import BytesIO
-from diffusers import StableDiffusionInpaintPipeline, AutoPipelineForInpainting
+import diffusers
+from diffusers import StableDiffusionInpaintPipeline
 import base64
+import logging
 import numpy as np
 import time
 import argparse
 
+from image_io import decode_image, encode_image, to_data_uri
+from mask_processing import MaskParams, MaskProcessor
+from roi import crop_to_roi
+
+logger = logging.getLogger(__name__)
+
 class Inpainter:
-    def __init__(self, model_path="runwayml/stable-diffusion-inpainting", device="cuda"):
+    def __init__(self, model_path="runwayml/stable-diffusion-inpainting", device="cuda", mask_params=MaskParams()):
         """
         Initialize the Inpainter class with a specific model.
         
+        Only the inpainting pipeline is loaded. If another pipeline type is
+        ever needed, build it with ``AutoPipelineFor*.from_pipe(self.pipeline)``
+        so it shares these weights instead of loading a second copy.
+        
         Args:
             model_path (str): Path to the model or model identifier from huggingface.co/models
             device (str): Device to use for inference (cuda, cpu)
+            mask_params (MaskParams): Mask preprocessing, by default the blur of 33 used so far
         """
+        start = time.perf_counter()
         self.device = device
         self.pipeline = StableDiffusionInpaintPipeline.from_pretrained(
             model_path,
             torch_dtype=torch.float16
         )
-        self.blur_pipeline = AutoPipelineForInpainting.from_pretrained("runwayml/stable-diffusion-v1-5", 
-            torch_dtype=torch.float16).to('cuda')
+        self.mask_params = mask_params
+        self.mask_processor = MaskProcessor()
         
         self.pipeline = self.pipeline.to(device)
+        # Scheduler class name -> pipeline sharing self.pipeline's weights
+        self.scheduler_pipelines = {}
+        logger.info(f"Loaded {model_path} on {device} in {time.perf_counter() - start:.1f} seconds")
     
-    def generate(self, prompt, init_image, mask_image, guidance_scale=5, num_inference_steps=150):
+    def generate(self, prompt, init_image, mask_image, guidance_scale=5, num_inference_steps=150, roi=False):
+        """
+        Generate inpainted image based on prompt, initial image and mask.
+        
+        Args:
+            prompt (str): Text prompt to guide the image generation
+            init_image (str): Base64 encoded initial image to inpaint
+            mask_image (str): Base64 encoded mask image where white pixels are the area to inpaint
+            guidance_scale (float): Scale for classifier-free guidance
+            num_inference_steps (int): Number of denoising steps
+            roi (bool): Inpaint only the region around the mask, see generate_image
+            
+        Returns:
+            str: Base64 encoded inpainted image with data URI prefix
+        """
+        output = self.generate_image(prompt, init_image, mask_image, guidance_scale, num_inference_steps, roi)
+        return self.convert_image_to_base64(output)
+
+    def generate_image(self, prompt, init_image, mask_image, guidance_scale=5, num_inference_steps=150, roi=False):
         """
         Generate inpainted image based on prompt, initial image and mask.
         
         Args:
             prompt (str): Text prompt to guide the image generation
-            init_image (PIL.Image.Image): Initial image to inpaint
-            mask_image (PIL.Image.Image): Mask image where white pixels are the area to inpaint
+            init_image: Initial image to inpaint, as a PIL Image, raw encoded bytes or base64 string
+            mask_image: Mask image where white pixels are the area to inpaint, in any form init_image can be
             guidance_scale (float): Scale for classifier-free guidance
             num_inference_steps (int): Number of denoising steps
+            roi (bool): Send only the mask's region (plus context) to the pipeline at the model's
+                native size and blend the result back with a feathered mask. Small objects in
+                large images then cost a 512x512 run instead of a full frame one.
             
         Returns:
             PIL.Image.Image: Generated inpainted image
         """
 
-        init_image = self.convert_base64_to_image(init_image)
-        mask_image = self.convert_base64_to_image(mask_image)
+        init_image = decode_image(init_image)
+        mask_image = decode_image(mask_image)
 
         if not isinstance(init_image, PIL.Image.Image):
             raise TypeError("init_image must be a PIL Image")
@@ -51,31 +89,81 @@ class Inpainter:
         if not isinstance(mask_image, PIL.Image.Image):
             raise TypeError("mask_image must be a PIL Image")
 
-        print(f"Guidance scale: {guidance_scale}")
-        print(f"Num inference steps: {num_inference_steps}")
+        cropped = crop_to_roi(init_image, mask_image) if roi else None
+        if cropped is not None:
+            image_crop, mask_crop, crop = cropped
+            return crop.paste(self.generate_batch([prompt], [image_crop], [mask_crop], guidance_scale,
+                                                  num_inference_steps)[0])
+
+        return self.generate_batch([prompt], [init_image], [mask_image], guidance_scale, num_inference_steps)[0]
+
+    def generate_batch(self, prompts, init_images, mask_images, guidance_scale=5, num_inference_steps=150,
+                       scheduler=None, on_step=None):
+        """
+        Inpaint several images in one pipeline call.
+        
+        Args:
+            prompts (List[str]): Text prompt for each image
+            init_images (List[PIL.Image.Image]): Initial images, all of the same size
+            mask_images (List[PIL.Image.Image]): Mask for each image, white pixels are the area to inpaint
+            guidance_scale (float): Scale for classifier-free guidance
+            num_inference_steps (int): Number of denoising steps
+            scheduler (str): diffusers scheduler class name, None for the pipeline's own
+            on_step (Callable[[int, int], None]): Called with (steps done, total steps) after every denoising step
+            
+        Returns:
+            List[PIL.Image.Image]: Generated inpainted images, in input order
+        """
+        logger.debug(f"Batch size: {len(prompts)}, guidance scale: {guidance_scale}, "
+                     f"num inference steps: {num_inference_steps}, scheduler: {scheduler or 'default'}")
 
         negative_prompt = "deformed, grotesque, surreal, abstract"
 
 
-        with torch.no_grad():
-            blurred_mask = self.blur_pipeline.mask_processor.blur(mask_image, blur_factor=33)
+        blurred_masks = [self.mask_processor.process(mask_image, self.mask_params) for mask_image in mask_images]
+
+        step_callback = None
+        if on_step is not None:
+            def step_callback(pipeline, step, timestep, callback_kwargs):
+                on_step(step + 1, num_inference_steps)
+                return callback_kwargs
 
             
         with torch.no_grad():
             start = time.time()
-            output = self.pipeline(
-                prompt=prompt,
-                image=init_image,
-                negative_prompt = negative_prompt,
-                mask_image=blurred_mask,
+            output = self.pipeline_for(scheduler)(
+                prompt=list(prompts),
+                image=list(init_images),
+                negative_prompt = [negative_prompt] * len(prompts),
+                mask_image=blurred_masks,
                 guidance_scale=guidance_scale,
-                num_inference_steps=num_inference_steps
+                num_inference_steps=num_inference_steps,
+                callback_on_step_end=step_callback
             )
             end = time.time()
             print(f"Time elapsed: {end - start} seconds")
         
-        output = self.convert_image_to_base64(output.images[0])
-        return output
+        return output.images
+
+    def pipeline_for(self, scheduler=None):
+        """
+        The inpainting pipeline running with the given scheduler.
+        
+        Pipelines for other schedulers are built once from this pipeline's
+        components, so they share its weights and cost no extra memory.
+        
+        Args:
+            scheduler (str): diffusers scheduler class name, None for the pipeline's own
+        """
+        if scheduler is None:
+            return self.pipeline
+        pipeline = self.scheduler_pipelines.get(scheduler)
+        if pipeline is None:
+            scheduler_class = getattr(diffusers, scheduler)
+            components = dict(self.pipeline.components)
+            components["scheduler"] = scheduler_class.from_config(self.pipeline.scheduler.config)
+            pipeline = self.scheduler_pipelines[scheduler] = StableDiffusionInpaintPipeline(**components)
+        return pipeline
 
     def convert_base64_to_image(self, base64_string):
         """
@@ -87,18 +175,7 @@ class Inpainter:
         Returns:
             PIL.Image.Image: Decoded image
         """
-        # Remove data URI prefix if present
-        if "base64," in base64_string:
-            base64_string = base64_string.split("base64,")[1]
-        
-        # Decode base64 string
-        image_data = BytesIO(base64.b64decode(base64_string))
-        
-        # Open image
-        image = PIL.Image.open(image_data)
-        image = image.convert("RGB")
-        
-        return image
+        return decode_image(base64_string)
         
     def convert_image_to_base64(self, image, format="PNG"):
         """
@@ -111,10 +188,7 @@ class Inpainter:
         Returns:
             str: Base64 encoded image string with data URI prefix
         """
-        buffered = BytesIO()
-        image.save(buffered, format=format)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return f"data:image/{format.lower()};base64,{img_str}"
+        return to_data_uri(encode_image(image, format=format), format=format)
 
 
 # if __name__ == "__main__":
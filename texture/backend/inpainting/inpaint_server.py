@@ -1,9 +1,17 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, url_for
 import os
+import math
+import queue
 import sys
 import logging
-from typing import Optional, Dict, Any
-from inpaint import Inpainter
+import PIL.Image
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Tuple
+from batcher import InpaintBatcher, InpaintJob
+from image_io import BINARY_FORMATS, decode_image, encode_image, to_data_uri
+from jobs import JobStore
+from quality import TIERS, QualityTier, TierStats, fit_to_tier, get_tier
+from roi import RoiCrop, crop_to_roi
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,51 +22,309 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-inpainter = Inpainter()
+
+def load_inpainter():
+    # INPAINT_BACKEND=stub fills masks with a flat colour on CPU, handy for load tests and local development
+    if os.environ.get("INPAINT_BACKEND", "diffusers") == "stub":
+        from stub_pipeline import StubInpainter
+        return StubInpainter()
+
+    from inpaint import Inpainter
+    return Inpainter()
+
+
+inpainter = load_inpainter()
+batcher = InpaintBatcher(
+    inpainter,
+    max_batch_size=int(os.environ.get("INPAINT_MAX_BATCH_SIZE", "4")),
+    max_wait=float(os.environ.get("INPAINT_BATCH_WAIT_MS", "50")) / 1000.0,
+    max_queue_size=int(os.environ.get("INPAINT_MAX_QUEUE_SIZE", "64")),
+).start()
+REQUEST_TIMEOUT = float(os.environ.get("INPAINT_REQUEST_TIMEOUT", "600"))
+# Tier for requests that do not name one, "final" is the 150 step render every request used to get
+DEFAULT_QUALITY = os.environ.get("INPAINT_DEFAULT_QUALITY", "final")
+# Whether requests that do not say are cropped to their mask's region (see roi.py), off keeps whole-frame inpainting
+DEFAULT_ROI = os.environ.get("INPAINT_ROI", "false").lower() in ("1", "true", "yes")
+tier_stats = TierStats()
+# Jobs submitted to /jobs/inpaint, finished ones are dropped after INPAINT_JOB_TTL seconds
+jobs = JobStore(ttl=float(os.environ.get("INPAINT_JOB_TTL", "3600")))
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"})
 
 
+def read_inpaint_request():
+    """
+    Fields of an inpaint request.
+
+    JSON bodies carry base64 strings in "image" and "mask". multipart/form-data
+    bodies carry the other fields as form fields and "image"/"mask" as files,
+    which are decoded straight from the upload streams.
+
+    Returns:
+        Dict with "prompt", "image", "mask" and any optional parameters, or None if the request has no data
+    """
+    if request.mimetype == "multipart/form-data":
+        if not request.files and not request.form:
+            return None
+        data = request.form.to_dict()
+        for name in ("image", "mask"):
+            if name in request.files:
+                data[name] = request.files[name].stream
+        return data
+
+    return request.get_json(silent=True) or None
+
+
+class InpaintRequestError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class QueuedInpaint:
+    """A batcher job plus what is needed to turn its output into the response"""
+    job: InpaintJob
+    tier: QualityTier
+    original_size: Tuple[int, int]
+    roi: Optional[RoiCrop] = None
+    _result: Optional[PIL.Image.Image] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.job.finished
+
+    @property
+    def finished_at(self) -> Optional[float]:
+        return self.job.finished_at
+
+    def result(self, timeout: Optional[float] = None) -> PIL.Image.Image:
+        """The inpainted image at the request's original size, waiting up to timeout for it"""
+        if self._result is None:
+            result = self.job.wait(timeout)
+            tier_stats.record(self.tier.name, self.job.latency)
+            if self.roi is not None:
+                result = self.roi.paste(result)
+            elif result.size != self.original_size:
+                result = result.resize(self.original_size, PIL.Image.LANCZOS)
+            self._result = result
+        return self._result
+
+
+def submit_inpaint() -> QueuedInpaint:
+    """
+    Validate the inpaint request and queue it on the batcher.
+
+    "quality" picks a tier (preview, standard, final) that sets the scheduler,
+    step count and working resolution; "num_inference_steps" and
+    "guidance_scale" override the tier's values. With "roi" only the region
+    around the mask goes through the pipeline, at the tier's resolution (the
+    model's native 512 for "final"), and is blended back into the image.
+
+    Raises:
+        InpaintRequestError: The request is invalid (400) or the queue is full (503)
+    """
+    data = read_inpaint_request()
+
+    if not data:
+        raise InpaintRequestError("No data provided")
+
+    # Extract parameters from data
+    prompt = data.get("prompt")
+    if not prompt:
+        raise InpaintRequestError("No prompt provided")
+
+    if data.get("image") is None or data.get("mask") is None:
+        raise InpaintRequestError("No image or mask provided")
+
+    try:
+        tier = get_tier(data.get("quality"), DEFAULT_QUALITY)
+    except ValueError as e:
+        raise InpaintRequestError(str(e))
+
+    guidance_scale = _number(data, "guidance_scale", float, tier.guidance_scale)
+    num_inference_steps = _number(data, "num_inference_steps", int, tier.num_inference_steps)
+    if not math.isfinite(guidance_scale):
+        raise InpaintRequestError("guidance_scale must be a finite number")
+    if num_inference_steps < 1:
+        raise InpaintRequestError("num_inference_steps must be at least 1")
+
+    # Decode and resize here, in the request thread, so the batch worker only runs the pipeline
+    try:
+        image = decode_image(data.get("image"))
+        mask = decode_image(data.get("mask"))
+    except (ValueError, OSError, PIL.Image.DecompressionBombError) as e:
+        # binascii.Error is a ValueError, PIL.UnidentifiedImageError an OSError
+        raise InpaintRequestError(f"Invalid image or mask: {str(e)}")
+    original_size = image.size
+    cropped = crop_to_roi(image, mask, tier.resolution) if _flag(data.get("roi"), DEFAULT_ROI) else None
+    if cropped is not None:
+        image, mask, roi = cropped
+    else:
+        image, mask = fit_to_tier(image, mask, tier)
+        roi = None
+
+    # Queue the job, it runs in one pipeline call with other compatible requests
+    try:
+        job = batcher.submit(
+            prompt,
+            image,
+            mask,
+            guidance_scale=guidance_scale,
+            num_inference_steps=num_inference_steps,
+            scheduler=tier.scheduler,
+        )
+    except queue.Full:
+        raise InpaintRequestError("Server is busy, try again later", 503)
+    return QueuedInpaint(job, tier, original_size, roi)
+
+
+def _number(data: Dict[str, Any], name: str, cast, default):
+    """A numeric request field, from JSON or a form field"""
+    value = data.get(name)
+    if value is None:
+        return default
+    try:
+        if cast is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        return cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InpaintRequestError(f"{name} must be a number, got {value!r}")
+
+
+def _flag(value, default: bool) -> bool:
+    """A boolean request field, from JSON or a form field"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def result_response(queued: QueuedInpaint, timeout: Optional[float] = None):
+    """
+    The inpainted image as a response.
+
+    The result comes back as base64 in JSON by default. Clients sending
+    "Accept: image/png" or "Accept: image/webp" get the raw encoded image as
+    the response body instead.
+    """
+    result = queued.result(timeout)
+
+    mimetype = request.accept_mimetypes.best_match(["application/json", *BINARY_FORMATS])
+    if mimetype in BINARY_FORMATS:
+        return Response(encode_image(result, format=BINARY_FORMATS[mimetype]), mimetype=mimetype)
+
+    response = {
+        "status": "success",
+        "message": "Inpainting completed",
+        "quality": queued.tier.name,
+        # Region that went through the pipeline, None for the whole image
+        "roi": list(queued.roi.box) if queued.roi is not None else None,
+        "result": to_data_uri(encode_image(result))
+    }
+
+    return jsonify(response)
+
+
+def job_status(job_id: str, queued: QueuedInpaint) -> Dict[str, Any]:
+    status = {
+        "job_id": job_id,
+        "status": queued.job.status,
+        "progress": queued.job.progress,
+        "quality": queued.tier.name,
+    }
+    if queued.job.error is not None:
+        status["error"] = str(queued.job.error)
+    return status
+
+
 @app.route('/generate_inpaint', methods=['POST'])
 def generate_inpaint():
+    """
+    Inpaint an image, holding the request open until the result is ready.
+
+    Takes the same fields as /jobs/inpaint, long renders should go through that instead.
+    """
     try:
-        # Get the JSON data from the request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        print(data)
-
-        # Extract parameters from data
-        prompt = data.get("prompt")
-        if not prompt:
-            return jsonify({"error": "No prompt provided"}), 400
-        
-        # Extract optional parameters
-        image = data.get("image")
-        mask = data.get("mask")
-        
-        # Call the inpainting function from the LLM model
-        result = inpainter.generate(
-            prompt=prompt,
-            init_image=image,
-            mask_image=mask,
-        )
-        
-        response = {
-            "status": "success",
-            "message": "Inpainting completed",
-            "result": result
-        }
-        
-        return jsonify(response)
-    
+        return result_response(submit_inpaint(), timeout=REQUEST_TIMEOUT)
+
+    except InpaintRequestError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/inpaint', methods=['POST'])
+def submit_inpaint_job():
+    """
+    Queue an inpaint job and return at once with 202 and its id.
+
+    Poll /jobs/<job_id> for status and progress, then fetch /jobs/<job_id>/result.
+    Results are kept for INPAINT_JOB_TTL seconds after the job finished.
+    """
+    try:
+        queued = submit_inpaint()
+    except InpaintRequestError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    job_id = jobs.add(queued)
+    response = jsonify({
+        **job_status(job_id, queued),
+        "status_url": url_for("inpaint_job_status", job_id=job_id),
+        "result_url": url_for("inpaint_job_result", job_id=job_id),
+    })
+    response.headers["Location"] = url_for("inpaint_job_status", job_id=job_id)
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def inpaint_job_status(job_id):
+    queued = jobs.get(job_id)
+    if queued is None:
+        return jsonify({"error": f"Unknown or expired job {job_id}"}), 404
+    return jsonify(job_status(job_id, queued))
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def inpaint_job_result(job_id):
+    """The finished job's result, negotiated like /generate_inpaint. 202 with the job status while it runs."""
+    queued = jobs.get(job_id)
+    if queued is None:
+        return jsonify({"error": f"Unknown or expired job {job_id}"}), 404
+    if not queued.finished:
+        return jsonify(job_status(job_id, queued)), 202
+    if queued.job.error is not None:
+        return jsonify(job_status(job_id, queued)), 500
+    return result_response(queued)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "batcher": batcher.stats.as_dict(),
+        "mask_cache": inpainter.mask_processor.as_dict(),
+        "queue_depth": batcher.queue_depth,
+        "tiers": tier_stats.as_dict(),
+        "jobs": {"stored": len(jobs), "expired": jobs.expired},
+    })
+
+
+@app.route('/quality_tiers', methods=['GET'])
+def quality_tiers():
+    return jsonify({
+        "default": DEFAULT_QUALITY,
+        "tiers": {name: tier.__dict__ for name, tier in TIERS.items()},
+    })
+
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,58 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+class JobStore:
+    """
+    Jobs submitted through the asynchronous API, by id.
+
+    A job stays retrievable until ``ttl`` seconds after it finished, so a
+    client polling for its result has that long to fetch it. Unfinished jobs
+    are never evicted. When more than ``max_jobs`` are stored the oldest
+    finished ones go first, even if their TTL has not run out.
+
+    Args:
+        ttl (float): Seconds a finished job is kept
+        max_jobs (int): Upper bound on stored jobs, finished or not
+        clock (Callable[[], float]): Time source, must match the jobs' finished_at
+    """
+
+    def __init__(self, ttl: float = 3600, max_jobs: int = 1024, clock: Callable[[], float] = time.perf_counter):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.clock = clock
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Any]" = OrderedDict()
+
+    def add(self, job: Any) -> str:
+        """Store a job with ``finished`` and ``finished_at`` attributes and return its new id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Any]:
+        """The job, or None if the id is unknown or has expired"""
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def _evict(self) -> None:
+        now = self.clock()
+        finished = [(job_id, job) for job_id, job in self._jobs.items() if job.finished]
+        overflow = len(self._jobs) - self.max_jobs
+        for job_id, job in sorted(finished, key=lambda item: item[1].finished_at):
+            if overflow <= 0 and now - job.finished_at < self.ttl:
+                break
+            del self._jobs[job_id]
+            self.expired += 1
+            overflow -= 1
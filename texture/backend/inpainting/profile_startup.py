@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Cold-start time and resident memory of the inpainting backend.
+
+Loads the Inpainter the server uses and reports wall time plus the process's
+peak RSS (and CUDA memory when available). --legacy also loads the second
+runwayml/stable-diffusion-v1-5 pipeline the old Inpainter kept around just for
+its mask blur, to measure what dropping it saves.
+
+    python profile_startup.py
+    python profile_startup.py --legacy
+"""
+
+import argparse
+import resource
+import sys
+import time
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile inpainting backend startup")
+    parser.add_argument("--legacy", action="store_true", help="Also load the second pipeline used only for blurring")
+    parser.add_argument("--device", default="cuda")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    import torch
+    from inpaint import Inpainter
+    imported = time.perf_counter()
+
+    inpainter = Inpainter(device=args.device)
+    loaded = time.perf_counter()
+
+    if args.legacy:
+        from diffusers import AutoPipelineForInpainting
+        inpainter.blur_pipeline = AutoPipelineForInpainting.from_pretrained(
+            "runwayml/stable-diffusion-v1-5", torch_dtype=torch.float16).to(args.device)
+    finished = time.perf_counter()
+
+    print(f"imports:           {imported - start:8.1f} s")
+    print(f"inpaint pipeline:  {loaded - imported:8.1f} s")
+    if args.legacy:
+        print(f"blur pipeline:     {finished - loaded:8.1f} s")
+    print(f"total:             {finished - start:8.1f} s")
+    print(f"peak RSS:          {peak_rss_mb():8.0f} MB")
+    if torch.cuda.is_available():
+        print(f"CUDA allocated:    {torch.cuda.memory_allocated() / 2 ** 20:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
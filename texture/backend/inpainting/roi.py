@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from mask_processing import MaskParams, process_mask
+from quality import working_size
+
+Box = Tuple[int, int, int, int]
+
+# Side the model was trained at, a crop smaller than this gets more context rather than being upscaled
+NATIVE_RESOLUTION = 512
+# Blend of the inpainted crop into the original: solid over the mask, softened over a few pixels outside it
+BLEND_PARAMS = MaskParams(dilate=4, blur=8, feather=True)
+
+
+def mask_roi(mask: Image.Image, margin: float = 0.25, min_side: int = NATIVE_RESOLUTION) -> Optional[Box]:
+    """
+    Region of the image worth sending to the pipeline for this mask.
+
+    The mask's bounding box, grown by ``margin`` times its longest side on
+    every side for context, widened to a square of at least ``min_side``
+    pixels where the image allows, and shifted to stay inside the image.
+
+    Args:
+        mask (PIL.Image.Image): Mask where white pixels are the area to inpaint
+        margin (float): Context around the mask, as a fraction of its bounding box's longest side
+        min_side (int): Smallest side of the region
+
+    Returns:
+        (left, top, right, bottom), None for an empty mask
+    """
+    bbox = mask.convert("L").point(lambda value: 255 if value > 127 else 0).getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    width, height = mask.size
+    side = max(right - left, bottom - top)
+    side = max(round(side * (1 + 2 * margin)), min_side)
+
+    def span(low, high, limit):
+        length = min(side, limit)
+        start = (low + high - length) // 2
+        start = min(max(start, 0), limit - length)
+        return start, start + length
+
+    left, right = span(left, right, width)
+    top, bottom = span(top, bottom, height)
+    return left, top, right, bottom
+
+
+@dataclass
+class RoiCrop:
+    """
+    A request cut down to the region around its mask, and what is needed to put the result back.
+
+    Args:
+        image (PIL.Image.Image): The whole original image
+        box (Box): Region sent to the pipeline, in original image pixels
+        blend (PIL.Image.Image): Feathered mask of the region, how much of the result shows through
+    """
+    image: Image.Image
+    box: Box
+    blend: Image.Image
+
+    def paste(self, result: Image.Image) -> Image.Image:
+        """The original image with the inpainted region blended in, at the original size"""
+        left, top, right, bottom = self.box
+        size = (right - left, bottom - top)
+        if result.size != size:
+            result = result.resize(size, Image.LANCZOS)
+        region = Image.composite(result.convert(self.image.mode), self.image.crop(self.box), self.blend)
+        output = self.image.copy()
+        output.paste(region, self.box)
+        return output
+
+
+def crop_to_roi(image: Image.Image, mask: Image.Image, resolution: Optional[int] = NATIVE_RESOLUTION,
+                margin: float = 0.25) -> Optional[Tuple[Image.Image, Image.Image, RoiCrop]]:
+    """
+    Crop a request to its mask's region and scale it to the working resolution.
+
+    Args:
+        image (PIL.Image.Image): Scene to inpaint
+        mask (PIL.Image.Image): Mask where white pixels are the area to inpaint, the size of image
+        resolution (int): Longest side the pipeline works at, None for the model's native size
+        margin (float): Context around the mask, see mask_roi
+
+    Returns:
+        (image crop, mask crop, RoiCrop) with the crops at the working size, or None when
+        the region is the whole image (or the mask is empty) and cropping saves nothing
+    """
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.BILINEAR)
+    resolution = resolution or NATIVE_RESOLUTION
+    box = mask_roi(mask, margin, min_side=resolution)
+    if box is None or box == (0, 0) + image.size:
+        return None
+
+    image_crop, mask_crop = image.crop(box), mask.crop(box)
+    blend = process_mask(mask_crop, BLEND_PARAMS)
+    size = working_size(image_crop.size, resolution)
+    if image_crop.size != size:
+        image_crop = image_crop.resize(size, Image.LANCZOS)
+        mask_crop = mask_crop.resize(size, Image.BILINEAR)
+    return image_crop, mask_crop, RoiCrop(image, box, blend)
@@ -0,0 +1,64 @@
+import hashlib
+import time
+
+from PIL import Image
+
+from image_io import decode_image
+from mask_processing import MaskParams, MaskProcessor
+
+
+class StubInpainter:
+    """Drop-in replacement for Inpainter that needs neither a GPU nor weights.
+
+    The inpainted area is filled with a flat colour derived from the prompt.
+    Costs are simulated with sleeps shaped like a diffusion pipeline: every
+    denoising step has a fixed cost plus a smaller per-image cost, so running
+    several images in one call pays off the same way it does on a GPU.
+
+    Masks go through the same preprocessing as in Inpainter.
+
+    Args:
+        step_ms: Simulated fixed cost of one denoising step
+        image_ms: Simulated extra cost per image in a denoising step
+        mask_params: Mask preprocessing, as in Inpainter
+    """
+
+    def __init__(self, step_ms=2.0, image_ms=0.5, mask_params=MaskParams()):
+        self.step_ms = step_ms
+        self.image_ms = image_ms
+        self.mask_params = mask_params
+        self.mask_processor = MaskProcessor()
+        self.calls = []
+        self.schedulers = []
+
+    def generate_batch(self, prompts, init_images, mask_images, guidance_scale=5, num_inference_steps=150,
+                       scheduler=None, on_step=None):
+        sizes = {image.size for image in init_images}
+        if len(sizes) != 1:
+            raise ValueError(f"A batch needs images of one size, got {sorted(sizes)}")
+        self.calls.append((len(prompts), num_inference_steps))
+        self.schedulers.append(scheduler)
+        if on_step is None:
+            _sleep_ms(num_inference_steps * (self.step_ms + self.image_ms * len(prompts)))
+        else:
+            for step in range(num_inference_steps):
+                _sleep_ms(self.step_ms + self.image_ms * len(prompts))
+                on_step(step + 1, num_inference_steps)
+
+        outputs = []
+        for prompt, init_image, mask_image in zip(prompts, init_images, mask_images):
+            colour = tuple(hashlib.sha256(prompt.encode()).digest()[:3])
+            fill = Image.new("RGB", init_image.size, colour)
+            mask = self.mask_processor.process(mask_image, self.mask_params).resize(init_image.size)
+            outputs.append(Image.composite(fill, init_image, mask))
+        return outputs
+
+    def generate_image(self, prompt, init_image, mask_image, guidance_scale=5, num_inference_steps=150,
+                       scheduler=None):
+        return self.generate_batch([prompt], [decode_image(init_image)], [decode_image(mask_image)],
+                                   guidance_scale, num_inference_steps, scheduler)[0]
+
+
+def _sleep_ms(ms):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the inpaint micro-batcher, run against the stub pipeline.
+
+    python -m pytest test_batcher.py
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent))
+
+from batcher import InpaintBatcher
+from mask_processing import MaskParams
+from stub_pipeline import StubInpainter
+
+
+def scene(size=(64, 64)):
+    return Image.new("RGB", size, (10, 20, 30))
+
+
+def mask(size=(64, 64)):
+    image = Image.new("L", size, 0)
+    image.paste(255, (0, 0, size[0] // 2, size[1]))
+    return image
+
+
+def make_batcher(max_batch_size=4, max_wait=0.2, **kwargs):
+    kwargs.setdefault("step_ms", 0)
+    kwargs.setdefault("image_ms", 0)
+    kwargs.setdefault("mask_params", MaskParams(blur=0))
+    inpainter = StubInpainter(**kwargs)
+    return inpainter, InpaintBatcher(inpainter, max_batch_size=max_batch_size, max_wait=max_wait).start()
+
+
+def test_concurrent_jobs_share_one_pipeline_call():
+    inpainter, batcher = make_batcher(max_batch_size=4)
+    try:
+        jobs = [batcher.submit(f"object {i}", scene(), mask(), num_inference_steps=10) for i in range(4)]
+        results = [job.wait(5) for job in jobs]
+        assert inpainter.calls == [(4, 10)]
+        assert all(job.batch_size == 4 for job in jobs)
+        # Each job gets its own result back: the stub fills the mask with a prompt-specific colour
+        fills = {np.asarray(result)[0, 0].tobytes() for result in results}
+        assert len(fills) == 4
+        assert np.asarray(results[0])[0, -1].tolist() == [10, 20, 30]
+    finally:
+        batcher.stop()
+
+
+def test_incompatible_jobs_are_batched_separately_in_order():
+    inpainter, batcher = make_batcher(max_batch_size=4)
+    try:
+        jobs = [
+            batcher.submit("a", scene(), mask(), num_inference_steps=10),
+            batcher.submit("b", scene((32, 32)), mask((32, 32)), num_inference_steps=10),
+            batcher.submit("c", scene(), mask(), num_inference_steps=20),
+            batcher.submit("d", scene(), mask(), num_inference_steps=10),
+        ]
+        for job in jobs:
+            job.wait(5)
+        assert inpainter.calls == [(2, 10), (1, 10), (1, 20)]
+        assert jobs[1].result.size == (32, 32)
+    finally:
+        batcher.stop()
+
+
+def test_lone_job_waits_at_most_max_wait():
+    inpainter, batcher = make_batcher(max_batch_size=4, max_wait=0.05)
+    try:
+        job = batcher.submit("a", scene(), mask(), num_inference_steps=1)
+        job.wait(5)
+        assert job.batch_size == 1
+        assert job.started_at - job.submitted_at < 0.5
+    finally:
+        batcher.stop()
+
+
+def test_pipeline_error_fails_the_whole_batch():
+    class FailingInpainter(StubInpainter):
+        def generate_batch(self, *args, **kwargs):
+            raise RuntimeError("CUDA out of memory")
+
+    batcher = InpaintBatcher(FailingInpainter(), max_batch_size=2, max_wait=0.2).start()
+    try:
+        jobs = [batcher.submit("a", scene(), mask()), batcher.submit("b", scene(), mask())]
+        for job in jobs:
+            try:
+                job.wait(5)
+                assert False, "expected the batch to fail"
+            except RuntimeError as e:
+                assert "out of memory" in str(e)
+        assert batcher.stats.failed == 2
+    finally:
+        batcher.stop()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for decoding and encoding images across the JSON and binary transports.
+
+    python -m pytest test_image_io.py
+"""
+
+import base64
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent))
+
+from image_io import decode_image, encode_image, to_data_uri
+
+
+def sample_image():
+    pixels = np.random.default_rng(0).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def test_every_source_decodes_to_the_same_pixels():
+    image = sample_image()
+    png = encode_image(image)
+    padded = bytearray(b"xxxx" + png + b"yyyy")
+
+    sources = [
+        png,
+        memoryview(padded)[4:-4],
+        bytearray(png),
+        io.BytesIO(png),
+        base64.b64encode(png).decode(),
+        to_data_uri(png),
+        image,
+    ]
+    for source in sources:
+        assert np.array_equal(np.asarray(decode_image(source)), np.asarray(image))
+
+
+def test_decode_converts_mode():
+    mask = Image.new("L", (8, 8), 255)
+    assert decode_image(encode_image(mask)).mode == "RGB"
+    assert decode_image(encode_image(mask), mode=None).mode == "L"
+
+
+def test_webp_round_trip():
+    data = encode_image(sample_image(), format="WEBP", lossless=True)
+    assert data[:4] == b"RIFF" and data[8:12] == b"WEBP"
+    assert np.array_equal(np.asarray(decode_image(data)), np.asarray(sample_image()))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for the inpaint server endpoints, run against the stub pipeline.
+
+    python -m pytest test_inpaint_server.py
+"""
+
+import io
+import os
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent))
+os.environ["INPAINT_BACKEND"] = "stub"
+
+from image_io import decode_image, encode_image, to_data_uri
+import inpaint_server
+from quality import working_size
+
+SCENE = encode_image(Image.new("RGB", (64, 64), (10, 20, 30)))
+MASK = encode_image(Image.new("L", (64, 64), 255))
+
+
+def client():
+    inpaint_server.inpainter.step_ms = 0
+    inpaint_server.inpainter.image_ms = 0
+    return inpaint_server.app.test_client()
+
+
+def test_json_request_gets_base64_result():
+    response = client().post("/generate_inpaint", json={
+        "prompt": "a chair", "image": to_data_uri(SCENE), "mask": to_data_uri(MASK), "num_inference_steps": 2,
+    })
+    assert response.status_code == 200
+    result = decode_image(response.get_json()["result"])
+    assert np.asarray(result)[0, 0].tolist() != [10, 20, 30]
+
+
+def test_multipart_request_gets_raw_image():
+    response = client().post(
+        "/generate_inpaint",
+        data={"prompt": "a chair", "num_inference_steps": "2",
+              "image": (io.BytesIO(SCENE), "scene.png"), "mask": (io.BytesIO(MASK), "mask.png")},
+        headers={"Accept": "image/webp"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    assert decode_image(response.data).size == (64, 64)
+
+
+def test_missing_fields_are_rejected():
+    assert client().post("/generate_inpaint", json={"image": to_data_uri(SCENE)}).status_code == 400
+    assert client().post("/generate_inpaint", json={"prompt": "a chair"}).status_code == 400
+
+
+def test_stats_report_batches():
+    stats = client().get("/stats").get_json()
+    assert stats["batcher"]["completed"] >= stats["batcher"]["batches"]
+
+
+def test_quality_tier_sets_steps_scheduler_and_resolution():
+    large_scene = encode_image(Image.new("RGB", (1024, 768), (10, 20, 30)))
+    large_mask = encode_image(Image.new("L", (1024, 768), 255))
+    inpainter = inpaint_server.inpainter
+    calls = len(inpainter.calls)
+
+    response = client().post("/generate_inpaint", json={
+        "prompt": "a chair", "image": to_data_uri(large_scene), "mask": to_data_uri(large_mask), "quality": "preview",
+    })
+    assert response.status_code == 200
+    assert response.get_json()["quality"] == "preview"
+    # The pipeline ran at the tier's resolution, the caller gets the original size back
+    assert decode_image(response.get_json()["result"]).size == (1024, 768)
+    assert inpainter.calls[calls:] == [(1, 12)]
+    assert inpainter.schedulers[-1] == "DPMSolverMultistepScheduler"
+    assert "preview" in client().get("/stats").get_json()["tiers"]
+
+
+def test_roi_request_inpaints_only_the_region_around_the_mask():
+    scene = np.zeros((768, 1024, 3), dtype=np.uint8)
+    scene[..., 0] = 200
+    mask = Image.new("L", (1024, 768), 0)
+    mask.paste(255, (600, 300, 640, 340))
+    inpainter = inpaint_server.inpainter
+    calls = len(inpainter.calls)
+
+    response = client().post("/generate_inpaint", json={
+        "prompt": "a chair", "image": to_data_uri(encode_image(Image.fromarray(scene))),
+        "mask": to_data_uri(encode_image(mask)), "num_inference_steps": 2, "roi": True,
+    })
+    assert response.status_code == 200
+    assert response.get_json()["roi"] == [364, 64, 876, 576]
+    assert inpainter.calls[calls:] == [(1, 2)]
+    result = np.asarray(decode_image(response.get_json()["result"]))
+    assert result.shape == scene.shape
+    # Outside the region the original pixels come back as they were
+    assert (result[:64] == scene[:64]).all() and (result[:, 876:] == scene[:, 876:]).all()
+    assert (result[310:330, 610:630] != scene[310:330, 610:630]).any()
+
+
+def test_unknown_quality_is_rejected():
+    response = client().post("/generate_inpaint", json={
+        "prompt": "a chair", "image": to_data_uri(SCENE), "mask": to_data_uri(MASK), "quality": "ultra",
+    })
+    assert response.status_code == 400
+
+
+def test_bad_images_and_parameters_are_rejected_before_queueing():
+    valid = {"prompt": "a chair", "image": to_data_uri(SCENE), "mask": to_data_uri(MASK)}
+    with mock.patch.object(inpaint_server.batcher, "submit") as submit:
+        for fields in ({"image": "not base64!"}, {"mask": "aGVsbG8="},
+                       {"guidance_scale": "high"}, {"guidance_scale": "nan"},
+                       {"num_inference_steps": "many"}, {"num_inference_steps": 2.5}, {"num_inference_steps": 0}):
+            response = client().post("/generate_inpaint", json={**valid, **fields})
+            assert response.status_code == 400, fields
+            assert "error" in response.get_json()
+    submit.assert_not_called()
+
+
+def test_working_size_downscales_to_multiples_of_eight():
+    assert working_size((1024, 768), 384) == (384, 288)
+    assert working_size((1000, 750), 512) == (512, 384)
+    assert working_size((300, 200), 512) == (296, 200)
+    assert working_size((1001, 601), None) == (1000, 600)
+
+
+def test_async_job_reports_progress_and_result():
+    test_client = client()
+    # Slow enough steps to watch the job run
+    inpaint_server.inpainter.step_ms = 5
+    response = test_client.post("/jobs/inpaint", json={
+        "prompt": "a chair", "image": to_data_uri(SCENE), "mask": to_data_uri(MASK), "num_inference_steps": 20,
+    })
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers["Location"] == job["status_url"]
+
+    progress = []
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        status = test_client.get(job["status_url"]).get_json()
+        progress.append(status["progress"])
+        if status["status"] == "succeeded":
+            break
+        assert test_client.get(job["result_url"]).status_code == 202
+        time.sleep(0.01)
+    assert status["status"] == "succeeded"
+    assert progress == sorted(progress) and progress[-1] == 1.0
+
+    result = test_client.get(job["result_url"], headers={"Accept": "image/png"})
+    assert result.status_code == 200
+    assert decode_image(result.data).size == (64, 64)
+
+
+def test_async_job_validation_and_unknown_ids():
+    assert client().post("/jobs/inpaint", json={"prompt": "a chair"}).status_code == 400
+    assert client().get("/jobs/nope").status_code == 404
+    assert client().get("/jobs/nope/result").status_code == 404
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for the asynchronous job store.
+
+    python -m pytest test_jobs.py
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent))
+
+from jobs import JobStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def job(finished_at=None):
+    return SimpleNamespace(finished=finished_at is not None, finished_at=finished_at)
+
+
+def test_finished_jobs_expire_after_ttl():
+    clock = Clock()
+    store = JobStore(ttl=10, clock=clock)
+    running = store.add(job())
+    done = store.add(job(finished_at=0.0))
+
+    clock.now = 9.0
+    assert store.get(done) is not None
+    clock.now = 10.0
+    assert store.get(done) is None
+    # Unfinished jobs never expire
+    clock.now = 1000.0
+    assert store.get(running) is not None
+    assert store.expired == 1
+
+
+def test_overflow_drops_the_oldest_finished_jobs_first():
+    store = JobStore(ttl=100, max_jobs=2, clock=Clock())
+    running = store.add(job())
+    old = store.add(job(finished_at=0.0))
+    new = store.add(job(finished_at=1.0))
+    # The store is over its bound, the running job and the newest result survive
+    assert len(store) == 2
+    assert store.get(old) is None
+    assert store.get(running) is not None and store.get(new) is not None
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for mask preprocessing and its cache.
+
+    python -m pytest test_mask_processing.py
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.append(str(Path(__file__).parent))
+
+from mask_processing import MaskParams, MaskProcessor, dilate_mask, process_mask
+
+
+def object_mask(size=128):
+    mask = np.zeros((size, size), dtype=np.uint8)
+    mask[30:70, 40:90] = 255
+    mask[90:100, 10:20] = 255
+    return Image.fromarray(mask).convert("RGB")
+
+
+def test_default_matches_the_diffusers_blur():
+    # diffusers' mask_processor.blur(mask, blur_factor=33) is a PIL GaussianBlur on the decoded RGB mask
+    mask = object_mask()
+    expected = np.asarray(mask.filter(ImageFilter.GaussianBlur(33)).convert("L"), dtype=int)
+    actual = np.asarray(process_mask(mask, MaskParams()), dtype=int)
+    assert np.abs(actual - expected).max() <= 1
+
+
+def test_dilation_matches_max_filter():
+    mask = np.asarray(object_mask().convert("L"))
+    for radius in (1, 3, 6):
+        expected = np.asarray(Image.fromarray(mask).filter(ImageFilter.MaxFilter(2 * radius + 1)))
+        assert np.array_equal(dilate_mask(mask, radius), expected)
+
+
+def test_feathering_keeps_the_masked_area_solid():
+    mask = object_mask()
+    blurred = np.asarray(process_mask(mask, MaskParams(blur=8)))
+    feathered = np.asarray(process_mask(mask, MaskParams(blur=8, feather=True)))
+    inside = np.asarray(mask.convert("L")) == 255
+    assert blurred[inside].min() < 255
+    assert feathered[inside].min() == 255
+    assert np.array_equal(feathered[~inside], blurred[~inside])
+
+
+def test_cache_is_keyed_by_pixels_and_params():
+    processor = MaskProcessor(max_entries=2)
+    first = processor.process(object_mask(), MaskParams())
+    # A fresh image with the same pixels, in another mode, is a hit
+    assert processor.process(object_mask().convert("L"), MaskParams()) is first
+    assert processor.process(object_mask(), MaskParams(blur=4)) is not first
+    assert processor.as_dict()["hits"] == 1
+    assert processor.as_dict()["misses"] == 2
+
+    processor.process(object_mask(64), MaskParams())
+    assert processor.as_dict()["entries"] == 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for cropping inpaint requests to the region around their mask.
+
+    python -m pytest test_roi.py
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent))
+
+from roi import crop_to_roi, mask_roi
+
+
+def scene(width=1600, height=1200):
+    ys, xs = np.mgrid[0:height, 0:width]
+    pixels = np.stack([xs % 256, ys % 256, (xs + ys) % 256], axis=-1).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def object_mask(box, size=(1600, 1200)):
+    mask = Image.new("L", size, 0)
+    mask.paste(255, box)
+    return mask
+
+
+def test_region_is_a_square_of_at_least_the_native_size_inside_the_image():
+    assert mask_roi(object_mask((700, 500, 740, 560))) == (464, 274, 976, 786)
+    # Large objects get their margin, and the region stops at the image border
+    assert mask_roi(object_mask((0, 100, 600, 500))) == (0, 0, 900, 900)
+    assert mask_roi(object_mask((100, 100, 1500, 1100))) == (0, 0, 1600, 1200)
+    assert mask_roi(Image.new("L", (64, 64), 0)) is None
+
+
+def test_small_object_is_inpainted_at_native_size_and_blended_back():
+    image, mask = scene(), object_mask((700, 500, 740, 560))
+    image_crop, mask_crop, crop = crop_to_roi(image, mask)
+    assert image_crop.size == mask_crop.size == (512, 512)
+
+    result = crop.paste(Image.new("RGB", image_crop.size, (255, 0, 255)))
+    original, pasted = np.asarray(image), np.asarray(result)
+    assert result.size == image.size
+    # The object is replaced, the feathered edge around it is blended, the rest is untouched
+    assert (pasted[500:560, 700:740] == [255, 0, 255]).all()
+    changed = np.argwhere((pasted != original).any(axis=-1))
+    assert changed.min(axis=0).tolist() >= [470, 670] and changed.max(axis=0).tolist() <= [590, 770]
+
+
+def test_large_regions_are_downscaled_to_the_working_resolution():
+    image, mask = scene(), object_mask((200, 200, 1000, 800))
+    image_crop, _, crop = crop_to_roi(image, mask, resolution=384)
+    assert crop.box == (0, 0, 1200, 1200)
+    assert image_crop.size == (384, 384)
+    assert crop.paste(image_crop).size == image.size
+
+
+def test_whole_image_regions_are_not_cropped():
+    image = scene(256, 256)
+    assert crop_to_roi(image, object_mask((10, 10, 30, 30), size=(256, 256))) is None
+    assert crop_to_roi(image, Image.new("L", (256, 256), 0)) is None
@@ -1 +0,0 @@
-from llm import preprocess, generate
\ No newline at end of file
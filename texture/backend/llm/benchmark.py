@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Throughput / tail latency benchmark for the continuous batching scheduler.
+
+Runs the scheduler in-process with either the stub backend (default, CPU only)
+or a small Hugging Face model, and compares batch size 1 (the old one request
+at a time behaviour) against in-flight batching.
+
+    python benchmark.py --clients 16 --requests 64
+    python benchmark.py --backend qwen --model Qwen/Qwen2.5-0.5B-Instruct --device cpu
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from scheduler import ContinuousBatchingScheduler
+
+
+def load_model(args):
+    if args.backend == "stub":
+        from stub_model import StubModel
+        return StubModel(reply_tokens=None, step_ms=args.step_ms, sequence_ms=args.sequence_ms)
+
+    from llm import QwenModel
+    return QwenModel(model_name=args.model, device=args.device, attn_implementation="sdpa")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run(model, max_batch_size, clients, requests_per_client, max_new_tokens):
+    scheduler = ContinuousBatchingScheduler(model, max_batch_size=max_batch_size).start()
+    prompt = [{"role": "system", "content": "You are the riddle master of a guessing game."},
+              {"role": "user", "content": "Give me a riddle about the hidden object."}]
+    input_ids = model.encode(prompt)
+    latencies, tokens = [], []
+    lock = threading.Lock()
+
+    def client():
+        rng = random.Random()
+        for _ in range(requests_per_client):
+            # Mixed completion lengths are what makes in-flight admission matter
+            length = rng.randint(max_new_tokens // 4, max_new_tokens)
+            request = scheduler.submit(input_ids, temperature=0.7, max_new_tokens=length)
+            output = request.wait()
+            with lock:
+                latencies.append(request.latency)
+                tokens.append(len(output))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    scheduler.stop()
+
+    return {
+        "max_batch_size": max_batch_size,
+        "requests": len(latencies),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "tokens_per_s": sum(tokens) / elapsed,
+        "p50_s": statistics.median(latencies),
+        "p99_s": percentile(latencies, 99),
+        "mean_batch": scheduler.stats.as_dict()["mean_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the continuous batching scheduler")
+    parser.add_argument("--backend", choices=["stub", "qwen"], default="stub")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=4, help="Requests per client")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--step-ms", type=float, default=20.0, help="Stub decode step cost")
+    parser.add_argument("--sequence-ms", type=float, default=1.0, help="Stub per-sequence step cost")
+    args = parser.parse_args()
+
+    model = load_model(args)
+    print(f"{'batch':>6} {'reqs':>5} {'req/s':>8} {'tok/s':>9} {'p50 s':>8} {'p99 s':>8} {'mean batch':>11}")
+    for batch_size in args.batch_sizes:
+        result = run(model, batch_size, args.clients, args.requests, args.max_new_tokens)
+        print(f"{result['max_batch_size']:>6} {result['requests']:>5} {result['requests_per_s']:>8.2f} "
+              f"{result['tokens_per_s']:>9.1f} {result['p50_s']:>8.2f} {result['p99_s']:>8.2f} "
+              f"{result['mean_batch']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
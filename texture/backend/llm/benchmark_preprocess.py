@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Per-turn prompt preprocessing cost as the chat history grows.
+
+Compares rendering + tokenizing the full conversation every turn (the old
+QwenModel.preprocess) with IncrementalChatTokenizer, up to the
+CHATBOT_MAX_HISTORY limit the proxy trims to.
+
+    python benchmark_preprocess.py
+    python benchmark_preprocess.py --tokenizer stub
+"""
+
+import argparse
+import os
+import time
+
+from tokenization import IncrementalChatTokenizer
+
+SYSTEM_PROMPT = ("You are the riddle master of a guessing game. These are the objects chair, couch, keyboard, tv. "
+                 "You shouldn't give any exact information about them. Instead, as a part of the game, you may "
+                 "give hints. Some descriptive words. ") * 4
+USER_MESSAGE = "Is it something you sit on in the living room, maybe next to the television?"
+ASSISTANT_MESSAGE = ("Not quite! Think of something with keys that is not a piano, you can find it on a desk and "
+                     "it helps you talk to a computer. Here is your next riddle: I have a screen but no window.")
+
+
+def load_tokenizer(name):
+    if name != "stub":
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(name)
+        except (ImportError, OSError) as e:
+            print(f"Could not load {name} ({e.__class__.__name__}), using the stub tokenizer")
+
+    from stub_model import StubTokenizer
+    return StubTokenizer()
+
+
+def full_encode(tokenizer, messages):
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat prompt preprocessing")
+    parser.add_argument("--tokenizer", default="Qwen/Qwen2.5-32B-Instruct",
+                        help="Hugging Face tokenizer name, or 'stub' for the byte-level stand-in")
+    parser.add_argument("--max-history", type=int, default=int(os.environ.get("CHATBOT_MAX_HISTORY", "20")))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    tokenizer = load_tokenizer(args.tokenizer)
+    chat = IncrementalChatTokenizer(tokenizer)
+    print(f"incremental tokenization: {'on' if chat.incremental else 'off (template not supported)'}")
+    print(f"{'messages':>8} {'tokens':>7} {'full us':>9} {'incremental us':>15}")
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    turn = 0
+    while len(messages) < args.max_history:
+        messages.append({"role": "user", "content": f"{USER_MESSAGE} (guess {turn})"})
+        conversation = f"turn-{turn}"
+        chat.encode(messages[:-1], conversation_id=conversation)  # previous turn, already cached
+
+        full_time, expected = timed(lambda: full_encode(tokenizer, messages), args.repeat)
+        # Cached conversation with only the newest message unseen, like a real follow-up turn
+        incremental_time = 0.0
+        for _ in range(args.repeat):
+            chat.encode(messages[:-1], conversation_id=conversation)
+            start = time.perf_counter()
+            ids = chat.encode(messages, conversation_id=conversation)
+            incremental_time += time.perf_counter() - start
+        incremental_time /= args.repeat
+        assert ids == expected
+
+        print(f"{len(messages):>8} {len(ids):>7} {full_time * 1e6:>9.0f} {incremental_time * 1e6:>15.0f}")
+        messages.append({"role": "assistant", "content": ASSISTANT_MESSAGE})
+        turn += 1
+
+
+if __name__ == "__main__":
+    main()
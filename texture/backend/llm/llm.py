@@ -1,30 +1,56 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, BatchEncoding, DynamicCache
+import logging
+import torch
+import torch.nn.functional as F
 import time
+from prefix_cache import PrefixCache
+from tokenization import IncrementalChatTokenizer
+
+logger = logging.getLogger(__name__)
 
 class QwenModel:
-    def __init__(self, model_name="Qwen/Qwen2.5-32B-Instruct", device="cuda:0"):
+    def __init__(self, model_name="Qwen/Qwen2.5-32B-Instruct", device="cuda:0", attn_implementation="flash_attention_2",
+                 prefix_cache_bytes=0):
         self.model_name = model_name
         self.model = AutoModelForCausalLM.from_pretrained(
             model_name,
             torch_dtype="auto",
             device_map=device,
-            attn_implementation="flash_attention_2",
+            attn_implementation=attn_implementation,
         )
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        
-    def preprocess(self, messages):
+        self.chat_tokenizer = IncrementalChatTokenizer(self.tokenizer)
+
+        generation_config = self.model.generation_config
+        eos = generation_config.eos_token_id
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        self.top_k = generation_config.top_k or 0
+        self.top_p = generation_config.top_p or 1.0
+
+        # KV states of recent prompts, so a follow-up turn only prefills the new messages
+        self.prefix_cache = PrefixCache(prefix_cache_bytes, truncate=_truncate_cache, size_of=_cache_nbytes)
+
+    def preprocess(self, messages, conversation_id=None):
+        input_ids = self.encode(messages, conversation_id)
+        logger.debug(f"Prompt: {len(input_ids)} tokens")
+
+        return BatchEncoding({
+            "input_ids": torch.tensor([input_ids]),
+            "attention_mask": torch.ones((1, len(input_ids)), dtype=torch.long),
+        }).to(self.model.device)
+
+    def encode(self, messages, conversation_id=None):
+        """Render the chat template and return the prompt token ids as a plain list.
+
+        With a conversation_id, messages tokenized on earlier turns are reused.
+        """
+        return self.chat_tokenizer.encode(messages, conversation_id)
+
+    def decode_tokens(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
 
-        messages = [{"role": message['role'], "content": message["content"]} for message in messages]
-        
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        print(f"Text: {text}")
-        
-        return self.tokenizer([text], return_tensors="pt").to(self.model.device)
-        
     def generate(self, messages, temperature, max_new_tokens):
         start = time.time()
         
@@ -41,6 +67,121 @@ class QwenModel:
         ]
         
         end = time.time()
-        print(f"Time elapsed: {end - start} seconds")
+        logger.debug(f"Time elapsed: {end - start} seconds")
         
         return self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+    # Step-wise interface used by scheduler.ContinuousBatchingScheduler.
+    # Every sequence keeps its own KV cache as a tuple of (key, value) per layer,
+    # shaped [1, heads, seq_len, head_dim]. A decode step left-pads the caches to
+    # the longest one, runs the whole batch through one forward pass and slices
+    # the padding back off.
+
+    @torch.no_grad()
+    def prefill(self, request):
+        start = time.time()
+        cached_length, cached = self.prefix_cache.lookup(request.input_ids)
+
+        input_ids = torch.tensor([request.input_ids[cached_length:]], device=self.model.device)
+        output = self.model(
+            input_ids=input_ids,
+            past_key_values=_tuples_to_cache(cached) if cached is not None else None,
+            use_cache=True,
+        )
+        request.cache = _cache_to_tuples(output.past_key_values)
+        token = self._sample(output.logits[:, -1, :], [request.temperature])[0]
+
+        self.prefix_cache.record_prefill(len(request.input_ids) - cached_length, time.time() - start)
+        self.prefix_cache.insert(request.input_ids, request.cache)
+        return token
+
+    def release(self, request):
+        """Called when a sequence is retired: keep its prompt + answer KV for the next turn."""
+        tokens = (request.input_ids + request.output_ids)[:_cache_length(request.cache)]
+        self.prefix_cache.insert(tokens, request.cache)
+
+    @torch.no_grad()
+    def decode(self, requests):
+        device = self.model.device
+        lengths = [_cache_length(request.cache) for request in requests]
+        max_length = max(lengths)
+
+        layers = []
+        for layer in range(len(requests[0].cache)):
+            keys = torch.cat([
+                F.pad(request.cache[layer][0], (0, 0, max_length - length, 0))
+                for request, length in zip(requests, lengths)
+            ])
+            values = torch.cat([
+                F.pad(request.cache[layer][1], (0, 0, max_length - length, 0))
+                for request, length in zip(requests, lengths)
+            ])
+            layers.append((keys, values))
+
+        attention_mask = torch.zeros((len(requests), max_length + 1), dtype=torch.long, device=device)
+        for row, length in enumerate(lengths):
+            attention_mask[row, max_length - length:] = 1
+
+        output = self.model(
+            input_ids=torch.tensor([[request.output_ids[-1]] for request in requests], device=device),
+            attention_mask=attention_mask,
+            position_ids=torch.tensor([[length] for length in lengths], device=device),
+            past_key_values=_tuples_to_cache(layers),
+            use_cache=True,
+        )
+
+        batched = _cache_to_tuples(output.past_key_values)
+        for row, (request, length) in enumerate(zip(requests, lengths)):
+            start = max_length - length
+            request.cache = tuple(
+                (keys[row:row + 1, :, start:], values[row:row + 1, :, start:]) for keys, values in batched
+            )
+
+        return self._sample(output.logits[:, -1, :], [request.temperature for request in requests])
+
+    def _sample(self, logits, temperatures):
+        logits = logits.float()
+        greedy = logits.argmax(dim=-1)
+
+        temperature = torch.tensor(temperatures, dtype=logits.dtype, device=logits.device).clamp(min=1e-5)
+        logits = logits / temperature.unsqueeze(1)
+
+        if self.top_k:
+            kth = torch.topk(logits, min(self.top_k, logits.shape[-1]), dim=-1).values[:, -1:]
+            logits = logits.masked_fill(logits < kth, float("-inf"))
+        if self.top_p < 1.0:
+            sorted_logits, sorted_idx = torch.sort(logits, descending=True, dim=-1)
+            cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+            remove = cumulative - sorted_logits.softmax(dim=-1) > self.top_p
+            logits = logits.masked_fill(torch.zeros_like(remove).scatter(1, sorted_idx, remove), float("-inf"))
+
+        sampled = torch.multinomial(logits.softmax(dim=-1), num_samples=1).squeeze(1)
+        do_sample = torch.tensor([t > 0 for t in temperatures], device=logits.device)
+        return torch.where(do_sample, sampled, greedy).tolist()
+
+
+def _cache_to_tuples(cache):
+    if hasattr(cache, "layers"):
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+    if hasattr(cache, "key_cache"):
+        return tuple(zip(cache.key_cache, cache.value_cache))
+    return tuple(cache)
+
+
+def _tuples_to_cache(layers):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+def _cache_length(cache):
+    return cache[0][0].shape[2]
+
+
+def _truncate_cache(cache, length):
+    # clone so a cached prefix does not pin the (larger) batched tensors it was sliced from
+    return tuple((keys[:, :, :length].clone(), values[:, :, :length].clone()) for keys, values in cache)
+
+
+def _cache_nbytes(cache):
+    return sum(keys.nbytes + values.nbytes for keys, values in cache)
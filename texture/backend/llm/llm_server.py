@@ -1,10 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import json
-from llm import QwenModel
+import os
+import queue
+import wire
+from scheduler import ContinuousBatchingScheduler
+from streaming import TokenStreamer, sse_event
 
 app = Flask(__name__)
 
-llm = QwenModel()
+
+def load_model():
+    prefix_cache_bytes = int(os.environ.get("LLM_PREFIX_CACHE_MB", "2048")) * 1024 * 1024
+
+    # LLM_BACKEND=stub serves canned answers on CPU, handy for load tests and local development
+    backend = os.environ.get("LLM_BACKEND", "qwen")
+    if backend == "stub":
+        from stub_model import StubModel
+        return StubModel(prefix_cache_bytes=prefix_cache_bytes)
+
+    from llm import QwenModel
+    return QwenModel(
+        model_name=os.environ.get("LLM_MODEL_NAME", "Qwen/Qwen2.5-32B-Instruct"),
+        prefix_cache_bytes=prefix_cache_bytes,
+    )
+
+
+llm = load_model()
+scheduler = ContinuousBatchingScheduler(
+    llm,
+    max_batch_size=int(os.environ.get("LLM_MAX_BATCH_SIZE", "8")),
+    max_queue_size=int(os.environ.get("LLM_MAX_QUEUE_SIZE", "256")),
+).start()
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", "75"))
 
 @app.route('/kaan', methods=['GET'])
 def kaan():
@@ -13,10 +40,19 @@ def kaan():
 
 @app.route('/generate_answer', methods=['POST'])
 def generate_answer():
+    """Answer a conversation in one response.
+
+    The request body is JSON, or MessagePack with "Content-Type: application/msgpack".
+    The answer comes back in the best format of the Accept header: compact JSON by
+    default, MessagePack for "Accept: application/msgpack" when msgpack is installed.
+    """
     try:
-        # Get the JSON data from the request
-        data = request.get_json()
-        
+        # Decode the request body in whichever format the client sent it
+        try:
+            data = wire.decode(request.get_data(), request.mimetype)
+        except ValueError:
+            return jsonify({"error": "Malformed request body"}), 400
+
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
@@ -28,24 +64,97 @@ def generate_answer():
         temperature = data.get("temperature", 0.7)
         max_tokens = data.get("max_tokens", 500)
 
-        # Generate answer with the processed messages
-        answer = llm.generate(
-            messages=messages,
-            temperature=temperature,
-            max_new_tokens=max_tokens
-        )
+        # Queue the prompt for the batching decode loop and wait for it to be retired
+        try:
+            generation = scheduler.submit(
+                llm.encode(messages, data.get("conversation_id")),
+                temperature=temperature,
+                max_new_tokens=max_tokens
+            )
+        except queue.Full:
+            return jsonify({"error": "Server is busy, try again later"}), 503
+
+        try:
+            output = generation.wait(timeout=REQUEST_TIMEOUT)
+        except TimeoutError:
+            # Nobody reads the answer after the 504, free its batch slot and KV cache
+            scheduler.cancel(generation)
+            raise
+        answer = llm.decode_tokens(output)
 
         response = {
             "status": "success",
             "message": "Received JSON data",
             "received_data": {"answer": answer},
         }
-        
-        return jsonify(response)
+
+        # Encoded once, compact, jsonify would pretty-print it in debug mode
+        body, mimetype = wire.encode(response, request.accept_mimetypes)
+        return Response(body, mimetype=mimetype)
     
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+@app.route('/generate_answer_stream', methods=['POST'])
+def generate_answer_stream():
+    """Same input as /generate_answer, answers with Server-Sent Events.
+
+    Every text chunk is sent as a `data: {"delta": ...}` message as soon as it
+    is decoded, followed by an `event: done` message carrying the full answer.
+    """
+    data = request.get_json(silent=True)
+
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+
+    if not data.get("messages"):
+        return jsonify({"error": "No messages provided"}), 400
+
+    try:
+        generation = scheduler.submit(
+            llm.encode(data["messages"], data.get("conversation_id")),
+            temperature=data.get("temperature", 0.7),
+            max_new_tokens=data.get("max_tokens", 500),
+            stream=True
+        )
+    except queue.Full:
+        return jsonify({"error": "Server is busy, try again later"}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    def events():
+        streamer = TokenStreamer(llm.decode_tokens)
+        try:
+            for delta in streamer.stream(generation.iter_tokens(timeout=REQUEST_TIMEOUT)):
+                yield sse_event({"delta": delta})
+            yield sse_event({"status": "success", "received_data": {"answer": streamer.text}}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            # Timed out, or the client disconnected and the generator was closed
+            if not generation.finished:
+                scheduler.cancel(generation)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "scheduler": scheduler.stats.as_dict(),
+        "prefix_cache": llm.prefix_cache.as_dict(),
+        "queue_depth": scheduler.queue_depth,
+        "active": scheduler.active_count,
+    })
+
 if __name__ == '__main__':
 
     app.run(host='0.0.0.0', port=8187, debug=True, use_reloader=False)
\ No newline at end of file
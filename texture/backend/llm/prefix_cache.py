@@ -0,0 +1,134 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrefixCacheStats:
+    lookups: int = 0
+    hits: int = 0
+    prompt_tokens: int = 0
+    reused_tokens: int = 0
+    prefill_tokens: int = 0
+    prefill_seconds: float = 0.0
+    prefills: int = 0
+    inserts: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "reused_tokens": self.reused_tokens,
+            "token_reuse_rate": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "prefill_tokens": self.prefill_tokens,
+            "prefill_seconds": self.prefill_seconds,
+            "mean_prefill_ms": 1000 * self.prefill_seconds / self.prefills if self.prefills else 0.0,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+        }
+
+
+class PrefixCache:
+    """LRU cache of KV states keyed by a hash of the token prefix they cover.
+
+    Prefixes are tracked at ``block_size`` boundaries with chained block
+    hashes, so the longest cached prefix of a prompt is found with one pass
+    over its tokens. A follow-up turn of a conversation, whose prompt starts
+    with the previous prompt (system prompt, history), only has to prefill
+    the tokens after the longest hit.
+
+    The cache knows nothing about the state it stores; the model supplies:
+        truncate(state, length) -> state covering only the first ``length`` tokens
+        size_of(state) -> bytes, counted against ``max_bytes``
+
+    Args:
+        max_bytes: Memory budget, least recently used prefixes are evicted past it (0 disables caching)
+        block_size: Granularity of cached prefixes in tokens
+    """
+
+    def __init__(self, max_bytes: int, truncate: Callable[[Any, int], Any], size_of: Callable[[Any], int],
+                 block_size: int = 16):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.truncate = truncate
+        self.size_of = size_of
+        self.stats = PrefixCacheStats()
+        self.bytes = 0
+        self._entries: "OrderedDict[int, Tuple[int, Any, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, token_ids: List[int]) -> Tuple[int, Optional[Any]]:
+        """Return (prefix length, state) of the longest cached prefix, or (0, None).
+
+        At least one token is always left uncached so the caller gets logits for the last position.
+        """
+        self.stats.lookups += 1
+        self.stats.prompt_tokens += len(token_ids)
+
+        hashes = self._block_hashes(token_ids)
+        for blocks in range(len(hashes), 0, -1):
+            length = blocks * self.block_size
+            if length >= len(token_ids):
+                continue
+            entry = self._entries.get(hashes[blocks - 1])
+            if entry is not None and entry[0] == length:
+                self._entries.move_to_end(hashes[blocks - 1])
+                self.stats.hits += 1
+                self.stats.reused_tokens += length
+                return length, entry[1]
+        return 0, None
+
+    def insert(self, token_ids: List[int], state: Any) -> None:
+        """Cache ``state`` (covering ``token_ids``) under its longest block-aligned prefix."""
+        if self.max_bytes <= 0:
+            return
+
+        hashes = self._block_hashes(token_ids)
+        if not hashes:
+            return
+        key = hashes[-1]
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        length = len(hashes) * self.block_size
+        state = self.truncate(state, length)
+        size = self.size_of(state)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (length, state, size)
+        self.bytes += size
+        self.stats.inserts += 1
+        while self.bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats.evictions += 1
+
+    def record_prefill(self, tokens: int, seconds: float) -> None:
+        self.stats.prefills += 1
+        self.stats.prefill_tokens += tokens
+        self.stats.prefill_seconds += seconds
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def as_dict(self) -> dict:
+        return {**self.stats.as_dict(), "entries": len(self._entries), "bytes": self.bytes,
+                "max_bytes": self.max_bytes}
+
+    def _block_hashes(self, token_ids: List[int]) -> List[int]:
+        hashes, previous = [], 0
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            previous = hash((previous, tuple(token_ids[start:start + self.block_size])))
+            hashes.append(previous)
+        return hashes
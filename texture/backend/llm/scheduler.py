@@ -0,0 +1,273 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """Raised to the waiters of a request that was cancelled before it finished"""
+
+
+@dataclass
+class GenerationRequest:
+    """A single prompt travelling through the decode loop.
+
+    The model backend owns ``cache``; the scheduler only keeps it alive for as
+    long as the sequence is active.
+    """
+    input_ids: List[int]
+    temperature: float
+    max_new_tokens: int
+    request_id: int = 0
+    output_ids: List[int] = field(default_factory=list)
+    cache: Any = None
+    error: Optional[BaseException] = None
+    cancelled: bool = False
+    submitted_at: float = field(default_factory=time.perf_counter)
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+    _tokens: Optional["queue.Queue[Optional[int]]"] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+    def wait(self, timeout: Optional[float] = None) -> List[int]:
+        """Block until the sequence is retired and return the generated token ids."""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Request {self.request_id} did not finish within {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.output_ids
+
+    def iter_tokens(self, timeout: Optional[float] = None) -> Iterator[int]:
+        """Yield token ids as the decode loop produces them (request must be submitted with stream=True).
+
+        Args:
+            timeout: Maximum seconds to wait for the next token
+        """
+        if self._tokens is None:
+            raise RuntimeError(f"Request {self.request_id} was not submitted for streaming")
+        while True:
+            try:
+                token = self._tokens.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"Request {self.request_id} produced no token within {timeout} seconds")
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+
+@dataclass
+class SchedulerStats:
+    """Counters exported by the scheduler (read without locking, they are only informative)."""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    steps: int = 0
+    batched_sequences: int = 0
+    generated_tokens: int = 0
+    max_batch_seen: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "steps": self.steps,
+            "generated_tokens": self.generated_tokens,
+            "max_batch_seen": self.max_batch_seen,
+            "mean_batch_size": self.batched_sequences / self.steps if self.steps else 0.0,
+        }
+
+
+class ContinuousBatchingScheduler:
+    """Request queue plus an in-flight batching decode loop in front of a model.
+
+    New sequences are admitted into the running batch between decode steps and
+    finished ones are retired right away, so a long completion never holds a
+    short one hostage and the GPU always decodes as many sequences as it can.
+
+    The model has to provide:
+        eos_token_ids: set of token ids that end a sequence
+        prefill(request) -> int: run the prompt, set ``request.cache`` and return the first token
+        decode(requests) -> List[int]: feed the last token of every request, return the next ones
+        release(request): optional, called with a finished request before its cache is dropped
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_queue_size: int = 256):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.stats = SchedulerStats()
+
+        self._queue: "queue.Queue[GenerationRequest]" = queue.Queue(maxsize=max_queue_size)
+        self._active: List[GenerationRequest] = []
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ContinuousBatchingScheduler":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="decode-loop", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, input_ids: List[int], temperature: float = 0.7, max_new_tokens: int = 500,
+               stream: bool = False) -> GenerationRequest:
+        """Queue a prompt for generation. Raises ``queue.Full`` when the backlog is saturated.
+
+        With ``stream=True`` tokens can be consumed through ``GenerationRequest.iter_tokens``.
+        """
+        request = GenerationRequest(
+            input_ids=list(input_ids),
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            request_id=next(self._ids),
+            _tokens=queue.Queue() if stream else None,
+        )
+        self._queue.put_nowait(request)
+        self.stats.submitted += 1
+        return request
+
+    def generate(self, input_ids: List[int], temperature: float = 0.7, max_new_tokens: int = 500,
+                 timeout: Optional[float] = None) -> List[int]:
+        return self.submit(input_ids, temperature, max_new_tokens).wait(timeout)
+
+    def cancel(self, request: GenerationRequest) -> None:
+        """Stop generating for a request nobody waits for any more (timed out, client gone)
+
+        The decode loop retires it before its next step, freeing its batch slot;
+        its KV cache goes through ``model.release`` like a finished sequence's.
+        Waiters get RequestCancelled. Finished requests are left as they are.
+        """
+        request.cancelled = True
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._admit()
+            if any(request.cancelled for request in self._active):
+                self._active = [request for request in self._active if not self._drop_cancelled(request)]
+            if self._active:
+                self._step()
+        # Fail whatever is left so no caller blocks forever on shutdown
+        for request in self._active:
+            self._retire(request, RuntimeError("Scheduler stopped"))
+        self._active = []
+        while True:
+            try:
+                self._retire(self._queue.get_nowait(), RuntimeError("Scheduler stopped"))
+            except queue.Empty:
+                break
+
+    def _admit(self) -> None:
+        while len(self._active) < self.max_batch_size:
+            try:
+                if self._active:
+                    request = self._queue.get_nowait()
+                else:
+                    # Nothing to decode, park until work arrives
+                    request = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if self._drop_cancelled(request):
+                continue
+
+            try:
+                token = self.model.prefill(request)
+            except Exception as e:
+                logger.exception(f"Prefill failed for request {request.request_id}")
+                self._retire(request, e)
+                continue
+
+            request.first_token_at = time.perf_counter()
+            if not self._append(request, token):
+                self._active.append(request)
+
+    def _step(self) -> None:
+        batch = self._active
+        try:
+            tokens = self.model.decode(batch)
+        except Exception as e:
+            logger.exception(f"Decode step failed for a batch of {len(batch)}")
+            for request in batch:
+                self._retire(request, e)
+            self._active = []
+            return
+
+        self.stats.steps += 1
+        self.stats.batched_sequences += len(batch)
+        self.stats.max_batch_seen = max(self.stats.max_batch_seen, len(batch))
+        self._active = [request for request, token in zip(batch, tokens) if not self._append(request, token)]
+
+    def _append(self, request: GenerationRequest, token: int) -> bool:
+        """Record a sampled token, retiring the request when it is done. Returns True if retired."""
+        if token in self.model.eos_token_ids:
+            self._retire(request)
+            return True
+
+        request.output_ids.append(token)
+        self.stats.generated_tokens += 1
+        if request._tokens is not None:
+            request._tokens.put(token)
+        if len(request.output_ids) >= request.max_new_tokens:
+            self._retire(request)
+            return True
+        return False
+
+    def _drop_cancelled(self, request: GenerationRequest) -> bool:
+        """Retire a cancelled request. Returns True if it was cancelled."""
+        if not request.cancelled:
+            return False
+        self._retire(request, RequestCancelled(f"Request {request.request_id} was cancelled"))
+        return True
+
+    def _retire(self, request: GenerationRequest, error: Optional[BaseException] = None) -> None:
+        released = error is None or isinstance(error, RequestCancelled)
+        if released and request.cache is not None and hasattr(self.model, "release"):
+            try:
+                self.model.release(request)
+            except Exception:
+                logger.exception(f"Releasing request {request.request_id} failed")
+        request.cache = None
+        request.error = error
+        request.finished_at = time.perf_counter()
+        if error is None:
+            self.stats.completed += 1
+        elif isinstance(error, RequestCancelled):
+            self.stats.cancelled += 1
+        else:
+            self.stats.failed += 1
+        request._done.set()
+        if request._tokens is not None:
+            request._tokens.put(None)
@@ -0,0 +1,61 @@
+import json
+from typing import Callable, Iterable, Iterator, List
+
+
+class TokenStreamer:
+    """Incremental detokenizer: turns a stream of token ids into text deltas.
+
+    Decoding token by token breaks multi-byte characters and BPE merges that
+    only make sense together, so each push decodes a small window of recent
+    tokens and emits only the text that became stable.
+
+    Args:
+        decode: Function mapping a list of token ids to text (special tokens skipped)
+    """
+
+    def __init__(self, decode: Callable[[List[int]], str]):
+        self.decode = decode
+        self.tokens: List[int] = []
+        self.text = ""
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def push(self, token: int) -> str:
+        """Add a token and return the newly readable text (may be empty)."""
+        self.tokens.append(token)
+        prefix_text = self.decode(self.tokens[self._prefix_offset:self._read_offset])
+        new_text = self.decode(self.tokens[self._prefix_offset:])
+
+        # A trailing replacement character means a multi-byte character is still incomplete
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+
+        delta = new_text[len(prefix_text):]
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.tokens)
+        self.text += delta
+        return delta
+
+    def flush(self) -> str:
+        """Return whatever text is still held back once the sequence is finished."""
+        prefix_text = self.decode(self.tokens[self._prefix_offset:self._read_offset])
+        new_text = self.decode(self.tokens[self._prefix_offset:])
+        delta = new_text[len(prefix_text):]
+        self._prefix_offset = self._read_offset = len(self.tokens)
+        self.text += delta
+        return delta
+
+    def stream(self, tokens: Iterable[int]) -> Iterator[str]:
+        for token in tokens:
+            delta = self.push(token)
+            if delta:
+                yield delta
+        delta = self.flush()
+        if delta:
+            yield delta
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events message."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
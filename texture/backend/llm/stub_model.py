@@ -0,0 +1,142 @@
+import re
+import time
+
+from prefix_cache import PrefixCache
+from tokenization import IncrementalChatTokenizer
+
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+ENDOFTEXT = "<|endoftext|>"
+
+
+class StubTokenizer:
+    """Byte-level tokenizer with the Qwen ChatML template and special tokens.
+
+    Token ids 0-255 are raw bytes, special tokens sit above them. It is slow in
+    the same way a real tokenizer is (linear in the text) which keeps
+    preprocessing benchmarks honest without downloading a vocabulary.
+    """
+
+    SPECIAL_TOKENS = [IM_START, IM_END, ENDOFTEXT]
+    DEFAULT_SYSTEM_PROMPT = "You are Qwen, created by Alibaba Cloud. You are a helpful assistant."
+
+    def __init__(self):
+        self.special_ids = {token: 256 + i for i, token in enumerate(self.SPECIAL_TOKENS)}
+        self.special_tokens = {i: token for token, i in self.special_ids.items()}
+        self.eos_token_id = self.special_ids[IM_END]
+        self._split = re.compile("(" + "|".join(re.escape(token) for token in self.SPECIAL_TOKENS) + ")")
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = ""
+        if not messages or messages[0]["role"] != "system":
+            text += f"{IM_START}system\n{self.DEFAULT_SYSTEM_PROMPT}{IM_END}\n"
+        for message in messages:
+            text += f"{IM_START}{message['role']}\n{message['content']}{IM_END}\n"
+        if add_generation_prompt:
+            text += f"{IM_START}assistant\n"
+        return self.encode(text) if tokenize else text
+
+    def encode(self, text, add_special_tokens=False):
+        ids = []
+        for part in self._split.split(text):
+            if part in self.special_ids:
+                ids.append(self.special_ids[part])
+            elif part:
+                ids.extend(part.encode("utf-8"))
+        return ids
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        text, pending = "", bytearray()
+        for token in token_ids:
+            if token < 256:
+                pending.append(token)
+                continue
+            text += pending.decode("utf-8", errors="replace")
+            pending.clear()
+            if not skip_special_tokens:
+                text += self.special_tokens[token]
+        return text + pending.decode("utf-8", errors="replace")
+
+
+class StubModel:
+    """Drop-in replacement for QwenModel that needs neither a GPU nor weights.
+
+    Costs are simulated with sleeps shaped like a real decoder: prefill is
+    linear in the prompt length, a decode step has a fixed cost plus a small
+    per-sequence cost, so batching pays off the same way it does on a GPU.
+
+    Args:
+        reply: Text every completion is made of (repeated until max tokens or reply_tokens)
+        reply_tokens: Tokens to emit before the end-of-turn token (None: stop only at max_new_tokens)
+        prefill_ms_per_token: Simulated prompt processing cost
+        step_ms: Simulated fixed cost of one decode step
+        sequence_ms: Simulated extra cost per sequence in a decode step
+        prefix_cache_bytes: Prefix cache budget, the "KV state" is just a token count
+        kv_bytes_per_token: Simulated KV size per token (default is Qwen2.5-32B in bf16)
+    """
+
+    def __init__(self, reply="This is a riddle from the stub model. ", reply_tokens=64,
+                 prefill_ms_per_token=0.02, step_ms=20.0, sequence_ms=1.0,
+                 prefix_cache_bytes=0, kv_bytes_per_token=262144):
+        self.model_name = "stub"
+        self.tokenizer = StubTokenizer()
+        self.chat_tokenizer = IncrementalChatTokenizer(self.tokenizer)
+        self.eos_token_ids = {self.tokenizer.eos_token_id}
+        self.reply_ids = self.tokenizer.encode(reply)
+        self.reply_tokens = reply_tokens
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.step_ms = step_ms
+        self.sequence_ms = sequence_ms
+        self.prefix_cache = PrefixCache(
+            prefix_cache_bytes,
+            truncate=lambda cached_tokens, length: min(cached_tokens, length),
+            size_of=lambda cached_tokens: cached_tokens * kv_bytes_per_token,
+        )
+
+    def encode(self, messages, conversation_id=None):
+        return self.chat_tokenizer.encode(messages, conversation_id)
+
+    def decode_tokens(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    def generate(self, messages, temperature, max_new_tokens):
+        from scheduler import GenerationRequest
+
+        request = GenerationRequest(input_ids=self.encode(messages), temperature=temperature,
+                                    max_new_tokens=max_new_tokens)
+        token = self.prefill(request)
+        while token not in self.eos_token_ids and len(request.output_ids) < max_new_tokens:
+            request.output_ids.append(token)
+            token = self.decode([request])[0]
+        return self.decode_tokens(request.output_ids)
+
+    def prefill(self, request):
+        start = time.perf_counter()
+        cached_length, _ = self.prefix_cache.lookup(request.input_ids)
+        _sleep_ms(self.prefill_ms_per_token * (len(request.input_ids) - cached_length))
+        request.cache = len(request.input_ids)
+        self.prefix_cache.record_prefill(len(request.input_ids) - cached_length, time.perf_counter() - start)
+        self.prefix_cache.insert(request.input_ids, request.cache)
+        return self._next_token(0)
+
+    def release(self, request):
+        tokens = (request.input_ids + request.output_ids)[:request.cache]
+        self.prefix_cache.insert(tokens, request.cache)
+
+    def decode(self, requests):
+        _sleep_ms(self.step_ms + self.sequence_ms * len(requests))
+        tokens = []
+        for request in requests:
+            request.cache += 1
+            tokens.append(self._next_token(len(request.output_ids)))
+        return tokens
+
+    def _next_token(self, position):
+        if self.reply_tokens is not None and position >= self.reply_tokens:
+            return self.tokenizer.eos_token_id
+        return self.reply_ids[position % len(self.reply_ids)]
+
+
+def _sleep_ms(ms):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
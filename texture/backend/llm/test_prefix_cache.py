@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the prefix KV cache, using token counts as the cached "state".
+
+    python -m pytest test_prefix_cache.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from prefix_cache import PrefixCache
+from scheduler import ContinuousBatchingScheduler
+from stub_model import StubModel
+
+
+def make_cache(max_bytes=10_000, block_size=4):
+    return PrefixCache(max_bytes, truncate=lambda state, length: length, size_of=lambda state: state,
+                       block_size=block_size)
+
+
+def test_longest_block_aligned_prefix_hits():
+    cache = make_cache()
+    cache.insert(list(range(10)), 10)
+
+    assert cache.lookup(list(range(20))) == (8, 8)
+    assert cache.lookup([99] + list(range(20))) == (0, None)
+    assert cache.stats.hits == 1 and cache.stats.reused_tokens == 8
+
+
+def test_one_token_is_always_left_to_prefill():
+    cache = make_cache()
+    cache.insert(list(range(8)), 8)
+    assert cache.lookup(list(range(8))) == (0, None)
+    assert cache.lookup(list(range(9))) == (8, 8)
+
+
+def test_lru_eviction_respects_memory_budget():
+    cache = make_cache(max_bytes=20)
+    cache.insert([1] * 8, 8)
+    cache.insert([2] * 8, 8)
+    cache.lookup([1] * 9)  # touch the first prefix
+    cache.insert([3] * 8, 8)
+
+    assert cache.bytes <= 20
+    assert cache.lookup([1] * 9)[0] == 8
+    assert cache.lookup([2] * 9)[0] == 0
+    assert cache.stats.evictions == 1
+
+
+def test_follow_up_turn_only_prefills_new_tokens():
+    model = StubModel(reply="Ok. ", reply_tokens=8, prefill_ms_per_token=0, step_ms=0, sequence_ms=0,
+                      prefix_cache_bytes=10**9, kv_bytes_per_token=1)
+    scheduler = ContinuousBatchingScheduler(model).start()
+    try:
+        conversation = [{"role": "system", "content": "You are the riddle master. " * 20},
+                        {"role": "user", "content": "Give me a riddle"}]
+        first = model.encode(conversation)
+        answer = model.decode_tokens(scheduler.generate(first, timeout=5))
+
+        conversation += [{"role": "assistant", "content": answer}, {"role": "user", "content": "Is it a chair?"}]
+        second = model.encode(conversation)
+        scheduler.generate(second, timeout=5)
+
+        stats = model.prefix_cache.stats
+        assert stats.hits == 1
+        # Everything up to the previous answer is reused, only the tail is prefilled
+        assert stats.prefill_tokens - len(first) < len(second) - len(first) + model.prefix_cache.block_size
+    finally:
+        scheduler.stop()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for the continuous batching scheduler, run against the stub backend.
+
+    python -m pytest test_scheduler.py
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent))
+
+from scheduler import ContinuousBatchingScheduler, RequestCancelled
+from stub_model import StubModel
+
+
+def make_scheduler(max_batch_size=4, **kwargs):
+    kwargs.setdefault("step_ms", 0)
+    kwargs.setdefault("sequence_ms", 0)
+    kwargs.setdefault("prefill_ms_per_token", 0)
+    model = StubModel(**kwargs)
+    return model, ContinuousBatchingScheduler(model, max_batch_size=max_batch_size).start()
+
+
+def test_generates_reply_and_stops_at_eos():
+    model, scheduler = make_scheduler(reply="abc", reply_tokens=5)
+    try:
+        output = scheduler.generate(model.encode([{"role": "user", "content": "hi"}]), max_new_tokens=50, timeout=5)
+        assert model.decode_tokens(output) == "abcab"
+    finally:
+        scheduler.stop()
+
+
+def test_max_new_tokens_caps_output():
+    model, scheduler = make_scheduler(reply_tokens=None)
+    try:
+        assert len(scheduler.generate([1, 2, 3], max_new_tokens=7, timeout=5)) == 7
+    finally:
+        scheduler.stop()
+
+
+def test_concurrent_requests_share_decode_steps():
+    model, scheduler = make_scheduler(max_batch_size=4, reply_tokens=None, step_ms=2)
+    try:
+        requests = [scheduler.submit([1, 2, 3], max_new_tokens=20) for _ in range(8)]
+        outputs = [request.wait(10) for request in requests]
+        assert all(len(output) == 20 for output in outputs)
+        assert scheduler.stats.max_batch_seen == 4
+        # 8 sequences of 20 tokens in batches of 4 need far fewer than 8 * 19 steps
+        assert scheduler.stats.steps < 8 * 19
+    finally:
+        scheduler.stop()
+
+
+def test_new_sequence_joins_running_batch():
+    model, scheduler = make_scheduler(max_batch_size=4, reply_tokens=None, step_ms=2)
+    try:
+        long_request = scheduler.submit([1], max_new_tokens=200)
+        while len(long_request.output_ids) < 10:
+            threading.Event().wait(0.001)
+        short_request = scheduler.submit([1], max_new_tokens=5)
+        short_request.wait(5)
+        # The short one was admitted mid-flight and retired before the long one finished
+        assert not long_request.finished
+        long_request.wait(10)
+        assert scheduler.stats.max_batch_seen == 2
+    finally:
+        scheduler.stop()
+
+
+def test_prefill_error_fails_only_that_request():
+    class FlakyModel(StubModel):
+        def prefill(self, request):
+            if request.input_ids == [666]:
+                raise ValueError("bad prompt")
+            return super().prefill(request)
+
+    model = FlakyModel(step_ms=0, sequence_ms=0, prefill_ms_per_token=0, reply_tokens=3)
+    scheduler = ContinuousBatchingScheduler(model).start()
+    try:
+        bad = scheduler.submit([666])
+        good = scheduler.submit([1])
+        with pytest.raises(ValueError):
+            bad.wait(5)
+        assert len(good.wait(5)) == 3
+        assert scheduler.stats.failed == 1
+    finally:
+        scheduler.stop()
+
+
+def test_stop_fails_pending_requests():
+    model, scheduler = make_scheduler(max_batch_size=1, reply_tokens=None, step_ms=5)
+    request = scheduler.submit([1], max_new_tokens=10_000)
+    scheduler.stop(timeout=5)
+    with pytest.raises(RuntimeError):
+        request.wait(1)
+
+
+def test_streamed_tokens_match_final_output():
+    model, scheduler = make_scheduler(reply="héllo wörld ", reply_tokens=30)
+    try:
+        request = scheduler.submit([1, 2], max_new_tokens=100, stream=True)
+        streamed = list(request.iter_tokens(timeout=5))
+        assert streamed == request.wait(5)
+    finally:
+        scheduler.stop()
+
+
+def test_cancelled_requests_free_their_slot_and_release_their_cache():
+    model, scheduler = make_scheduler(max_batch_size=1, reply_tokens=None, step_ms=1)
+    released = []
+    model.release = lambda request: released.append(request.request_id)
+    try:
+        running = scheduler.submit([1], max_new_tokens=100_000, stream=True)
+        queued = scheduler.submit([1], max_new_tokens=100_000)
+        next(running.iter_tokens(timeout=5))
+        scheduler.cancel(queued)
+        scheduler.cancel(running)
+        with pytest.raises(RequestCancelled):
+            running.wait(5)
+        with pytest.raises(RequestCancelled):
+            queued.wait(5)
+        assert released == [running.request_id]
+        assert len(running.output_ids) < 100_000
+        # The freed slot serves the next request
+        assert len(scheduler.generate([1], max_new_tokens=5, timeout=5)) == 5
+        assert scheduler.stats.cancelled == 2 and scheduler.stats.failed == 0
+    finally:
+        scheduler.stop()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental detokenization used by /generate_answer_stream.
+
+    python -m pytest test_streaming.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from streaming import TokenStreamer, sse_event
+from stub_model import StubTokenizer
+
+
+def test_deltas_rebuild_text_with_multibyte_characters():
+    tokenizer = StubTokenizer()
+    text = "Ünder the tablé sits a 🐈, guess it!"
+    tokens = tokenizer.encode(text) + [tokenizer.eos_token_id]
+
+    streamer = TokenStreamer(tokenizer.decode)
+    deltas = list(streamer.stream(tokens))
+
+    assert "".join(deltas) == text
+    assert streamer.text == text
+    # Partial UTF-8 sequences are held back instead of being emitted as garbage
+    assert not any("\ufffd" in delta for delta in deltas)
+
+
+def test_sse_event_format():
+    assert sse_event({"delta": "hi"}) == 'data: {"delta": "hi"}\n\n'
+    assert sse_event({"a": 1}, event="done") == 'event: done\ndata: {"a": 1}\n\n'
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-conversation incremental chat tokenizer.
+
+    python -m pytest test_tokenization.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from stub_model import StubTokenizer
+from tokenization import IncrementalChatTokenizer
+
+
+class CountingTokenizer(StubTokenizer):
+    def __init__(self):
+        super().__init__()
+        self.encoded_chars = 0
+
+    def encode(self, text, add_special_tokens=False):
+        self.encoded_chars += len(text)
+        return super().encode(text, add_special_tokens)
+
+
+def full_encode(tokenizer, messages):
+    return tokenizer.encode(tokenizer.apply_chat_template(messages, add_generation_prompt=True))
+
+
+def test_matches_full_template_across_turns_and_trimming():
+    tokenizer = StubTokenizer()
+    chat = IncrementalChatTokenizer(tokenizer)
+    messages = [{"role": "system", "content": "You are the riddle master."}]
+
+    for turn in range(12):
+        messages.append({"role": "user", "content": f"Guess number {turn}"})
+        assert chat.encode(messages, conversation_id="42") == full_encode(tokenizer, messages)
+        messages.append({"role": "assistant", "content": f"Riddle number {turn}"})
+        # History is trimmed like ChatBOT does: keep the system prompt and the latest messages
+        messages = messages[:1] + messages[1:][-6:]
+
+
+def test_conversation_without_system_prompt_gets_template_default():
+    tokenizer = StubTokenizer()
+    chat = IncrementalChatTokenizer(tokenizer)
+    messages = [{"role": "user", "content": "Hello"}]
+    assert chat.encode(messages, conversation_id=1) == full_encode(tokenizer, messages)
+
+
+def test_only_new_message_is_encoded():
+    tokenizer = CountingTokenizer()
+    chat = IncrementalChatTokenizer(tokenizer)
+    messages = [{"role": "system", "content": "x" * 5000}, {"role": "user", "content": "first"}]
+    chat.encode(messages, conversation_id="a")
+
+    tokenizer.encoded_chars = 0
+    messages += [{"role": "assistant", "content": "reply"}, {"role": "user", "content": "second"}]
+    chat.encode(messages, conversation_id="a")
+    assert tokenizer.encoded_chars < 100
+
+
+def test_falls_back_when_template_depends_on_position():
+    class NumberingTokenizer(StubTokenizer):
+        def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+            text = "".join(f"[{i}]{m['role']}:{m['content']}\n" for i, m in enumerate(messages))
+            return text + ("assistant:" if add_generation_prompt else "")
+
+    tokenizer = NumberingTokenizer()
+    chat = IncrementalChatTokenizer(tokenizer)
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}]
+    assert not chat.incremental
+    assert chat.encode(messages, conversation_id=1) == full_encode(tokenizer, messages)
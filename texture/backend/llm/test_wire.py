@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for the response formats negotiated by /generate_answer.
+
+    python -m pytest test_wire.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+sys.path.append(str(Path(__file__).parent))
+
+import wire
+
+RESPONSE = {"status": "success", "received_data": {"answer": "Ünder the tablé sits a 🐈"}}
+
+
+def accept(header):
+    return parse_accept_header(header, MIMEAccept)
+
+
+def test_json_is_compact_and_the_default():
+    for header in ("", "*/*", "application/json", "text/html"):
+        body, mimetype = wire.encode(RESPONSE, accept(header))
+        assert mimetype == wire.JSON
+        assert json.loads(body) == RESPONSE
+        assert b"\n" not in body and b": " not in body
+
+
+@pytest.mark.skipif(wire.msgpack is None, reason="msgpack is not installed")
+def test_msgpack_when_the_client_prefers_it():
+    body, mimetype = wire.encode(RESPONSE, accept("application/msgpack, application/json;q=0.5"))
+    assert mimetype == wire.MSGPACK
+    assert wire.decode(body, mimetype) == RESPONSE
+
+
+def test_msgpack_falls_back_to_json_when_not_installed(monkeypatch):
+    monkeypatch.delitem(wire.ENCODERS, wire.MSGPACK, raising=False)
+    body, mimetype = wire.encode(RESPONSE, accept("application/msgpack, application/json;q=0.5"))
+    assert mimetype == wire.JSON
+    assert json.loads(body) == RESPONSE
+
+
+def test_decode_request_bodies():
+    assert wire.decode(b'{"messages": [1]}', "application/json") == {"messages": [1]}
+    assert wire.decode(b"", "application/json") is None
+    assert wire.decode(b"messages=1", "application/x-www-form-urlencoded") is None
+    with pytest.raises(ValueError):
+        wire.decode(b"{not json", "application/json")
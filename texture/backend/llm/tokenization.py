@@ -0,0 +1,112 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalChatTokenizer:
+    """Chat template rendering + tokenization that only encodes what changed.
+
+    Every turn re-sends the whole conversation, but only the last message is
+    new. Each message is rendered on its own (behind a fixed anchor message,
+    so the template does not inject its default system prompt) and its token
+    ids are cached per conversation, keyed by (role, content). A turn then
+    costs one small render + encode, however long the history is.
+
+    On construction the incremental rendering is checked against a full
+    render of a probe conversation; templates that render messages
+    differently depending on their neighbours fall back to full encoding.
+
+    Args:
+        tokenizer: Hugging Face style tokenizer (apply_chat_template, encode)
+        max_conversations: Conversations kept in the LRU
+    """
+
+    _ANCHOR = {"role": "system", "content": ""}
+    _PROBE = [
+        {"role": "system", "content": "You are the riddle master."},
+        {"role": "user", "content": "Give me a riddle!"},
+        {"role": "assistant", "content": "It has four legs but cannot walk."},
+        {"role": "user", "content": "Is it a chair?"},
+    ]
+
+    def __init__(self, tokenizer, max_conversations: int = 256):
+        self.tokenizer = tokenizer
+        self.max_conversations = max_conversations
+        self._conversations: "OrderedDict[str, Dict[Tuple[str, str], List[int]]]" = OrderedDict()
+
+        self._anchor_text = self._render([self._ANCHOR])
+        self._generation_prompt = self._encode(
+            self._render([self._ANCHOR], add_generation_prompt=True)[len(self._anchor_text):]
+        )
+        self.incremental = True
+        try:
+            probe_user = {"role": "user", "content": ""}
+            implicit = self._render([probe_user])
+            segment = self._segment_text(probe_user)
+            if not implicit.endswith(segment):
+                raise ValueError("template renders a lone user message differently")
+            # What the template puts in front of a conversation that has no system message
+            self._implicit_prefix = self._encode(implicit[:len(implicit) - len(segment)])
+
+            if self.encode(self._PROBE, conversation_id=None) != self._encode_full(self._PROBE):
+                raise ValueError("per-message rendering does not match the full template")
+        except ValueError as e:
+            logger.warning(f"Incremental chat tokenization disabled: {e}")
+            self.incremental = False
+
+    def encode(self, messages: List[dict], conversation_id: Optional[str] = None) -> List[int]:
+        """Return the prompt token ids for ``messages`` with the generation prompt appended.
+
+        Args:
+            messages: Chat messages with 'role' and 'content'
+            conversation_id: Key for reusing already tokenized messages (None: no caching)
+        """
+        if not self.incremental:
+            return self._encode_full(messages)
+
+        if conversation_id is None:
+            segments = {}
+        else:
+            segments = self._conversations.pop(str(conversation_id), {})
+
+        ids = [] if messages and messages[0]["role"] == "system" else list(self._implicit_prefix)
+        used = {}
+        for message in messages:
+            key = (message["role"], message["content"])
+            segment = segments.get(key) or used.get(key)
+            if segment is None:
+                segment = self._encode(self._segment_text(message))
+            used[key] = segment
+            ids.extend(segment)
+        ids.extend(self._generation_prompt)
+
+        if conversation_id is not None:
+            # Only keep messages that are still part of the (possibly trimmed) history
+            self._conversations[str(conversation_id)] = used
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        return ids
+
+    def forget(self, conversation_id: str) -> None:
+        self._conversations.pop(str(conversation_id), None)
+
+    def _encode_full(self, messages: List[dict]) -> List[int]:
+        return self._encode(self._render(messages, add_generation_prompt=True))
+
+    def _segment_text(self, message: dict) -> str:
+        text = self._render([self._ANCHOR, {"role": message["role"], "content": message["content"]}])
+        if not text.startswith(self._anchor_text):
+            raise ValueError("template output for a message does not extend the anchor")
+        return text[len(self._anchor_text):]
+
+    def _render(self, messages: List[dict], add_generation_prompt: bool = False) -> str:
+        return self.tokenizer.apply_chat_template(
+            [{"role": message["role"], "content": message["content"]} for message in messages],
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt
+        )
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
@@ -0,0 +1,60 @@
+import json
+from typing import Any, Callable, Dict, Tuple
+
+# orjson and msgpack are optional: without orjson JSON goes through the standard
+# library, without msgpack clients asking for it get JSON instead
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+
+def dumps_json(data: Any) -> bytes:
+    """Compact JSON, never pretty-printed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads_json(body: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# Body formats the server can send and read, JSON first so it wins ties
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {JSON: dumps_json}
+DECODERS: Dict[str, Callable[[bytes], Any]] = {JSON: loads_json}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = msgpack.packb
+    DECODERS[MSGPACK] = msgpack.unpackb
+
+
+def encode(data: Any, accept_mimetypes) -> Tuple[bytes, str]:
+    """The body and mimetype for a response, in the best format the request accepts
+
+    Args:
+        data: What to send
+        accept_mimetypes: The request's parsed Accept header (request.accept_mimetypes)
+
+    Returns:
+        (body, mimetype), JSON if the client accepts nothing this server can send
+    """
+    mimetype = accept_mimetypes.best_match(list(ENCODERS)) or JSON
+    return ENCODERS[mimetype](data), mimetype
+
+
+def decode(body: bytes, mimetype: str) -> Any:
+    """A request body in one of DECODERS' formats, None if it is empty or in an unknown format"""
+    decoder = DECODERS.get(mimetype or JSON)
+    if not body or decoder is None:
+        return None
+    return decoder(body)